@@ -1,10 +1,52 @@
+import json
+import math
 import random
+import time
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from Chess import ChessEngine
+from Chess import ChessBook
+from Chess import ChessEndgame
 
 INFINITY = 200000
 CHECKMATE = 100000
+MATE_THRESHOLD = CHECKMATE - 1000  # scores above are mates found in the search, stored relative to the node in the TT
 STALEMATE = 0
 DEPTH = 2
-MC_PATHS = 1000
+MAX_DEPTH = 64  # iterative deepening limit when searching on a time budget
+MOVES_TO_GO = 30  # expected number of moves left when allocating time from a game clock
+INCREMENT_USAGE = 0.8  # part of the increment spent on each move
+TIME_SAFETY_MARGIN = 0.05  # seconds kept on the clock for the move overhead
+SOFT_TIME_FRACTION = 0.5  # don't start a new iteration once this part of the budget is spent
+TIME_CHECK_NODES = 255  # check the clock every 256 nodes
+HASH_SIZE_MB = 16
+SEARCH_WORKERS = 1  # processes of the root parallel search, 1 searches in the calling process only
+PARALLEL_MIN_DEPTH = 3  # shallower iterations are not worth shipping to the workers
+KILLER_SLOTS = 2  # quiet moves that caused a cut-off, kept per ply
+NULL_MOVE_PRUNING = True  # a node whose reduced search still fails high after passing the turn is cut off
+NULL_MOVE_REDUCTION = 2  # plies taken off the null move search, besides the passed turn
+NULL_MOVE_MIN_DEPTH = 3
+NULL_MOVE_VERIFICATION_DEPTH = 5  # from this depth the null move cut-off is confirmed by a search without null move
+ASPIRATION_MIN_DEPTH = 4  # iterations from this depth on start with a window around the previous score
+ASPIRATION_WINDOW = 50  # half width of the first window, the failing side is widened by twice as much each time
+LATE_MOVE_REDUCTIONS = True  # late quiet moves are searched shallower first, at full depth only if they fail high
+LMR_MIN_DEPTH = 3
+LMR_FULL_DEPTH_MOVES = 3  # moves searched at full depth before the reductions start
+LMR_DEEP_REDUCTION_MOVES = 8  # moves from this one on are reduced by 2 plies instead of 1
+KILLER_ORDER_SCORE = 1 << 30  # killers are tried before the quiet moves ordered by history
+TT_EXACT = 0
+TT_LOWER_BOUND = 1  # fail-high, the score is at least the stored one
+TT_UPPER_BOUND = 2  # fail-low, the score is at most the stored one
+CHECK_INCREMENTAL_SCORE = False  # for debug, compare the incremental score with a full board scan at every leaf
+SEARCH_NEGAMAX = 'negamax'  # iterative deepening alpha-beta
+SEARCH_MCTS = 'mcts'  # Monte Carlo tree search, its cost grows with the number of rollouts instead of the depth
+MC_PATHS = 1000  # rollouts of a Monte Carlo tree search without a time limit
+MCTS_MAX_NODES = 1 << 18  # tree nodes, leaves are no longer expanded once the pool is full
+MCTS_EXPLORATION = 1.4  # UCT exploration constant
+MCTS_ROLLOUT_PLIES = 16  # random plies played from a leaf before the position is scored
+MCTS_CAPTURE_BIAS = 0.5  # probability that a rollout plays one of the captures when there are some
+MCTS_SCORE_SCALE = 400  # score giving the side to move about 91% chances when a rollout ends on a static score
 END_OF_OPENING_PHASE_MOVES = 20
 PIECES_ON_BOARD_FOR_END_GAME = 10
 BASE_VALUES = {'P': 100, 'N': 280, 'B': 320, 'R': 500, 'Q': 900, 'K': 300, '-': 0}
@@ -68,63 +110,713 @@ BUMP_VALUES = {
 }
 
 
-class AIState:
+def build_piece_square_values():
+    # PIECE_SQUARE_VALUES[piece][row * 8 + col]: base value + bump, rows mirrored and sign flipped for black
+    values = {'--': [0] * 64}
+    for piece in ['P', 'N', 'B', 'R', 'Q', 'K']:
+        values['w' + piece] = [BASE_VALUES[piece] + BUMP_VALUES[piece][sq // 8][sq % 8] for sq in range(64)]
+        values['b' + piece] = [-(BASE_VALUES[piece] + BUMP_VALUES[piece][7 - sq // 8][sq % 8]) for sq in range(64)]
+    return values
+
+
+PIECE_SQUARE_VALUES = build_piece_square_values()
+
+
+class TranspositionTable:
+    # Each entry is two 64-bit words: the Zobrist key, and a packed value
+    # score + INFINITY (32 bits) | move id + 1 (16 bits) | depth (8 bits) | bound (2 bits) | generation (6 bits)
+    ENTRY_SIZE_BYTES = 16
+
+    def __init__(self, size_mb=HASH_SIZE_MB):
+        entries = max(1, size_mb * 1024 * 1024 // self.ENTRY_SIZE_BYTES)
+        self.size = 1 << (entries.bit_length() - 1)  # power of 2 so that the index is a simple mask
+        self.mask = self.size - 1
+        self.keys = array('Q', bytes(8 * self.size))
+        self.values = array('q', bytes(8 * self.size))
+        self.generation = 0
+        self.hits = 0
+
+    def clear(self):
+        self.keys = array('Q', bytes(8 * self.size))
+        self.values = array('q', bytes(8 * self.size))
+        self.generation = 0
+        self.hits = 0
+
+    def new_search(self):
+        self.generation = (self.generation + 1) & 0x3F
+
+    def probe(self, key):
+        index = key & self.mask
+        if self.keys[index] != key:
+            return None
+        value = self.values[index]
+        if value == 0:
+            return None
+        self.hits += 1
+        move_id = ((value >> 16) & 0xFFFF) - 1
+        return (value >> 8) & 0xFF, (value >> 6) & 0x3, (value >> 32) - INFINITY, move_id if move_id >= 0 else None
+
+    def store(self, key, depth, bound, score, move_id):
+        assert -INFINITY <= score <= INFINITY, score  # the score field holds 0 .. 2 * INFINITY
+        index = key & self.mask
+        old_value = self.values[index]
+        # replace entries from previous searches, or searched less deep: a quiescence result (depth 0) reached again
+        # by transposition must not erase the deep result of the same position
+        if old_value != 0 and (old_value & 0x3F) == self.generation and ((old_value >> 8) & 0xFF) > depth:
+            return
+        if move_id is None and self.keys[index] == key:
+            move_id = ((old_value >> 16) & 0xFFFF) - 1  # keep the best move found by a previous search
+            move_id = move_id if move_id >= 0 else None
+        self.keys[index] = key
+        self.values[index] = ((score + INFINITY) << 32) | ((0 if move_id is None else move_id + 1) << 16) | \
+            (min(depth, 0xFF) << 8) | (bound << 6) | self.generation
+
+
+def score_to_tt(score, ply):
+    # mate scores are relative to the root in the search, but to the node in the table
+    if score > MATE_THRESHOLD:
+        return score + ply
+    if score < -MATE_THRESHOLD:
+        return score - ply
+    return score
+
+
+def score_from_tt(score, ply):
+    if score > MATE_THRESHOLD:
+        return score - ply
+    if score < -MATE_THRESHOLD:
+        return score + ply
+    return score
+
+
+class SearchStatistics:
+    # Record of one start_search call: totals, including an interrupted last iteration, and a breakdown of every
+    # completed iteration. Scores are seen from the side to move
     def __init__(self):
-        self.best_moves = []
-        self.best_scores = []
+        self.move = None  # UCI notation
+        self.score = 0  # None for a book move, which isn't searched
+        self.book_move = False
+        self.book_weight = 0  # times the book move was played in the games of the book
+        self.depth = 0  # last completed iteration
+        self.stopped = False
+        self.nodes = 0
+        self.quiescence_nodes = 0
+        self.beta_cutoffs = 0  # in the main search, not the quiescence one
+        self.first_move_cutoffs = 0
+        self.tt_hits = 0
+        self.seconds = 0.0
+        self.iterations = []
+
+    def add_iteration(self, depth, move, score, counters, seconds):
+        nodes, quiescence_nodes, beta_cutoffs, first_move_cutoffs, tt_hits = counters
+        self.iterations.append({'depth': depth, 'move': move.get_uci_notation() if move is not None else None,
+                                'score': score, 'nodes': nodes, 'quiescence_nodes': quiescence_nodes,
+                                'beta_cutoffs': beta_cutoffs, 'first_move_cutoffs': first_move_cutoffs,
+                                'tt_hits': tt_hits, 'seconds': seconds})
+
+    def get_first_move_cutoff_rate(self):
+        return self.first_move_cutoffs / self.beta_cutoffs if self.beta_cutoffs else 0.0
+
+    def get_effective_branching_factor(self):
+        # node count growth from the last but one completed iteration to the last one
+        if len(self.iterations) < 2 or self.iterations[-2]['nodes'] == 0:
+            return 0.0
+        return self.iterations[-1]['nodes'] / self.iterations[-2]['nodes']
+
+    def get_nodes_per_second(self):
+        return self.nodes / self.seconds if self.seconds > 0 else 0.0
+
+    def to_dict(self):
+        return {'move': self.move, 'score': self.score, 'book_move': self.book_move, 'book_weight': self.book_weight,
+                'depth': self.depth, 'stopped': self.stopped, 'nodes': self.nodes, 'quiescence_nodes': self.quiescence_nodes,
+                'beta_cutoffs': self.beta_cutoffs, 'first_move_cutoff_rate': self.get_first_move_cutoff_rate(),
+                'tt_hits': self.tt_hits, 'effective_branching_factor': self.get_effective_branching_factor(),
+                'seconds': self.seconds, 'nps': self.get_nodes_per_second(), 'iterations': self.iterations}
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+
+class AIState:
+    def __init__(self, hash_size_mb=HASH_SIZE_MB, workers=SEARCH_WORKERS, seed=None, book_path=None, endgame_path=None,
+                 statistics_path=None, search_mode=SEARCH_NEGAMAX, null_move_pruning=NULL_MOVE_PRUNING,
+                 late_move_reductions=LATE_MOVE_REDUCTIONS):
         self.nodes_count = 0
+        self.quiescence_nodes_count = 0
+        self.beta_cutoffs_count = 0
+        self.first_move_cutoffs_count = 0
+        self.tt_hits_count = 0
+        self.statistics = SearchStatistics()  # of the last search
+        self.statistics_path = statistics_path  # JSON-lines file every search record is appended to
         self.chosen_move = None
         self.chosen_score = 0
+        self.principal_variation = []  # moves of the last completed iteration's best line, chosen move first
+        # triangular PV table: row 'ply' holds the best line found from that ply, in its columns ply to pv_length[ply]
+        self.pv_table = [[None] * (MAX_DEPTH + 2) for _ in range(MAX_DEPTH + 2)]
+        self.pv_length = [0] * (MAX_DEPTH + 2)
         self.depth = DEPTH
-        self.hasConsideredEnPassant = False  # for debug
+        self.root_depth = DEPTH
+        self.search_mode = search_mode
+        self.null_move_pruning = null_move_pruning
+        self.late_move_reductions = late_move_reductions
+        self.mc_paths = MC_PATHS
+        self.completed_depth = 0
+        self.deadline = None
+        self.stopped = False
+        self.stop_requested = False  # set from another thread by stop(), cleared once the search has returned
+        self.transposition_table = TranspositionTable(hash_size_mb)
+        self.killer_moves = [[None] * KILLER_SLOTS for _ in range(MAX_DEPTH + 1)]  # move ids by ply
+        self.history = {piece: [0] * 64 for piece in PIECE_SQUARE_VALUES}  # cut-off bonus by piece & target square
+        self.hash_size_mb = hash_size_mb
+        self.workers = workers
+        self.executor = None
+        # with a seed the move ordering, hence the chosen move, is the same from one run to the other
+        self.seed = seed
+        self.random = random.Random(seed) if seed is not None else random
+        self.book = ChessBook.OpeningBook(book_path) if book_path is not None else None
+        self.endgame_path = endgame_path
+        self.endgame_tables = ChessEndgame.EndgameTables(endgame_path) if endgame_path is not None else None
+
+    def start_search(self, game_state, time_limit=None, remaining_time=None, increment=0.0, on_iteration=None):
+        # Iterative deepening: search at depth 1, 2, ... up to self.depth, or as deep as the time budget allows
+        # when 'time_limit' (seconds for this move) or a game clock ('remaining_time' & 'increment') is given.
+        # on_iteration(depth, score, nodes, seconds) is called after each completed iteration, score from the side
+        # to move. Returns the SearchStatistics of the search
+        self.reset_counters()
+        self.statistics = SearchStatistics()
+        start_time = time.perf_counter()
+        self.chosen_move = None
+        self.chosen_score = 0
+        self.principal_variation = []
+        self.completed_depth = 0
+        self.stopped = False
+        self.transposition_table.new_search()
+        self.new_move_ordering()
 
-    def start_search(self, game_state):
-        self.hasConsideredEnPassant = False  # for debug
+        if self.book is not None and len(game_state.moveLog) <= END_OF_OPENING_PHASE_MOVES:
+            book_move = self.book.choose_move(game_state, self.random)
+            if book_move is not None:
+                self.chosen_move = book_move
+                self.principal_variation = [book_move]
+                self.stop_requested = False
+                self.statistics.book_move = True
+                self.statistics.book_weight = dict(self.book.get_moves(game_state.Zobrist))[book_move.moveID]
+                return self.finish_statistics(start_time)
+
+        use_incremental_score(game_state)
+        if time_limit is None and remaining_time is not None:
+            time_limit = self.allocate_time(remaining_time, increment)
+        self.deadline = None if time_limit is None else start_time + time_limit
+        max_depth = self.depth if time_limit is None else MAX_DEPTH
+        if self.endgame_tables is not None and game_state.pieceCount <= self.endgame_tables.max_pieces and \
+                self.endgame_tables.probe(game_state) is not None:
+            max_depth = 1  # the replies are probed, their scores are exact
+        elif self.search_mode == SEARCH_MCTS:
+            if self.workers > 1:
+                self.parallel_mcts_search(game_state)
+            else:
+                self.mcts_search(game_state, self.mc_paths)
+            self.principal_variation = [self.chosen_move] if self.chosen_move is not None else []
+            self.deadline = None
+            self.stop_requested = False
+            self.statistics.stopped = self.stopped
+            return self.finish_statistics(start_time)
+
+        completed_move, completed_score = None, 0
+        for depth in range(1, max_depth + 1):
+            self.root_depth = depth
+            iteration_counters = self.get_counters()
+            iteration_start_time = time.perf_counter()
+            self.aspiration_search(game_state, depth, completed_score)
+            if self.stopped:
+                break
+            completed_move, completed_score = self.chosen_move, self.chosen_score
+            if self.pv_length[0] > 0 and self.pv_table[0][0] is completed_move:
+                self.principal_variation = self.pv_table[0][:self.pv_length[0]]
+            else:
+                self.principal_variation = [completed_move] if completed_move is not None else []
+            self.completed_depth = depth
+            self.statistics.add_iteration(depth, completed_move, completed_score,
+                                          [count - iteration_count for count, iteration_count
+                                           in zip(self.get_counters(), iteration_counters)],
+                                          time.perf_counter() - iteration_start_time)
+            if on_iteration is not None:
+                on_iteration(depth, completed_score, self.nodes_count, time.perf_counter() - start_time)
+            if completed_move is None or abs(completed_score) > MATE_THRESHOLD:
+                break
+            if time_limit is not None and time.perf_counter() - start_time >= time_limit * SOFT_TIME_FRACTION:
+                break
+
+        # an interrupted iteration is discarded, the last completed one is kept
+        self.chosen_move, self.chosen_score = completed_move, completed_score
+        self.deadline = None
+        self.stop_requested = False
+        self.statistics.stopped = self.stopped
+        return self.finish_statistics(start_time)
+
+    def finish_statistics(self, start_time):
+        statistics = self.statistics
+        statistics.move = self.chosen_move.get_uci_notation() if self.chosen_move is not None else None
+        statistics.score = None if statistics.book_move else self.chosen_score
+        statistics.depth = self.completed_depth
+        statistics.nodes, statistics.quiescence_nodes, statistics.beta_cutoffs, statistics.first_move_cutoffs, \
+            statistics.tt_hits = self.get_counters()
+        statistics.seconds = time.perf_counter() - start_time
+        if self.statistics_path is not None:
+            with open(self.statistics_path, 'a', encoding='utf-8') as statistics_file:
+                statistics_file.write(statistics.to_json() + '\n')
+        return statistics
+
+    def reset_counters(self):
         self.nodes_count = 0
-        best_score = self.negamax_pruning_move(game_state, self.depth, -INFINITY, INFINITY)
-        direction = 1 if game_state.whiteToMove else -1
-        print(f"{self.nodes_count} nodes computed")
-        return best_score * direction
+        self.quiescence_nodes_count = 0
+        self.beta_cutoffs_count = 0
+        self.first_move_cutoffs_count = 0
+        self.tt_hits_count = 0
 
-    def negamax_pruning_move(self, game_state, depth, alpha, beta):
-        if depth == 0:
+    def get_counters(self):
+        return (self.nodes_count, self.quiescence_nodes_count, self.beta_cutoffs_count, self.first_move_cutoffs_count,
+                self.tt_hits_count)
+
+    def add_counters(self, counters):
+        nodes, quiescence_nodes, beta_cutoffs, first_move_cutoffs, tt_hits = counters
+        self.nodes_count += nodes
+        self.quiescence_nodes_count += quiescence_nodes
+        self.beta_cutoffs_count += beta_cutoffs
+        self.first_move_cutoffs_count += first_move_cutoffs
+        self.tt_hits_count += tt_hits
+
+    def probe_endgame_tables(self, game_state, ply):
+        # exact score of the position when it is in the endgame tables, None otherwise
+        if self.endgame_tables is None or game_state.pieceCount > self.endgame_tables.max_pieces:
+            return None
+        result = self.endgame_tables.probe(game_state)
+        if result is None:
+            return None
+        outcome, plies = result
+        return outcome * (CHECKMATE - ply - plies)
+
+    def aspiration_search(self, game_state, depth, previous_score):
+        # Searches the root within a window around the previous iteration's score, the side the score falls out of
+        # is widened until the score falls inside. Returns the score, 0 when stopped
+        window = ASPIRATION_WINDOW
+        if depth >= ASPIRATION_MIN_DEPTH and abs(previous_score) < MATE_THRESHOLD:
+            alpha, beta = previous_score - window, previous_score + window
+        else:
+            alpha, beta = -INFINITY, INFINITY
+        while True:
+            if self.workers > 1 and depth >= PARALLEL_MIN_DEPTH:
+                score = self.parallel_root_search(game_state, depth, alpha, beta)
+            else:
+                score = self.negamax_pruning_move(game_state, depth, alpha, beta)
+            if self.stopped:
+                return 0
+            if score <= alpha and alpha > -INFINITY:
+                alpha = max(score - window, -INFINITY)
+            elif score >= beta and beta < INFINITY:
+                beta = min(score + window, INFINITY)
+            else:
+                return score
+            window *= 2
+
+    def parallel_root_search(self, game_state, depth, alpha, beta):
+        # Root splitting: the first (principal) move is searched here to get a bound, the other root moves are then
+        # searched by the worker processes & merged back in root order, which keeps the result independent of the
+        # order the workers finish in. Only as many moves as there are workers are in flight: the next one is handed
+        # out once the oldest is merged, against the alpha raised by the moves merged so far. Returns the score, 0
+        # when stopped
+        valid_moves = game_state.get_valid_moves()
+        if game_state.isCheckMate or game_state.isStaleMate:
+            return self.negamax_pruning_move(game_state, depth, alpha, beta)
+        tt_entry = self.transposition_table.probe(game_state.Zobrist)
+        valid_moves = self.order_by_candidate_moves(valid_moves, depth)
+        valid_moves = self.order_hash_move_first(valid_moves, tt_entry[3] if tt_entry is not None else None)
+        alpha_original = alpha
+        self.pv_length[0] = 0
+
+        best_move = valid_moves[0]
+        game_state.make_move(best_move)
+        best_score = -1 * self.negamax_pruning_move(game_state, depth - 1, -beta, -alpha, 1)
+        game_state.undo_move()
+        self.nodes_count += 1
+        if self.stopped:
+            return 0
+        self.update_root_best_move(best_move, best_score)
+        if best_score > alpha:
+            self.update_principal_variation(best_move, 0)
+            alpha = best_score
+
+        if alpha < beta:
+            executor = self.get_executor()
+            fen = game_state.get_fen_from_board()
+            remaining_moves = iter(valid_moves[1:])
+            in_flight = deque()  # (move, alpha it is searched against, future) in root order
+            while True:
+                while len(in_flight) < self.workers:
+                    move = next(remaining_moves, None)
+                    if move is None:
+                        break
+                    time_left = None if self.deadline is None else self.deadline - time.perf_counter()
+                    in_flight.append((move, alpha, executor.submit(
+                        search_root_move, type(game_state), fen, move.moveID, depth, alpha, beta, time_left,
+                        self.seed is not None, self.null_move_pruning, self.late_move_reductions)))
+                if not in_flight:
+                    break
+
+                move, bound, future = in_flight.popleft()
+                new_score, counters, stopped, variation = future.result()
+                self.add_counters(counters)
+                self.nodes_count += 1
+                if stopped:
+                    self.stopped = True
+                    for _, _, other_future in in_flight:
+                        other_future.cancel()
+                    return 0
+                if new_score > bound and new_score > best_score:  # scores not above the bound are only upper bounds
+                    best_score = new_score
+                    best_move = move
+                    self.update_root_best_move(move, new_score)
+                    self.pv_table[0][0] = move
+                    self.pv_table[0][1:1 + len(variation)] = variation
+                    self.pv_length[0] = 1 + len(variation)
+                    if new_score >= beta:
+                        for _, _, other_future in in_flight:
+                            other_future.cancel()
+                        break
+                    alpha = max(alpha, new_score)
+
+        if best_score <= alpha_original:
+            tt_bound = TT_UPPER_BOUND
+        elif best_score >= beta:
+            tt_bound = TT_LOWER_BOUND
+        else:
+            tt_bound = TT_EXACT
+        self.transposition_table.store(game_state.Zobrist, depth, tt_bound, score_to_tt(best_score, 0),
+                                       best_move.moveID)
+        return best_score
+
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_search_worker,
+                                                initargs=(self.hash_size_mb, self.endgame_path))
+        return self.executor
+
+    def mcts_search(self, game_state, rollouts):
+        # UCT search of up to 'rollouts' rollouts, or until the deadline or a stop request when there is a time limit.
+        # The tree is kept in flat arrays indexed by node, the children of a node being contiguous: the move leading
+        # to the node, its visits, the results of these visits for the side that played the move, and its first
+        # child, 0 while the node is not expanded & -1 when the game is over there. Returns the root children as
+        # {move id: (visits, results)} & sets the chosen move & score
+        first_children = array('i', bytes(4 * MCTS_MAX_NODES))
+        children_counts = array('H', bytes(2 * MCTS_MAX_NODES))
+        move_ids = array('H', bytes(2 * MCTS_MAX_NODES))
+        visits = array('I', bytes(4 * MCTS_MAX_NODES))
+        results = array('d', bytes(8 * MCTS_MAX_NODES))
+        node_count = 1  # the root
+
+        root_moves = game_state.get_valid_moves()
+        if not root_moves:
+            return {}
+        rollout = 0
+        while rollout < rollouts or self.deadline is not None:
+            if self.stop_requested:
+                self.stopped = True
+                break
+            if self.deadline is not None and time.perf_counter() >= self.deadline:
+                break
+            rollout += 1
+
+            # selection, down to a node not expanded yet
+            path = [0]
+            node = 0
+            while first_children[node] > 0:
+                parent_log = math.log(visits[node])
+                best_uct = -1.0
+                first_child = first_children[node]
+                for child in range(first_child, first_child + children_counts[node]):
+                    if visits[child] == 0:
+                        node = child
+                        break
+                    uct = results[child] / visits[child] + \
+                        MCTS_EXPLORATION * math.sqrt(parent_log / visits[child])
+                    if uct > best_uct:
+                        best_uct = uct
+                        node = child
+                game_state.make_move(find_move(game_state, move_ids[node]))
+                self.nodes_count += 1
+                path.append(node)
+
+            # expansion, once a leaf has been visited, then a rollout from the leaf or from its first child
+            if first_children[node] == 0 and (visits[node] > 0 or node == 0):
+                moves = game_state.get_valid_moves()
+                if not moves or game_state.isStaleMate:
+                    first_children[node] = -1
+                elif node_count + len(moves) <= MCTS_MAX_NODES:
+                    first_children[node] = node_count
+                    children_counts[node] = len(moves)
+                    for i, move in enumerate(moves):
+                        move_ids[node_count + i] = move.moveID
+                    node_count += len(moves)
+                    node = first_children[node]
+                    game_state.make_move(moves[0])
+                    self.nodes_count += 1
+                    path.append(node)
+            result = self.mcts_rollout(game_state)
+
+            # back-propagation, 'result' is for the side to move at the leaf, i.e. not the one who played into it
+            for node in reversed(path):
+                result = 1.0 - result
+                visits[node] += 1
+                results[node] += result
+            for _ in range(len(path) - 1):
+                game_state.undo_move()
+
+        root_children = {}
+        first_child = first_children[0]
+        for child in range(first_child, first_child + children_counts[0]) if first_child > 0 else ():
+            root_children[move_ids[child]] = (visits[child], results[child])
+        self.choose_mcts_move(game_state, root_moves, root_children)
+        return root_children
+
+    def mcts_rollout(self, game_state):
+        # plays random moves, captures first with a probability, and returns the outcome for the side to move at the
+        # start: 1 for a win, 0 for a loss, 0.5 for a draw, or the chances given by the static score
+        plies = 0
+        outcome = None
+        while True:
+            moves = game_state.get_valid_moves()
+            if not moves:
+                outcome = 0.0 if game_state.is_in_check() else 0.5  # for the side to move there
+                break
+            if game_state.isStaleMate:  # move rule
+                outcome = 0.5
+                break
+            if plies == MCTS_ROLLOUT_PLIES:
+                direction = 1 if game_state.whiteToMove else -1
+                outcome = 1.0 / (1.0 + 10.0 ** (-self.score_board(game_state, direction) / MCTS_SCORE_SCALE))
+                break
+            captures = [move for move in moves if move.pieceCaptured != "--"]
+            if captures and self.random.random() < MCTS_CAPTURE_BIAS:
+                moves = captures
+            game_state.make_move(moves[self.random.randrange(len(moves))])
+            self.nodes_count += 1
+            plies += 1
+        for _ in range(plies):
+            game_state.undo_move()
+        game_state.isCheckMate = game_state.isStaleMate = False
+        return outcome if plies % 2 == 0 else 1.0 - outcome
+
+    def choose_mcts_move(self, game_state, root_moves, root_children):
+        # most visited root move, its score being its results' rate turned back into a score
+        self.chosen_move = root_moves[0]
+        self.chosen_score = 0
+        best_visits = 0
+        for move in root_moves:
+            move_visits, move_results = root_children.get(move.moveID, (0, 0.0))
+            if move_visits > best_visits:
+                best_visits = move_visits
+                self.chosen_move = move
+                rate = min(max(move_results / move_visits, 0.001), 0.999)
+                self.chosen_score = round(MCTS_SCORE_SCALE * math.log10(rate / (1.0 - rate)))
+
+    def parallel_mcts_search(self, game_state):
+        # root parallelization: every worker grows its own tree from the position with its share of the rollouts,
+        # the visits & results of the root moves are then summed
+        root_moves = game_state.get_valid_moves()
+        if not root_moves:
+            return
+        executor = self.get_executor()
+        fen = game_state.get_fen_from_board()
+        time_left = None if self.deadline is None else self.deadline - time.perf_counter()
+        futures = [executor.submit(mcts_search_worker, type(game_state), fen,
+                                   self.mc_paths // self.workers + (worker < self.mc_paths % self.workers), time_left,
+                                   None if self.seed is None else self.seed + worker)
+                   for worker in range(self.workers)]
+        root_children = {}
+        for future in futures:
+            worker_children, nodes_count, stopped = future.result()
+            self.nodes_count += nodes_count
+            self.stopped = self.stopped or stopped
+            for move_id, (move_visits, move_results) in worker_children.items():
+                total_visits, total_results = root_children.get(move_id, (0, 0.0))
+                root_children[move_id] = (total_visits + move_visits, total_results + move_results)
+        self.choose_mcts_move(game_state, root_moves, root_children)
+
+    def update_root_best_move(self, move, score):
+        self.chosen_move = move
+        self.chosen_score = score
+
+    def update_principal_variation(self, move, ply):
+        # the best line from 'ply' becomes 'move' followed by the best line found after it
+        pv_row = self.pv_table[ply]
+        child_length = self.pv_length[ply + 1]
+        pv_row[ply] = move
+        pv_row[ply + 1:child_length] = self.pv_table[ply + 1][ply + 1:child_length]
+        self.pv_length[ply] = child_length
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+        if self.book is not None:
+            self.book.close()
+            self.book = None
+        if self.endgame_tables is not None:
+            self.endgame_tables.close()
+            self.endgame_tables = None
+
+    @staticmethod
+    def allocate_time(remaining_time, increment=0.0, moves_to_go=MOVES_TO_GO):
+        budget = remaining_time / moves_to_go + increment * INCREMENT_USAGE
+        return max(0.0, min(budget, remaining_time - TIME_SAFETY_MARGIN))
+
+    def is_time_up(self):
+        # the first iteration always completes so that there is a move to play
+        if self.root_depth > 1 and (self.nodes_count & TIME_CHECK_NODES) == 0:
+            if self.stop_requested or (self.deadline is not None and time.perf_counter() >= self.deadline):
+                self.stopped = True
+        return self.stopped
+
+    def stop(self):
+        # asks the running search to return, the next time it checks the clock, with its last completed iteration
+        self.stop_requested = True
+
+    def get_principal_variation(self, max_length=MAX_DEPTH):
+        return self.principal_variation[:max_length]
+
+    def negamax_pruning_move(self, game_state, depth, alpha, beta, ply=0, allow_null_move=True):
+        # 'ply' counts the moves from the root, reductions make it differ from root_depth - depth
+        self.pv_length[ply] = ply
+        if self.is_time_up():
+            return 0
+        if ply > 0 and self.endgame_tables is not None:
+            endgame_score = self.probe_endgame_tables(game_state, ply)
+            if endgame_score is not None:
+                return endgame_score
+        if depth <= 0:
             return self.quiescence_move(game_state, alpha, beta)
         else:
-            valid_moves = game_state.get_valid_moves()
-            valid_moves = self.order_by_candidate_moves(valid_moves, depth)
-            if game_state.isCheckMate or game_state.isStaleMate:
-                return self.quiescence_move(game_state, alpha, beta)
+            alpha_original = alpha
+            hash_move_id = None
+            tt_entry = self.transposition_table.probe(game_state.Zobrist)
+            if tt_entry is not None:
+                self.tt_hits_count += 1
+                tt_depth, tt_bound, tt_score, hash_move_id = tt_entry
+                if ply > 0 and tt_depth >= depth and beta - alpha == 1:  # no cut-off in a PV node, to keep its line
+                    tt_score = score_from_tt(tt_score, ply)
+                    if tt_bound == TT_EXACT or \
+                            (tt_bound == TT_LOWER_BOUND and tt_score >= beta) or \
+                            (tt_bound == TT_UPPER_BOUND and tt_score <= alpha):
+                        return tt_score
+
+            if ply == 0:
+                valid_moves = game_state.get_valid_moves()
+                if game_state.isCheckMate:
+                    return -CHECKMATE + ply
+                if game_state.isStaleMate:
+                    return STALEMATE
+                valid_moves = self.order_by_candidate_moves(valid_moves, depth)
+                valid_moves = self.order_hash_move_first(valid_moves, hash_move_id)
+            else:
+                if game_state.moveRuleLog[-1] >= ChessEngine.MOVES_TILL_STALEMATE and game_state.has_any_legal_move():
+                    return STALEMATE
+                in_check = game_state.is_in_check()
+                if self.null_move_pruning and allow_null_move and not in_check and depth >= NULL_MOVE_MIN_DEPTH and \
+                        abs(beta) < MATE_THRESHOLD and game_state.moveLog[-1] is not ChessEngine.NULL_MOVE and \
+                        game_state.has_non_pawn_material() and \
+                        self.score_board(game_state, 1 if game_state.whiteToMove else -1) >= beta:
+                    # passing the turn is assumed to be worse than the best move, unless in zugzwang, which is why
+                    # the pawn endgames are left out
+                    game_state.make_null_move()
+                    null_score = -1 * self.negamax_pruning_move(game_state, depth - 1 - NULL_MOVE_REDUCTION, -beta,
+                                                                -beta + 1, ply + 1)
+                    game_state.undo_null_move()
+                    self.nodes_count += 1
+                    if self.stopped:
+                        return 0
+                    if null_score >= beta:
+                        null_score = min(null_score, MATE_THRESHOLD - 1)  # a mate after passing is not proven
+                        if depth < NULL_MOVE_VERIFICATION_DEPTH:
+                            return null_score
+                        verification_score = self.negamax_pruning_move(game_state, depth - NULL_MOVE_REDUCTION,
+                                                                       beta - 1, beta, ply, allow_null_move=False)
+                        if self.stopped:
+                            return 0
+                        if verification_score >= beta:
+                            return null_score
+                        self.pv_length[ply] = ply
+                # below the root the moves are generated lazily, hash move first, then captures by MVV-LVA, then
+                # killers & quiet moves by history
+                killers = self.killer_moves[ply]
+                valid_moves = game_state.generate_moves_staged(
+                    hash_move_id, self.capture_order_score,
+                    lambda quiet_move: self.quiet_order_score(quiet_move, killers))
 
-            direction = 1 if game_state.whiteToMove else -1
             best_score = -INFINITY
+            best_move = None
 
-            for move in valid_moves:
+            for move_index, move in enumerate(valid_moves):
                 game_state.make_move(move)
-                self.hasConsideredEnPassant = self.hasConsideredEnPassant or move.isEnPassant  # for debug
-                new_score = -1 * self.negamax_pruning_move(game_state, depth - 1, -beta, -alpha)
+                if move_index == 0:
+                    new_score = -1 * self.negamax_pruning_move(game_state, depth - 1, -beta, -alpha, ply + 1)
+                else:
+                    # principal variation search: the later moves are expected to fail low, which a null window
+                    # proves faster, and are searched again with the full window when they don't
+                    if self.late_move_reductions and ply > 0 and depth >= LMR_MIN_DEPTH and \
+                            move_index >= LMR_FULL_DEPTH_MOVES and not in_check and move.pieceCaptured == "--" and \
+                            not move.isPromotion and move.moveID not in killers and not game_state.is_in_check():
+                        reduction = 1 if move_index < LMR_DEEP_REDUCTION_MOVES else 2
+                    else:
+                        reduction = 0
+                    new_score = -1 * self.negamax_pruning_move(game_state, depth - 1 - reduction, -alpha - 1, -alpha,
+                                                               ply + 1)
+                    if reduction > 0 and new_score > alpha and not self.stopped:
+                        new_score = -1 * self.negamax_pruning_move(game_state, depth - 1, -alpha - 1, -alpha, ply + 1)
+                    if alpha < new_score < beta and beta - alpha > 1 and not self.stopped:
+                        new_score = -1 * self.negamax_pruning_move(game_state, depth - 1, -beta, -alpha, ply + 1)
                 game_state.undo_move()
                 self.nodes_count += 1
+                if self.stopped:
+                    return 0
 
                 if new_score > best_score:
                     best_score = new_score
+                    best_move = move
 
-                    if depth == self.depth:
-                        self.best_moves.insert(0, move)
-                        self.best_scores.insert(0, best_score)
-                        self.chosen_move = move
-                        self.chosen_score = best_score
-                        print(f"{self.chosen_move.get_chess_notation()}, {best_score * direction}")
+                    if ply == 0:
+                        self.update_root_best_move(move, best_score)
+                if new_score > alpha:
+                    self.update_principal_variation(move, ply)
 
                 if best_score > alpha:
                     alpha = best_score
                 if alpha >= beta:
+                    self.beta_cutoffs_count += 1
+                    if move_index == 0:
+                        self.first_move_cutoffs_count += 1
+                    if move.pieceCaptured == "--" and not move.isPromotion:
+                        self.update_quiet_move_ordering(move, ply, depth)
                     break
 
+            if best_move is None and ply > 0:  # no legal move
+                return -CHECKMATE + ply if game_state.is_in_check() else STALEMATE
+
+            if best_score <= alpha_original:
+                tt_bound = TT_UPPER_BOUND
+            elif best_score >= beta:
+                tt_bound = TT_LOWER_BOUND
+            else:
+                tt_bound = TT_EXACT
+            self.transposition_table.store(game_state.Zobrist, depth, tt_bound, score_to_tt(best_score, ply),
+                                          best_move.moveID if best_move is not None else None)
+
             return best_score
 
     def quiescence_move(self, game_state, alpha, beta):
+        if self.is_time_up():
+            return 0
         direction = 1 if game_state.whiteToMove else -1
-        base_score = self.score_board(game_state.board, direction)
+        base_score = self.score_board(game_state, direction)
         if base_score > alpha:
             alpha = base_score
         if alpha > beta:
@@ -135,39 +827,61 @@ class AIState:
         if last_move.pieceCaptured == '--':
             return base_score
 
+        # any stored result is at least as deep as a quiescence search, mate scores do not occur here
+        hash_move_id = None
+        tt_entry = self.transposition_table.probe(game_state.Zobrist)
+        if tt_entry is not None:
+            self.tt_hits_count += 1
+            tt_depth, tt_bound, tt_score, hash_move_id = tt_entry
+            if abs(tt_score) < MATE_THRESHOLD and \
+                    ((tt_bound == TT_EXACT) or
+                     (tt_bound == TT_LOWER_BOUND and tt_score >= beta) or
+                     (tt_bound == TT_UPPER_BOUND and tt_score <= alpha)):
+                return max(alpha, min(tt_score, beta))
+
         # get the opponent capture responses
-        valid_moves = game_state.get_valid_moves()
-        valid_moves = game_state.get_capture_moves(valid_moves)
+        valid_moves = game_state.get_valid_capture_moves()
+        valid_moves.sort(key=self.capture_order_score, reverse=True)
+        valid_moves = self.order_hash_move_first(valid_moves, hash_move_id)
 
+        alpha_original = alpha
+        best_move = None
         for move in valid_moves:
             game_state.make_move(move)
-            self.hasConsideredEnPassant = self.hasConsideredEnPassant or move.isEnPassant  # for debug
             new_score = -1 * self.quiescence_move(game_state, -beta, -alpha)
             game_state.undo_move()
             self.nodes_count += 1
+            self.quiescence_nodes_count += 1
+            if self.stopped:
+                return 0
 
             if new_score > alpha:
                 alpha = new_score
+                best_move = move
             if new_score >= beta:
+                self.transposition_table.store(game_state.Zobrist, 0, TT_LOWER_BOUND, beta, move.moveID)
                 return beta
 
+        self.transposition_table.store(game_state.Zobrist, 0, TT_EXACT if alpha > alpha_original else TT_UPPER_BOUND,
+                                      alpha, best_move.moveID if best_move is not None else None)
         return alpha
 
     @staticmethod
-    def score_board(board, direction):
+    def score_board(game_state, direction):
+        # the score make_move / undo_move keep up to date once the search gave the tables to the game state, see
+        # use_incremental_score, a full board scan otherwise
+        if game_state.pieceSquareValues is not PIECE_SQUARE_VALUES:
+            return AIState.score_board_full(game_state.board, direction)
+        if CHECK_INCREMENTAL_SCORE:
+            assert game_state.score == AIState.score_board_full(game_state.board, 1), game_state.get_fen_from_board()
+        return game_state.score * direction
+
+    @staticmethod
+    def score_board_full(board, direction):
         score = 0
         for row in range(len(board)):
             for col in range(len(board[row])):
-                if board[row][col][0] == 'w':
-                    multiplier = 1
-                    bump_row = row
-                    bump_col = col
-                else:
-                    multiplier = -1
-                    bump_row = 7 - row
-                    bump_col = col
-                bump = BUMP_VALUES[board[row][col][1]][bump_row][bump_col]
-                score += (BASE_VALUES[board[row][col][1]] + bump) * multiplier
+                score += PIECE_SQUARE_VALUES[board[row][col]][row * 8 + col]
 
         return score * direction
 
@@ -181,21 +895,55 @@ class AIState:
         return 1
 
     def order_by_candidate_moves(self, moves, depth):
-        random.shuffle(moves)
-
-        if depth == self.depth and len(self.best_moves) > 0:
-            # intersect_moves
-            moves_id = {move.moveID for move in moves}
-            ai_state_moves_id = {move.moveID for move in self.best_moves}
-            intersect_moves_id = list(moves_id.intersection(ai_state_moves_id))
-            intersect_moves = [move for move in self.best_moves if move.moveID in intersect_moves_id]
-            other_moves = [move for move in moves if move.moveID not in intersect_moves_id]
-            capture_moves = [move for move in other_moves if move.pieceCaptured != "--"]
-            other_moves = [move for move in other_moves if move.pieceCaptured == "--"]
-            intersect_moves.extend(capture_moves)
-            intersect_moves.extend(other_moves)
-            return intersect_moves
+        # the shuffle only varies the order of moves of equal score, the sort is stable
+        self.random.shuffle(moves)
+        killers = self.killer_moves[self.root_depth - depth]
+        moves.sort(key=lambda move: self.capture_order_score(move) if move.pieceCaptured != "--" or move.isPromotion
+                   else self.quiet_order_score(move, killers) - KILLER_ORDER_SCORE, reverse=True)
+
+        if depth == self.root_depth and self.principal_variation:  # the previous iteration's choice first
+            return self.order_hash_move_first(moves, self.principal_variation[0].moveID)
+
+        return moves
+
+    @staticmethod
+    def capture_order_score(move):
+        # most valuable victim first, then least valuable attacker, promotions count the promoted piece
+        score = BASE_VALUES[move.pieceCaptured[1]] * 16 - BASE_VALUES[move.pieceMoved[1]] // 16
+        if move.isPromotion:
+            score += BASE_VALUES[move.promotionPiece] * 16
+        return score
+
+    def quiet_order_score(self, move, killers):
+        if move.isPromotion:
+            return KILLER_ORDER_SCORE + BASE_VALUES[move.promotionPiece]
+        if move.moveID in killers:
+            return KILLER_ORDER_SCORE - killers.index(move.moveID)
+        return self.history[move.pieceMoved][move.endRow * 8 + move.endCol]
 
+    def update_quiet_move_ordering(self, move, ply, depth):
+        killers = self.killer_moves[ply]
+        if killers[0] != move.moveID:
+            killers.pop()
+            killers.insert(0, move.moveID)
+        self.history[move.pieceMoved][move.endRow * 8 + move.endCol] += depth * depth
+
+    def new_move_ordering(self, keep_history=True):
+        # killers only hold for the position searched, history is aged so that the new search writes its own
+        self.killer_moves = [[None] * KILLER_SLOTS for _ in range(MAX_DEPTH + 1)]
+        for piece_history in self.history.values():
+            for square in range(64):
+                piece_history[square] = piece_history[square] // 2 if keep_history else 0
+
+    @staticmethod
+    def order_hash_move_first(moves, hash_move_id):
+        if hash_move_id is None:
+            return moves
+        for i in range(len(moves)):
+            if moves[i].moveID == hash_move_id:
+                if i > 0:
+                    moves.insert(0, moves.pop(i))
+                break
         return moves
 
     def find_best_move(self, game_state):
@@ -209,11 +957,11 @@ class AIState:
         if game_state.isStaleMate:
             return best_move, -direction * STALEMATE
 
-        random.shuffle(valid_moves)
+        self.random.shuffle(valid_moves)
 
         for move in valid_moves:
             game_state.make_move(move)
-            score = self.score_board(game_state.board, direction)
+            score = self.score_board(game_state, direction)
             game_state.undo_move()
             if score * direction > best_score * direction:
                 best_score = score
@@ -221,9 +969,8 @@ class AIState:
 
         return best_move, best_score
 
-    @staticmethod
-    def find_random_move(valid_moves):
-        z = random.randint(0, len(valid_moves) - 1)
+    def find_random_move(self, valid_moves):
+        z = self.random.randint(0, len(valid_moves) - 1)
         return valid_moves[z]
 
     def count_all_moves_at_depth(self, game_state, depth):
@@ -232,6 +979,8 @@ class AIState:
 
         num_positions = 0
         valid_moves = game_state.get_valid_moves()
+        if depth == 1:  # bulk counting, the leaves don't need to be played
+            return len(valid_moves)
         for move in valid_moves:
             game_state.make_move(move)
             num_positions += self.count_all_moves_at_depth(game_state, depth - 1)
@@ -239,3 +988,64 @@ class AIState:
 
         return num_positions
 
+
+def use_incremental_score(game_state):
+    # from now on make_move / undo_move keep the score of the game state up to date, score_board only reads it
+    if game_state.pieceSquareValues is not PIECE_SQUARE_VALUES:
+        game_state.set_piece_square_values(PIECE_SQUARE_VALUES)
+
+
+def find_move(game_state, move_id):
+    # the legal move of the position with this id, None if there is none
+    start_square = ChessEngine.Move.get_start_square_from_id(move_id)
+    for move in game_state.get_legal_moves(ChessEngine.GEN_ALL, start_square):
+        if move.moveID == move_id:
+            return move
+    return None
+
+
+# Root parallel search workers, each process keeps its own AIState and transposition table between tasks
+worker_ai_state = None
+
+
+def init_search_worker(hash_size_mb, endgame_path=None):
+    global worker_ai_state
+    worker_ai_state = AIState(hash_size_mb, workers=1, endgame_path=endgame_path)
+
+
+def mcts_search_worker(game_state_class, fen, rollouts, time_left, seed):
+    # returns (root children {move id: (visits, results)}, nodes, stopped)
+    ai_state = worker_ai_state
+    ai_state.random = random.Random(seed) if seed is not None else random
+    ai_state.reset_counters()
+    ai_state.stopped = False
+    ai_state.deadline = None if time_left is None else time.perf_counter() + time_left
+    game_state = game_state_class(fen)
+    use_incremental_score(game_state)
+    root_children = ai_state.mcts_search(game_state, rollouts)
+    return root_children, ai_state.nodes_count, ai_state.stopped
+
+
+def search_root_move(game_state_class, fen, move_id, depth, alpha, beta, time_left, clear_hash, null_move_pruning,
+                     late_move_reductions):
+    # searches the root move 'move_id' of the position 'fen', with a null window first as in the principal variation
+    # search, and returns (score, search counters, stopped, best line after the move), the score seen from the root
+    ai_state = worker_ai_state
+    if clear_hash:  # the table content depends on the previous tasks of this worker, not on the position only
+        ai_state.transposition_table.clear()
+        ai_state.new_move_ordering(keep_history=False)
+    ai_state.transposition_table.new_search()
+    ai_state.reset_counters()
+    ai_state.stopped = False
+    ai_state.root_depth = depth
+    ai_state.deadline = None if time_left is None else time.perf_counter() + time_left
+    ai_state.null_move_pruning = null_move_pruning
+    ai_state.late_move_reductions = late_move_reductions
+
+    game_state = game_state_class(fen)
+    use_incremental_score(game_state)
+    game_state.make_move(find_move(game_state, move_id))
+    score = -1 * ai_state.negamax_pruning_move(game_state, depth - 1, -alpha - 1, -alpha, 1)
+    if alpha < score < beta and not ai_state.stopped:
+        score = -1 * ai_state.negamax_pruning_move(game_state, depth - 1, -beta, -alpha, 1)
+    return score, ai_state.get_counters(), ai_state.stopped, ai_state.pv_table[1][1:ai_state.pv_length[1]]
@@ -0,0 +1,181 @@
+import argparse
+import gc
+import json
+import random
+import sys
+import time
+import tracemalloc
+from Chess import ChessAI
+from Chess import ChessBitboard
+from Chess import ChessEngine
+from Chess import ChessPerft
+
+BENCHMARKS = ['make_undo_move', 'get_valid_moves', 'get_pinned_and_checking_pieces', 'score_board',
+              'score_board_full', 'fen_round_trip', 'move_construction']
+CORPUS_SEED = 1
+CORPUS_SIZE = 200
+MAX_RANDOM_PLIES = 60  # length of the random games the corpus positions are taken from
+MIN_ROUND_TIME = 0.2  # seconds, each round repeats the benchmark at least this long
+ROUNDS = 3  # the fastest round is kept
+TOLERANCE = 0.10  # slowdown, or allocation growth, flagged as a regression
+ALLOCATION_NOISE_BYTES = 16
+BASELINE_VERSION = 1
+
+
+def build_corpus(seed=CORPUS_SEED, size=CORPUS_SIZE):
+    # FENs of the positions reached by random games from the perft positions, the same for a given seed
+    rng = random.Random(seed)
+    start_fens = [fen for _, fen, _ in ChessPerft.PERFT_POSITIONS]
+    corpus = []
+    while len(corpus) < size:
+        game_state = ChessEngine.GameState(start_fens[len(corpus) % len(start_fens)])
+        for _ in range(rng.randint(0, MAX_RANDOM_PLIES)):
+            valid_moves = game_state.get_valid_moves()
+            if game_state.isCheckMate or game_state.isStaleMate:
+                break
+            game_state.make_move(rng.choice(valid_moves))
+        if game_state.get_valid_moves() and not game_state.isStaleMate:
+            corpus.append(game_state.get_fen_from_board())
+    return corpus
+
+
+def get_benchmarks(game_state_class, corpus):
+    # name: (operation, items), the operation being applied to every item
+    game_states = [game_state_class(fen) for fen in corpus]
+    for game_state in game_states:
+        game_state.set_piece_square_values(ChessAI.PIECE_SQUARE_VALUES)  # as in the search
+    moves = [(game_state, move) for game_state in game_states for move in game_state.get_valid_moves()]
+
+    def make_undo_move(item):
+        game_state, move = item
+        game_state.make_move(move)
+        game_state.undo_move()
+
+    def fen_round_trip(item):
+        game_state, fen = item
+        game_state.get_board_from_fen(fen)
+        game_state.get_fen_from_board()
+
+    def move_construction(item):
+        game_state, move = item
+        ChessEngine.Move((move.startRow, move.startCol), (move.endRow, move.endCol), game_state.board)
+
+    return {
+        'make_undo_move': (make_undo_move, moves),
+        'get_valid_moves': (game_state_class.get_valid_moves, game_states),
+        'get_pinned_and_checking_pieces': (game_state_class.get_pinned_and_checking_pieces, game_states),
+        'score_board': (lambda game_state: ChessAI.AIState.score_board(game_state, 1), game_states),
+        'score_board_full': (lambda game_state: ChessAI.AIState.score_board_full(game_state.board, 1), game_states),
+        'fen_round_trip': (fen_round_trip, list(zip(game_states, corpus))),
+        'move_construction': (move_construction, moves),
+    }
+
+
+def time_benchmark(operation, items, min_round_time=MIN_ROUND_TIME, rounds=ROUNDS):
+    # operations per second of the fastest round
+    best_rate = 0.0
+    for _ in range(rounds):
+        passes = 0
+        start_time = time.perf_counter()
+        while True:
+            for item in items:
+                operation(item)
+            passes += 1
+            elapsed = time.perf_counter() - start_time
+            if elapsed >= min_round_time:
+                break
+        best_rate = max(best_rate, passes * len(items) / elapsed)
+    return best_rate
+
+
+def measure_allocations(operation, items):
+    # average peak of the memory allocated during one operation, bytes, freed or not at its end
+    gc.collect()
+    tracemalloc.start()
+    total = 0
+    for item in items:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        operation(item)
+        total += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return total / len(items)
+
+
+def run_benchmarks(backends, benchmarks, corpus, min_round_time=MIN_ROUND_TIME, rounds=ROUNDS):
+    # {'backend.benchmark': {'ops_per_sec': ..., 'alloc_bytes': ...}}
+    results = {}
+    for backend in backends:
+        backend_benchmarks = get_benchmarks(ChessBitboard.BACKENDS[backend], corpus)
+        for name in benchmarks:
+            operation, items = backend_benchmarks[name]
+            results[f"{backend}.{name}"] = {
+                'ops_per_sec': time_benchmark(operation, items, min_round_time, rounds),
+                'alloc_bytes': measure_allocations(operation, items),
+            }
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance=TOLERANCE):
+    # {'backend.benchmark': (speed ratio, allocation ratio, regression)} of the benchmarks found in the baseline
+    comparison = {}
+    for key, result in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            continue
+        speed_ratio = result['ops_per_sec'] / reference['ops_per_sec']
+        allocation_ratio = result['alloc_bytes'] / reference['alloc_bytes'] if reference['alloc_bytes'] else 1.0
+        regression = speed_ratio < 1 - tolerance or \
+            result['alloc_bytes'] > reference['alloc_bytes'] * (1 + tolerance) + ALLOCATION_NOISE_BYTES
+        comparison[key] = (speed_ratio, allocation_ratio, regression)
+    return comparison
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the game state primitives")
+    parser.add_argument('--backend', action='append', choices=sorted(ChessBitboard.BACKENDS),
+                        help="can be repeated, all by default")
+    parser.add_argument('--benchmark', action='append', choices=BENCHMARKS, help="can be repeated, all by default")
+    parser.add_argument('--seed', type=int, default=CORPUS_SEED, help="seed of the corpus of positions")
+    parser.add_argument('--corpus-size', type=int, default=CORPUS_SIZE)
+    parser.add_argument('--min-time', type=float, default=MIN_ROUND_TIME, help="seconds per round")
+    parser.add_argument('--rounds', type=int, default=ROUNDS)
+    parser.add_argument('--baseline', help="results file to compare with, regressions make the exit code 1")
+    parser.add_argument('--save-baseline', help="file to write the results to")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--json', action='store_true', help="print the results as one JSON object")
+    args = parser.parse_args(argv)
+
+    corpus = build_corpus(args.seed, args.corpus_size)
+    results = run_benchmarks(args.backend or sorted(ChessBitboard.BACKENDS), args.benchmark or BENCHMARKS, corpus,
+                             args.min_time, args.rounds)
+    comparison = {}
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get('seed') != args.seed or baseline.get('corpus_size') != args.corpus_size:
+            print("Warning: the baseline was measured on another corpus")
+        comparison = compare_with_baseline(results, baseline['results'], args.tolerance)
+
+    if args.json:
+        print(json.dumps({'results': results,
+                          'comparison': {key: {'speed_ratio': speed_ratio, 'allocation_ratio': allocation_ratio,
+                                               'regression': regression}
+                                         for key, (speed_ratio, allocation_ratio, regression) in comparison.items()}}))
+    else:
+        for key, result in results.items():
+            line = f"{key:<42} {result['ops_per_sec']:>12,.0f} ops/s {result['alloc_bytes']:>9,.0f} B/op"
+            if key in comparison:
+                speed_ratio, allocation_ratio, regression = comparison[key]
+                line += f"  speed x{speed_ratio:.2f} alloc x{allocation_ratio:.2f}{'  REGRESSION' if regression else ''}"
+            print(line)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as baseline_file:
+            json.dump({'version': BASELINE_VERSION, 'seed': args.seed, 'corpus_size': args.corpus_size,
+                       'python': sys.version.split()[0], 'results': results}, baseline_file, indent=2)
+    return 1 if any(regression for _, _, regression in comparison.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
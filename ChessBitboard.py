@@ -0,0 +1,358 @@
+from Chess import ChessEngine
+
+# Squares are indexed as row * 8 + col, row 0 being the 8th rank, so bit i of a bitboard maps to board[i // 8][i % 8]
+WHITE = 0
+BLACK = 1
+FULL_BOARD = (1 << 64) - 1
+DIRECTIONS = [(-1, 0), (0, 1), (1, 0), (0, -1), (-1, 1), (1, 1), (1, -1), (-1, -1)]
+KNIGHT_DIRECTIONS = [(-2, 1), (-1, 2), (1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1)]
+
+
+def square_index(row, col):
+    return row * 8 + col
+
+
+def squares_of(bitboard):
+    while bitboard:
+        lowest_bit = bitboard & -bitboard
+        yield lowest_bit.bit_length() - 1
+        bitboard ^= lowest_bit
+
+
+def build_step_masks(directions):
+    masks = []
+    for sq in range(64):
+        row, col = divmod(sq, 8)
+        mask = 0
+        for direction in directions:
+            new_row = row + direction[0]
+            new_col = col + direction[1]
+            if 0 <= new_row <= 7 and 0 <= new_col <= 7:
+                mask |= 1 << square_index(new_row, new_col)
+        masks.append(mask)
+    return masks
+
+
+def build_ray_masks():
+    rays = []
+    for direction in DIRECTIONS:
+        direction_rays = []
+        for sq in range(64):
+            row, col = divmod(sq, 8)
+            mask = 0
+            for i in range(1, 8):
+                new_row = row + direction[0] * i
+                new_col = col + direction[1] * i
+                if not (0 <= new_row <= 7 and 0 <= new_col <= 7):
+                    break
+                mask |= 1 << square_index(new_row, new_col)
+            direction_rays.append(mask)
+        rays.append(direction_rays)
+    return rays
+
+
+def build_line_masks():
+    between = [[0] * 64 for _ in range(64)]
+    line = [[0] * 64 for _ in range(64)]
+    for sq in range(64):
+        for d in range(len(DIRECTIONS)):
+            opposite_d = (d + 2) % 4 + (d // 4) * 4
+            full_line = RAY_MASKS[d][sq] | RAY_MASKS[opposite_d][sq] | (1 << sq)
+            for target in squares_of(RAY_MASKS[d][sq]):
+                between[sq][target] = RAY_MASKS[d][sq] & ~RAY_MASKS[d][target] & ~(1 << target)
+                line[sq][target] = full_line
+    return between, line
+
+
+KNIGHT_MASKS = build_step_masks(KNIGHT_DIRECTIONS)
+KING_MASKS = build_step_masks(DIRECTIONS)
+# PAWN_ATTACK_MASKS[color][sq]: squares attacked by a pawn of 'color' standing on 'sq'
+PAWN_ATTACK_MASKS = [build_step_masks([(-1, -1), (-1, 1)]), build_step_masks([(1, -1), (1, 1)])]
+RAY_MASKS = build_ray_masks()
+# the first blocker on a ray going towards higher square indexes is its lowest bit, otherwise its highest bit
+RAY_IS_POSITIVE = [direction[0] * 8 + direction[1] > 0 for direction in DIRECTIONS]
+BETWEEN_MASKS, LINE_MASKS = build_line_masks()
+ROOK_EMPTY_BOARD_MASKS = [RAY_MASKS[0][sq] | RAY_MASKS[1][sq] | RAY_MASKS[2][sq] | RAY_MASKS[3][sq] for sq in range(64)]
+BISHOP_EMPTY_BOARD_MASKS = [RAY_MASKS[4][sq] | RAY_MASKS[5][sq] | RAY_MASKS[6][sq] | RAY_MASKS[7][sq] for sq in range(64)]
+PROMOTION_ROWS_MASKS = [0xFF, 0xFF << 56]
+
+
+def ray_attacks(sq, occupied, direction_index):
+    attacks = RAY_MASKS[direction_index][sq]
+    blockers = attacks & occupied
+    if blockers:
+        if RAY_IS_POSITIVE[direction_index]:
+            first_blocker = (blockers & -blockers).bit_length() - 1
+        else:
+            first_blocker = blockers.bit_length() - 1
+        attacks ^= RAY_MASKS[direction_index][first_blocker]
+    return attacks
+
+
+def rook_attacks(sq, occupied):
+    return ray_attacks(sq, occupied, 0) | ray_attacks(sq, occupied, 1) | \
+        ray_attacks(sq, occupied, 2) | ray_attacks(sq, occupied, 3)
+
+
+def bishop_attacks(sq, occupied):
+    return ray_attacks(sq, occupied, 4) | ray_attacks(sq, occupied, 5) | \
+        ray_attacks(sq, occupied, 6) | ray_attacks(sq, occupied, 7)
+
+
+class GameState(ChessEngine.GameState):
+    # Hybrid backend: the moves are generated from the bitboards, but make_move / undo_move still go through the
+    # mailbox game state, whose 8x8 board, logs, notation & Zobrist key the rest of the program reads, and then
+    # update the bitboards on top of it. Making & undoing moves is therefore slower than with the mailbox backend
+    def __init__(self, fen=None):
+        super().__init__(fen)
+        self.pieceBitboards = {}
+        self.colorBitboards = [0, 0]
+        self.set_bitboards_from_board()
+
+    def set_bitboards_from_board(self):
+        self.pieceBitboards = {piece: 0 for piece in self.PiecesToFEN}
+        self.colorBitboards = [0, 0]
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != '--':
+                    bit = 1 << square_index(r, c)
+                    self.pieceBitboards[piece] |= bit
+                    self.colorBitboards[WHITE if piece[0] == 'w' else BLACK] |= bit
+
+    def make_move(self, move, valid_moves=None):
+        super().make_move(move, valid_moves)
+        self.toggle_move_bits(move)
+
+    def undo_move(self):
+        if len(self.moveLog) != 0:
+            move = self.moveLog[-1]
+            super().undo_move()
+            self.toggle_move_bits(move)
+
+    def toggle_move_bits(self, move):
+        # XOR-ing the same bits twice restores the position, so this serves for both make and undo
+        color = WHITE if move.pieceMoved[0] == 'w' else BLACK
+        from_bit = 1 << square_index(move.startRow, move.startCol)
+        to_bit = 1 << square_index(move.endRow, move.endCol)
+        piece_bitboards = self.pieceBitboards
+        color_bitboards = self.colorBitboards
+
+        piece_bitboards[move.pieceMoved] ^= from_bit
+        if move.isPromotion:
+            piece_bitboards[move.pieceMoved[0] + move.promotionPiece] ^= to_bit
+        else:
+            piece_bitboards[move.pieceMoved] ^= to_bit
+        color_bitboards[color] ^= from_bit | to_bit
+
+        if move.pieceCaptured != '--':
+            if move.isEnPassant:
+                captured_bit = 1 << square_index(move.startRow, move.endCol)
+            else:
+                captured_bit = to_bit
+            piece_bitboards[move.pieceCaptured] ^= captured_bit
+            color_bitboards[1 - color] ^= captured_bit
+
+        if move.isCastling_OO or move.isCastling_OOO:
+            if move.isCastling_OO:
+                rook_bits = (1 << square_index(move.endRow, move.endCol + 1)) | (1 << square_index(move.endRow, move.endCol - 1))
+            else:
+                rook_bits = (1 << square_index(move.endRow, move.endCol - 2)) | (1 << square_index(move.endRow, move.endCol + 1))
+            piece_bitboards[move.pieceMoved[0] + 'R'] ^= rook_bits
+            color_bitboards[color] ^= rook_bits
+
+    def get_attackers_to(self, sq, by_color, occupied):
+        prefix = 'w' if by_color == WHITE else 'b'
+        piece_bitboards = self.pieceBitboards
+        queens = piece_bitboards[prefix + 'Q']
+        return (KNIGHT_MASKS[sq] & piece_bitboards[prefix + 'N']) | \
+            (KING_MASKS[sq] & piece_bitboards[prefix + 'K']) | \
+            (PAWN_ATTACK_MASKS[1 - by_color][sq] & piece_bitboards[prefix + 'P']) | \
+            (rook_attacks(sq, occupied) & (piece_bitboards[prefix + 'R'] | queens)) | \
+            (bishop_attacks(sq, occupied) & (piece_bitboards[prefix + 'B'] | queens))
+
+    def is_attacked(self, sq, by_color, occupied):
+        return self.get_attackers_to(sq, by_color, occupied) != 0
+
+    def is_square_attacked(self, row, col, by_color):
+        return self.is_attacked(square_index(row, col), WHITE if by_color == 'w' else BLACK,
+                                self.colorBitboards[0] | self.colorBitboards[1])
+
+    def get_king_relative_piece(self, sq, king_sq, unit_direction):
+        # (row, col, piece, row direction, col direction) seen from the king, the shape the mailbox game state gives
+        # its pins & checks: the direction is a unit step along a line, or the offset from the king otherwise
+        row, col = divmod(sq, 8)
+        king_row, king_col = divmod(king_sq, 8)
+        row_direction, col_direction = row - king_row, col - king_col
+        if unit_direction:
+            row_direction = (row_direction > 0) - (row_direction < 0)
+            col_direction = (col_direction > 0) - (col_direction < 0)
+        return row, col, self.board[row][col][1], row_direction, col_direction
+
+    def get_en_passant_square(self):
+        en_passant_file = self.get_en_passant_file()
+        if en_passant_file is None:
+            return None
+        return square_index(2 if self.whiteToMove else 5, en_passant_file)
+
+    def get_valid_moves(self):
+        valid_moves = self.generate_legal_moves()
+        self.update_end_of_game_state(valid_moves)
+        return valid_moves
+
+    def get_legal_moves(self, gen_type=ChessEngine.GEN_ALL, square=None, pins_and_checks=None):
+        # the pins & checks are always looked for, a few mask operations from the king square
+        from_mask = FULL_BOARD if square is None else 1 << square_index(square[0], square[1])
+        return self.generate_legal_moves(gen_type, from_mask)
+
+    def has_any_legal_move(self):
+        return len(self.generate_legal_moves(stop_at_first=True)) > 0
+
+    def has_non_pawn_material(self):
+        prefix = 'w' if self.whiteToMove else 'b'
+        piece_bitboards = self.pieceBitboards
+        return (piece_bitboards[prefix + 'N'] | piece_bitboards[prefix + 'B'] | piece_bitboards[prefix + 'R'] |
+                piece_bitboards[prefix + 'Q']) != 0
+
+    def is_in_check(self):
+        us = WHITE if self.whiteToMove else BLACK
+        king_sq = self.pieceBitboards['wK' if us == WHITE else 'bK'].bit_length() - 1
+        return self.is_attacked(king_sq, 1 - us, self.colorBitboards[0] | self.colorBitboards[1])
+
+    def generate_legal_moves(self, gen_type=ChessEngine.GEN_ALL, from_mask=FULL_BOARD, stop_at_first=False):
+        us = WHITE if self.whiteToMove else BLACK
+        them = 1 - us
+        own_prefix = 'w' if us == WHITE else 'b'
+        opponent_prefix = 'b' if us == WHITE else 'w'
+        piece_bitboards = self.pieceBitboards
+        own = self.colorBitboards[us]
+        opponent = self.colorBitboards[them]
+        occupied = own | opponent
+        empty = ~occupied & FULL_BOARD
+        king_sq = piece_bitboards[own_prefix + 'K'].bit_length() - 1
+
+        checkers = self.get_attackers_to(king_sq, them, occupied)
+        self.isCheck = checkers != 0
+        self.checkingPieces = [self.get_king_relative_piece(sq, king_sq, self.board[sq >> 3][sq & 7][1] in 'RBQ')
+                               for sq in squares_of(checkers)]
+
+        # pinned pieces can only move along the line joining their king and the pinning piece
+        pin_masks = {}
+        opponent_queens = piece_bitboards[opponent_prefix + 'Q']
+        snipers = (ROOK_EMPTY_BOARD_MASKS[king_sq] & (piece_bitboards[opponent_prefix + 'R'] | opponent_queens)) | \
+                  (BISHOP_EMPTY_BOARD_MASKS[king_sq] & (piece_bitboards[opponent_prefix + 'B'] | opponent_queens))
+        for sniper_sq in squares_of(snipers):
+            blockers = BETWEEN_MASKS[king_sq][sniper_sq] & occupied
+            if blockers and not blockers & (blockers - 1) and blockers & own:
+                pin_masks[blockers.bit_length() - 1] = LINE_MASKS[king_sq][sniper_sq]
+        self.pinnedPieces = [self.get_king_relative_piece(sq, king_sq, True) for sq in pin_masks]
+
+        # squares the generated moves may go to
+        if gen_type == ChessEngine.GEN_CAPTURES:
+            type_mask = opponent
+        elif gen_type == ChessEngine.GEN_QUIETS:
+            type_mask = empty
+        else:
+            type_mask = opponent | empty
+
+        valid_moves = []
+        board = self.board
+        Move = ChessEngine.Move
+
+        # King moves
+        if (1 << king_sq) & from_mask:
+            occupied_without_king = occupied ^ (1 << king_sq)
+            king_from = divmod(king_sq, 8)
+            for to_sq in squares_of(KING_MASKS[king_sq] & type_mask):
+                if not self.is_attacked(to_sq, them, occupied_without_king):
+                    valid_moves.append(Move(king_from, divmod(to_sq, 8), board))
+            if not checkers and gen_type != ChessEngine.GEN_CAPTURES:
+                self.add_castling_moves(valid_moves, us, king_sq, occupied)
+
+        if checkers & (checkers - 1) or (stop_at_first and valid_moves):  # Double check, only K can move
+            return valid_moves
+
+        if checkers:
+            checker_sq = checkers.bit_length() - 1
+            target_mask = (checkers | BETWEEN_MASKS[king_sq][checker_sq]) & type_mask
+        else:
+            target_mask = type_mask
+
+        # Knights, bishops, rooks & queens
+        for piece in ('N', 'B', 'R', 'Q'):
+            for from_sq in squares_of(piece_bitboards[own_prefix + piece] & from_mask):
+                if piece == 'N':
+                    targets = KNIGHT_MASKS[from_sq]
+                elif piece == 'B':
+                    targets = bishop_attacks(from_sq, occupied)
+                elif piece == 'R':
+                    targets = rook_attacks(from_sq, occupied)
+                else:
+                    targets = rook_attacks(from_sq, occupied) | bishop_attacks(from_sq, occupied)
+                targets &= target_mask
+                if from_sq in pin_masks:
+                    targets &= pin_masks[from_sq]
+                from_square = divmod(from_sq, 8)
+                for to_sq in squares_of(targets):
+                    valid_moves.append(Move(from_square, divmod(to_sq, 8), board))
+            if stop_at_first and valid_moves:
+                return valid_moves
+
+        # Pawns
+        pawns = piece_bitboards[own_prefix + 'P'] & from_mask
+        step = -8 if us == WHITE else 8
+        start_row = 6 if us == WHITE else 1
+        en_passant_sq = self.get_en_passant_square() if gen_type != ChessEngine.GEN_QUIETS else None
+        for from_sq in squares_of(pawns):
+            from_square = divmod(from_sq, 8)
+            allowed = target_mask & pin_masks.get(from_sq, FULL_BOARD)
+            targets = PAWN_ATTACK_MASKS[us][from_sq] & opponent
+            one_step = from_sq + step
+            if (1 << one_step) & empty:
+                targets |= 1 << one_step
+                two_steps = one_step + step
+                if from_square[0] == start_row and (1 << two_steps) & empty:
+                    targets |= 1 << two_steps
+            for to_sq in squares_of(targets & allowed):
+                if (1 << to_sq) & PROMOTION_ROWS_MASKS[us]:
+                    for promotion_piece in ChessEngine.PROMOTION_PIECES:
+                        valid_moves.append(Move(from_square, divmod(to_sq, 8), board, True, promotion_piece=promotion_piece))
+                else:
+                    valid_moves.append(Move(from_square, divmod(to_sq, 8), board))
+
+            if en_passant_sq is not None and PAWN_ATTACK_MASKS[us][from_sq] & (1 << en_passant_sq) and \
+                    piece_bitboards[opponent_prefix + 'P'] & (1 << (en_passant_sq - step)):
+                captured_sq = en_passant_sq - step
+                # removing two pawns from the same row can expose the king, so test the resulting position directly
+                occupied_after = occupied ^ (1 << from_sq) ^ (1 << en_passant_sq) ^ (1 << captured_sq)
+                exposed = (rook_attacks(king_sq, occupied_after) & (piece_bitboards[opponent_prefix + 'R'] | opponent_queens)) | \
+                          (bishop_attacks(king_sq, occupied_after) & (piece_bitboards[opponent_prefix + 'B'] | opponent_queens))
+                still_checked = checkers & ~(1 << captured_sq) & \
+                    (piece_bitboards[opponent_prefix + 'N'] | piece_bitboards[opponent_prefix + 'P'])
+                if not exposed and not still_checked:
+                    valid_moves.append(Move(from_square, divmod(en_passant_sq, 8), board, False, True))
+
+        return valid_moves
+
+    def add_castling_moves(self, moves, us, king_sq, occupied):
+        them = 1 - us
+        row, col = divmod(king_sq, 8)
+        if self.canOO[us] and self.board[row][7] == self.board[row][col][0] + 'R':
+            if not occupied & ((1 << (king_sq + 1)) | (1 << (king_sq + 2))):
+                if not self.is_attacked(king_sq + 1, them, occupied) and \
+                        not self.is_attacked(king_sq + 2, them, occupied):
+                    moves.append(ChessEngine.Move((row, col), (row, col + 2), self.board, False, False, (True, False)))
+        if self.canOOO[us] and self.board[row][0] == self.board[row][col][0] + 'R':
+            if not occupied & ((1 << (king_sq - 1)) | (1 << (king_sq - 2)) | (1 << (king_sq - 3))):
+                if not self.is_attacked(king_sq - 1, them, occupied) and \
+                        not self.is_attacked(king_sq - 2, them, occupied):
+                    moves.append(ChessEngine.Move((row, col), (row, col - 2), self.board, False, False, (False, True)))
+
+    def get_selected_piece_valid_moves(self):
+        r = self.selectedSquare[0]
+        c = self.selectedSquare[1]
+        return [move for move in self.get_valid_moves() if move.startRow == r and move.startCol == c]
+
+
+# move generation backends by name, for the command line tools
+BACKENDS = {'mailbox': ChessEngine.GameState, 'bitboard': GameState}
@@ -0,0 +1,183 @@
+import argparse
+import mmap
+import os
+import random
+import re
+import struct
+import sys
+from Chess import ChessEngine
+from Chess import ChessBitboard
+
+STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+BOOK_PLIES = 20  # plies of every game recorded in the book, see ChessAI.END_OF_OPENING_PHASE_MOVES
+MIN_WEIGHT = 1  # moves played fewer times are left out of the book
+MAX_WEIGHT = 0xFFFF
+# Records are sorted by key then move so that all the moves of a position are contiguous, big-endian like Polyglot
+RECORD = struct.Struct('>QHH')  # Zobrist key, packed move id, weight
+KEY = struct.Struct('>Q')
+SAN_PATTERN = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([QRBN]))?$')
+RESULTS = {'1-0', '0-1', '1/2-1/2', '*'}
+
+
+class OpeningBook:
+    # Read-only view of a compiled book: the file is memory mapped, so the processes reading the same book share
+    # the operating system's page cache instead of loading a copy each
+    def __init__(self, path):
+        with open(path, 'rb') as book_file:
+            # an empty file can't be memory mapped, it is a book without moves
+            size = os.fstat(book_file.fileno()).st_size
+            self.data = mmap.mmap(book_file.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else None
+        self.count = size // RECORD.size
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+
+    def get_moves(self, key):
+        # (move id, weight) of every book move of the position, found by a binary search on the key
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if KEY.unpack_from(self.data, middle * RECORD.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        moves = []
+        while low < self.count:
+            record_key, move_id, weight = RECORD.unpack_from(self.data, low * RECORD.size)
+            if record_key != key:
+                break
+            moves.append((move_id, weight))
+            low += 1
+        return moves
+
+    def choose_move(self, game_state, rng=random):
+        # a legal book move of the position picked at random in proportion to its weight, None when out of book
+        moves = self.get_moves(game_state.Zobrist)
+        if not moves:
+            return None
+        move_id = rng.choices([move_id for move_id, _ in moves], weights=[weight for _, weight in moves])[0]
+        start_square = ChessEngine.Move.get_start_square_from_id(move_id)
+        for move in game_state.get_legal_moves(ChessEngine.GEN_ALL, start_square):
+            if move.moveID == move_id:
+                return move
+        return None  # hash collision with a position of another book
+
+
+def get_move_from_san(game_state, san):
+    san = san.rstrip('+#!?')
+    valid_moves = game_state.get_valid_moves()
+    if san in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        king_side = len(san) == 3
+        candidates = [move for move in valid_moves if (move.isCastling_OO if king_side else move.isCastling_OOO)]
+    else:
+        match = SAN_PATTERN.match(san)
+        if match is None:
+            return None
+        piece, from_file, from_rank, end_square, promotion_piece = match.groups()
+        piece = piece or 'P'
+        candidates = [move for move in valid_moves
+                      if move.pieceMoved[1] == piece and
+                      move.get_rank_file(move.endRow, move.endCol) == end_square and
+                      (from_file is None or move.colsToFiles[move.startCol] == from_file) and
+                      (from_rank is None or move.rowsToRanks[move.startRow] == from_rank) and
+                      (move.promotionPiece == promotion_piece if move.isPromotion else promotion_piece is None)]
+    return candidates[0] if len(candidates) == 1 else None
+
+
+def read_pgn_games(lines):
+    # yields (tags, SAN moves) of every game, comments, variations, move numbers & annotations are dropped
+    tags = {}
+    movetext = []
+    for line in lines:
+        line = line.strip()
+        if line.startswith('['):
+            if movetext:
+                yield tags, get_san_moves(' '.join(movetext))
+                tags, movetext = {}, []
+            tag = re.match(r'\[(\w+)\s+"(.*)"\]', line)
+            if tag:
+                tags[tag.group(1)] = tag.group(2)
+        elif line:
+            movetext.append(line.split(';')[0])
+    if movetext:
+        yield tags, get_san_moves(' '.join(movetext))
+
+
+def get_san_moves(movetext):
+    movetext = re.sub(r'\{[^}]*\}', ' ', movetext)
+    while '(' in movetext:  # innermost variations first
+        without_variation = re.sub(r'\([^()]*\)', ' ', movetext)
+        if without_variation == movetext:
+            break
+        movetext = without_variation
+    moves = []
+    for token in movetext.split():
+        token = re.sub(r'^\d+\.+', '', token)  # move numbers, possibly glued to the move
+        if token and not token.startswith('$') and token not in RESULTS:
+            moves.append(token)
+    return moves
+
+
+def build_book(pgn_paths, book_path, plies=BOOK_PLIES, min_weight=MIN_WEIGHT):
+    # counts how often each move was played in each position of the games' first 'plies' plies
+    weights = {}
+    games = 0
+    skipped_games = 0
+    for pgn_path in pgn_paths:
+        with open(pgn_path, encoding='utf-8', errors='replace') as pgn_file:
+            for tags, san_moves in read_pgn_games(pgn_file):
+                game_state = ChessBitboard.GameState(tags.get('FEN', STARTING_FEN))
+                games += 1
+                for san in san_moves[:plies]:
+                    move = get_move_from_san(game_state, san)
+                    if move is None:
+                        print(f"Game {games}: unknown or ambiguous move {san}, rest of the game skipped")
+                        skipped_games += 1
+                        break
+                    entry = (game_state.Zobrist, move.moveID)
+                    weights[entry] = weights.get(entry, 0) + 1
+                    game_state.make_move(move)
+
+    records = sorted((key, move_id, min(weight, MAX_WEIGHT)) for (key, move_id), weight in weights.items()
+                     if weight >= min_weight)
+    with open(book_path, 'wb') as book_file:
+        for record in records:
+            book_file.write(RECORD.pack(*record))
+    return games, skipped_games, len(records)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Opening book compiler & viewer")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help="compile PGN files into a book")
+    build_parser.add_argument('pgn', nargs='+')
+    build_parser.add_argument('--output', required=True, help="book file to write")
+    build_parser.add_argument('--plies', type=int, default=BOOK_PLIES)
+    build_parser.add_argument('--min-weight', type=int, default=MIN_WEIGHT)
+    probe_parser = subparsers.add_parser('probe', help="list the book moves of a position")
+    probe_parser.add_argument('book')
+    probe_parser.add_argument('--fen', default=STARTING_FEN)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        games, skipped_games, records = build_book(args.pgn, args.output, args.plies, args.min_weight)
+        print(f"{games} games ({skipped_games} partly skipped), {records} book entries written to {args.output}")
+        return 0
+
+    book = OpeningBook(args.book)
+    game_state = ChessBitboard.GameState(args.fen)
+    moves = book.get_moves(game_state.Zobrist)
+    total_weight = sum(weight for _, weight in moves)
+    for move_id, weight in sorted(moves, key=lambda move: -move[1]):
+        start_square = ChessEngine.Move.get_start_square_from_id(move_id)
+        for move in game_state.get_legal_moves(ChessEngine.GEN_ALL, start_square):
+            if move.moveID == move_id:
+                print(f"{move.get_uci_notation():<6} {weight:>6}  {100 * weight / total_weight:5.1f} %")
+    book.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
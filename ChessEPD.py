@@ -0,0 +1,191 @@
+import argparse
+import json
+import shlex
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from Chess import ChessAI
+from Chess import ChessBitboard
+from Chess import ChessBook
+
+DEFAULT_MOVE_TIME = 1.0  # seconds per position
+TASKS_PER_WORKER = 2  # positions queued per worker, the file is read as the results come back
+
+
+def read_epd(path):
+    # yields (line number, EPD line) of the file, blank lines & lines starting with '#' are skipped
+    epd_file = sys.stdin if path == '-' else open(path, encoding='utf-8')
+    with epd_file:
+        for line_number, line in enumerate(epd_file, 1):
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line_number, line
+
+
+def parse_epd(line):
+    # (FEN, {opcode: [operands]}) of an EPD line: 4 FEN fields followed by operations ended by ';'
+    fields = line.split(maxsplit=4)
+    operations = {}
+    for operation in (fields[4] if len(fields) > 4 else '').split(';'):
+        tokens = shlex.split(operation, posix=True) if '"' in operation else operation.split()
+        if tokens:
+            operations[tokens[0]] = tokens[1:]
+    half_moves = operations.get('hmvc', ['0'])[0]
+    full_moves = operations.get('fmvn', ['1'])[0]
+    return ' '.join(fields[:4] + [half_moves, full_moves]), operations
+
+
+# Suite workers, each process keeps its own AIState between positions
+worker_ai_state = None
+
+
+def init_epd_worker(hash_size_mb, null_move_pruning=ChessAI.NULL_MOVE_PRUNING,
+                    late_move_reductions=ChessAI.LATE_MOVE_REDUCTIONS):
+    global worker_ai_state
+    worker_ai_state = ChessAI.AIState(hash_size_mb, workers=1, null_move_pruning=null_move_pruning,
+                                      late_move_reductions=late_move_reductions)
+
+
+def get_epd_move_ids(game_state, best_moves, avoid_moves):
+    # (best move ids, avoided move ids, error) of the SAN moves of the 'bm' & 'am' operations, the error being None
+    # unless the position has no such operation or one of its moves is not a legal move
+    if not best_moves and not avoid_moves:
+        return set(), set(), "no 'bm' or 'am' operation"
+    move_ids = []
+    for notations in (best_moves, avoid_moves):
+        move_ids.append(set())
+        for notation in notations:
+            move = ChessBook.get_move_from_san(game_state, notation)
+            if move is None:
+                return set(), set(), f"{notation} is not a legal move"
+            move_ids[-1].add(move.moveID)
+    return move_ids[0], move_ids[1], None
+
+
+def solve_position(backend, fen, best_moves, avoid_moves, depth, move_time):
+    # Searches the position & returns its result, the position is solved when the chosen move is one of the best
+    # moves, or none of the moves to avoid. The time & nodes to solution are those of the first iteration from which
+    # the chosen move stayed a solution, None when unsolved. A malformed position is not searched, its 'error' says
+    # why
+    game_state = ChessBitboard.BACKENDS[backend](fen)
+    best_move_ids, avoid_move_ids, error = get_epd_move_ids(game_state, best_moves, avoid_moves)
+    if error is not None:
+        return {'move': None, 'score': 0, 'solved': False, 'depth': 0, 'nodes': 0, 'seconds': 0.0,
+                'solution_depth': None, 'solution_seconds': None, 'solution_nodes': None, 'error': error}
+    ai_state = worker_ai_state
+    ai_state.transposition_table.clear()  # the result depends on the position only, not on the previous ones
+    ai_state.new_move_ordering(keep_history=False)
+    ai_state.depth = depth
+
+    def is_solution(move):
+        if move is None:
+            return False
+        if best_moves:
+            return move.moveID in best_move_ids
+        return move.moveID not in avoid_move_ids
+
+    solution = [None]  # (depth, seconds, nodes) of the first iteration of the current run of solutions
+
+    def on_iteration(iteration_depth, score, nodes, seconds):
+        if not is_solution(ai_state.chosen_move):
+            solution[0] = None
+        elif solution[0] is None:
+            solution[0] = (iteration_depth, seconds, nodes)
+
+    statistics = ai_state.start_search(game_state, time_limit=move_time, on_iteration=on_iteration)
+    solved = is_solution(ai_state.chosen_move)
+    solution_depth, solution_seconds, solution_nodes = solution[0] if solved and solution[0] is not None else \
+        (None, None, None)
+    return {'move': statistics.move, 'score': statistics.score, 'solved': solved, 'depth': statistics.depth,
+            'nodes': statistics.nodes, 'seconds': round(statistics.seconds, 6), 'solution_depth': solution_depth,
+            'solution_seconds': None if solution_seconds is None else round(solution_seconds, 6),
+            'solution_nodes': solution_nodes, 'error': None}
+
+
+def run_suite(positions, workers=1, backend='bitboard', depth=ChessAI.MAX_DEPTH, move_time=DEFAULT_MOVE_TIME,
+              hash_size_mb=ChessAI.HASH_SIZE_MB, null_move_pruning=ChessAI.NULL_MOVE_PRUNING,
+              late_move_reductions=ChessAI.LATE_MOVE_REDUCTIONS):
+    # Yields the result of every (line number, EPD line) of 'positions', in the order they finish. Only a few
+    # positions per worker are queued at a time, so that any number of positions can be streamed through the pool
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_epd_worker,
+                             initargs=(hash_size_mb, null_move_pruning, late_move_reductions)) as executor:
+        pending = {}
+        positions = iter(positions)
+        while True:
+            for line_number, line in positions:
+                fen, operations = parse_epd(line)
+                future = executor.submit(solve_position, backend, fen, operations.get('bm', []),
+                                         operations.get('am', []), depth, move_time)
+                pending[future] = {'id': ' '.join(operations.get('id', [])) or f"line {line_number}", 'fen': fen,
+                                   'bm': operations.get('bm', []), 'am': operations.get('am', [])}
+                if len(pending) >= workers * TASKS_PER_WORKER:
+                    break
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = pending.pop(future)
+                result.update(future.result())
+                yield result
+
+
+def print_result(result, as_json):
+    if as_json:
+        print(json.dumps(result), flush=True)
+        return
+    expected = ' '.join(result['bm']) if result['bm'] else 'not ' + ' '.join(result['am'])
+    if result['error'] is not None:
+        print(f"{result['id']:<20} malformed: {result['error']}", flush=True)
+        return
+    if result['solved']:
+        status = (f"solved at depth {result['solution_depth']} in {result['solution_seconds']:.2f} s, "
+                  f"{result['solution_nodes']} nodes") if result['solution_depth'] is not None else "solved"
+    else:
+        status = "unsolved"
+    print(f"{result['id']:<20} {result['move'] or '-':<6} ({expected}) {status}, searched to depth {result['depth']} "
+          f"in {result['seconds']:.2f} s, {result['nodes']} nodes", flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runs the AI over an EPD test suite of 'bm' or 'am' positions")
+    parser.add_argument('epd', help="EPD file, - for the standard input")
+    parser.add_argument('--workers', type=int, default=1, help="positions searched at once")
+    limit_group = parser.add_mutually_exclusive_group()
+    limit_group.add_argument('--move-time', type=float, default=DEFAULT_MOVE_TIME, help="seconds per position")
+    limit_group.add_argument('--depth', type=int, help="fixed search depth instead of a time limit")
+    parser.add_argument('--backend', choices=sorted(ChessBitboard.BACKENDS), default='bitboard')
+    parser.add_argument('--hash-mb', type=int, default=ChessAI.HASH_SIZE_MB, help="per worker")
+    parser.add_argument('--no-null-move', action='store_true', help="search without the null move pruning")
+    parser.add_argument('--no-lmr', action='store_true', help="search without the late move reductions")
+    parser.add_argument('--json', action='store_true', help="print one JSON object per line")
+    args = parser.parse_args(argv)
+    if args.depth is not None and not 1 <= args.depth <= ChessAI.MAX_DEPTH:
+        parser.error(f"--depth must be between 1 and {ChessAI.MAX_DEPTH}")
+
+    depth, move_time = (args.depth, None) if args.depth is not None else (ChessAI.MAX_DEPTH, args.move_time)
+    total = solved = malformed = total_nodes = 0
+    search_seconds = 0.0
+    start_time = time.perf_counter()
+    for result in run_suite(read_epd(args.epd), args.workers, args.backend, depth, move_time, args.hash_mb,
+                            not args.no_null_move, not args.no_lmr):
+        print_result(result, args.json)
+        total += 1
+        solved += result['solved']
+        malformed += result['error'] is not None
+        total_nodes += result['nodes']
+        search_seconds += result['seconds']
+    elapsed = time.perf_counter() - start_time
+
+    summary = {'id': 'total', 'positions': total, 'solved': solved, 'malformed': malformed, 'nodes': total_nodes,
+               'seconds': round(elapsed, 6), 'positions_per_sec': round(total / elapsed, 3) if elapsed > 0 else 0,
+               'nps': round(total_nodes / search_seconds) if search_seconds > 0 else 0}
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        print(f"{solved}/{total} solved, {malformed} malformed, {total_nodes} nodes in {elapsed:.2f} s, "
+              f"{summary['positions_per_sec']} positions/s, {summary['nps']} nps per worker")
+    return 1 if malformed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
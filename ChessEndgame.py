@@ -0,0 +1,296 @@
+import argparse
+import itertools
+import mmap
+import os
+import sys
+import time
+from array import array
+from Chess import ChessBitboard
+from Chess.ChessBitboard import KING_MASKS, KNIGHT_MASKS, PAWN_ATTACK_MASKS, WHITE, bishop_attacks, rook_attacks, \
+    squares_of
+
+# Endgames of a king & pieces (the strong side) against a bare king, in generation order: KPK promotes into KQK & KRK.
+# Each table holds one byte per (side to move, strong king, weak king, strong pieces) square combination, the side to
+# move being 0 when it is the strong side: 0 for a draw or an illegal position, otherwise the number of plies to mate
+# plus 1. The strong side plays up the board (towards row 0) like white, positions are mirrored when it is black.
+ENDGAMES = ['KQK', 'KRK', 'KBNK', 'KPK']
+# the generation is pure Python: the 3-piece tables take about 45 s in all, KBNK, 64 times larger, about 16 min
+DEFAULT_ENDGAMES = ['KQK', 'KRK', 'KPK']
+PIECE_ORDER = 'QRBNP'  # order of the strong pieces in the endgame names
+TABLE_EXTENSION = '.egtb'
+STRONG_TO_MOVE = 0
+WEAK_TO_MOVE = 1
+
+
+def get_table_size(endgame):
+    return 64 ** len(endgame)  # per side to move
+
+
+def get_index(squares):
+    index = 0
+    for sq in squares:
+        index = index * 64 + sq
+    return index
+
+
+def get_squares(index, piece_count):
+    squares = [0] * piece_count
+    for i in range(piece_count - 1, -1, -1):
+        index, squares[i] = divmod(index, 64)
+    return squares
+
+
+def get_attacks(piece, sq, occupied):
+    if piece == 'K':
+        return KING_MASKS[sq]
+    if piece == 'Q':
+        return rook_attacks(sq, occupied) | bishop_attacks(sq, occupied)
+    if piece == 'R':
+        return rook_attacks(sq, occupied)
+    if piece == 'B':
+        return bishop_attacks(sq, occupied)
+    if piece == 'N':
+        return KNIGHT_MASKS[sq]
+    return PAWN_ATTACK_MASKS[WHITE][sq]
+
+
+def get_strong_attacks(strong_pieces, squares, occupied, captured_index=None):
+    # squares attacked by the strong king & pieces, 'squares' being (strong king, weak king, pieces...)
+    attacks = KING_MASKS[squares[0]]
+    for i, piece in enumerate(strong_pieces):
+        if i + 2 != captured_index:
+            attacks |= get_attacks(piece, squares[i + 2], occupied)
+    return attacks
+
+
+def is_valid_placement(strong_pieces, squares):
+    if len(set(squares)) != len(squares) or KING_MASKS[squares[0]] & (1 << squares[1]):
+        return False
+    return all(piece != 'P' or 8 <= squares[i + 2] < 56 for i, piece in enumerate(strong_pieces))
+
+
+def count_weak_king_moves(strong_pieces, squares, occupied):
+    weak_king = squares[1]
+    occupied_without_king = occupied ^ (1 << weak_king)
+    attacks = get_strong_attacks(strong_pieces, squares, occupied_without_king)
+    count = 0
+    for target in squares_of(KING_MASKS[weak_king] & ~attacks):
+        if (1 << target) & occupied:  # capture, only legal if the captured piece was not protected
+            captured_index = squares.index(target)
+            if not (1 << target) & get_strong_attacks(strong_pieces, squares, occupied_without_king, captured_index):
+                count += 1
+        else:
+            count += 1
+    return count, (1 << weak_king) & get_strong_attacks(strong_pieces, squares, occupied) != 0
+
+
+def get_strong_unmoves(strong_pieces, squares, occupied):
+    # squares lists (strong king, weak king, pieces...) of the positions where the strong side just had to play a
+    # quiet move to reach 'squares', the weak king not being in check there
+    weak_king_bit = 1 << squares[1]
+    for i, piece in enumerate('K' + strong_pieces):
+        sq = squares[0] if i == 0 else squares[i + 1]
+        if piece == 'P':
+            sources = 0
+            if sq < 48 and not (1 << (sq + 8)) & occupied:
+                sources |= 1 << (sq + 8)
+                if 32 <= sq < 40 and not (1 << (sq + 16)) & occupied:
+                    sources |= 1 << (sq + 16)
+        elif piece == 'K':
+            sources = KING_MASKS[sq] & ~occupied & ~KING_MASKS[squares[1]]
+        else:
+            sources = get_attacks(piece, sq, occupied) & ~occupied
+        for source in squares_of(sources):
+            previous_squares = list(squares)
+            previous_squares[0 if i == 0 else i + 1] = source
+            previous_occupied = occupied ^ (1 << sq) ^ (1 << source)
+            if not weak_king_bit & get_strong_attacks(strong_pieces, previous_squares, previous_occupied):
+                yield previous_squares
+
+
+def get_weak_unmoves(squares, occupied):
+    for source in squares_of(KING_MASKS[squares[1]] & ~occupied & ~KING_MASKS[squares[0]]):
+        previous_squares = list(squares)
+        previous_squares[1] = source
+        yield previous_squares
+
+
+def get_promotion_plies(squares, occupied, sub_tables):
+    # fewest plies to mate by promoting the pawn of a KPK position, strong side to move
+    pawn = squares[2]
+    if pawn >= 16 or (1 << (pawn - 8)) & occupied:
+        return None
+    best_plies = None
+    for endgame in ('KQK', 'KRK'):
+        value = sub_tables[endgame][get_table_size(endgame) + get_index((squares[0], squares[1], pawn - 8))]
+        if value and (best_plies is None or value < best_plies):
+            best_plies = value  # mated in value - 1 plies after the promotion
+    return best_plies
+
+
+def generate_table(endgame, sub_tables=None, verbose=False):
+    strong_pieces = endgame[1:-1]
+    piece_count = len(endgame)
+    size = get_table_size(endgame)
+    values = bytearray(2 * size)
+    move_counts = bytearray(size)  # weak to move: legal moves not yet known to lose
+    done = bytearray(2 * size)
+    buckets = [array('L') for _ in range(256)]  # positions to process by plies to mate
+
+    start_time = time.perf_counter()
+    for squares in itertools.product(range(64), repeat=piece_count):
+        if not is_valid_placement(strong_pieces, squares):
+            continue
+        index = get_index(squares)
+        occupied = 0
+        for sq in squares:
+            occupied |= 1 << sq
+        count, is_check = count_weak_king_moves(strong_pieces, squares, occupied)
+        move_counts[index] = count
+        if count == 0 and is_check:
+            values[size + index] = 1
+            buckets[0].append(size + index)
+        if not is_check and 'P' in strong_pieces:
+            plies = get_promotion_plies(squares, occupied, sub_tables)
+            if plies is not None:
+                buckets[plies].append(index)  # tentative, a quiet move may mate sooner
+    if verbose:
+        print(f"{endgame}: initialised in {time.perf_counter() - start_time:.1f} s", flush=True)
+
+    # retrograde analysis, positions are processed by increasing distance to mate so the first value found is the
+    # shortest mate for the strong side, and the weak side loses once all its moves are known to lose
+    for plies in range(len(buckets) - 1):
+        for position in buckets[plies]:
+            if done[position] or (values[position] and values[position] != plies + 1):
+                continue
+            values[position] = plies + 1
+            done[position] = 1
+            squares = get_squares(position % size, piece_count)
+            occupied = 0
+            for sq in squares:
+                occupied |= 1 << sq
+            if position >= size:  # the weak side is mated in 'plies', the strong side played the previous move
+                for previous_squares in get_strong_unmoves(strong_pieces, squares, occupied):
+                    previous_position = get_index(previous_squares)
+                    if not values[previous_position]:
+                        values[previous_position] = plies + 2
+                        buckets[plies + 1].append(previous_position)
+            else:  # the strong side mates in 'plies', the weak side played the previous move
+                for previous_squares in get_weak_unmoves(squares, occupied):
+                    previous_position = size + get_index(previous_squares)
+                    if not values[previous_position]:
+                        move_counts[previous_position - size] -= 1
+                        if move_counts[previous_position - size] == 0:
+                            values[previous_position] = plies + 2
+                            buckets[plies + 1].append(previous_position)
+        buckets[plies] = None
+
+    if verbose:
+        wins = sum(1 for value in values[:size] if value)
+        print(f"{endgame}: {wins} won positions with the strong side to move, "
+              f"longest mate {max(values) - 1} plies, {time.perf_counter() - start_time:.1f} s", flush=True)
+    return values
+
+
+def generate_tables(directory, endgames=DEFAULT_ENDGAMES, verbose=False):
+    os.makedirs(directory, exist_ok=True)
+    tables = {}
+    for endgame in ENDGAMES:
+        path = os.path.join(directory, endgame + TABLE_EXTENSION)
+        if endgame in endgames:
+            tables[endgame] = generate_table(endgame, tables, verbose)
+            with open(path, 'wb') as table_file:
+                table_file.write(tables[endgame])
+        elif endgame in ('KQK', 'KRK') and 'KPK' in endgames:  # the pawn promotes into these
+            if os.path.exists(path):
+                with open(path, 'rb') as table_file:
+                    tables[endgame] = table_file.read()
+            else:
+                tables[endgame] = generate_table(endgame, tables, verbose)
+
+
+class EndgameTables:
+    # Memory-mapped tables of the endgames found in 'directory', shared between the processes through the page cache
+    def __init__(self, directory):
+        self.tables = {}
+        for endgame in ENDGAMES:
+            path = os.path.join(directory, endgame + TABLE_EXTENSION)
+            if os.path.exists(path) and os.path.getsize(path) == 2 * get_table_size(endgame):
+                with open(path, 'rb') as table_file:
+                    self.tables[endgame] = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.max_pieces = max((len(endgame) for endgame in self.tables), default=0)  # positions with more aren't probed
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+        self.tables = {}
+        self.max_pieces = 0
+
+    def probe(self, game_state):
+        # (outcome, plies to mate) seen from the side to move, the outcome being 1 for a win, 0 for a draw & -1 for a
+        # loss, None when the position is not in the tables
+        if game_state.pieceCount > self.max_pieces or any(game_state.canOO) or any(game_state.canOOO):
+            return None
+        pieces = {'w': [], 'b': []}
+        for row in range(8):
+            for col in range(8):
+                piece = game_state.board[row][col]
+                if piece != "--":
+                    pieces[piece[0]].append((piece[1], row, col))
+        strong_color = 'w' if len(pieces['w']) > 1 else 'b'
+        weak_color = 'b' if strong_color == 'w' else 'w'
+        if len(pieces[weak_color]) != 1:
+            return None
+        strong_pieces = sorted((piece for piece in pieces[strong_color] if piece[0] != 'K'),
+                               key=lambda piece: PIECE_ORDER.index(piece[0]))
+        endgame = 'K' + ''.join(piece[0] for piece in strong_pieces) + 'K'
+        table = self.tables.get(endgame)
+        if table is None:
+            return None
+
+        def get_square(row, col):
+            return (row if strong_color == 'w' else 7 - row) * 8 + col
+
+        strong_king = next(piece for piece in pieces[strong_color] if piece[0] == 'K')
+        weak_king = pieces[weak_color][0]
+        squares = [get_square(strong_king[1], strong_king[2]), get_square(weak_king[1], weak_king[2])]
+        squares.extend(get_square(row, col) for _, row, col in strong_pieces)
+        strong_to_move = game_state.whiteToMove == (strong_color == 'w')
+        value = table[(STRONG_TO_MOVE if strong_to_move else WEAK_TO_MOVE) * get_table_size(endgame) +
+                      get_index(squares)]
+        if value == 0:
+            return 0, 0
+        return (1 if strong_to_move else -1), value - 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Endgame tables generator & viewer")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    generate_parser = subparsers.add_parser('generate', help="build the tables by retrograde analysis")
+    generate_parser.add_argument('directory')
+    generate_parser.add_argument('--endgame', action='append', choices=ENDGAMES,
+                                 help="endgame to build, can be repeated. By default the 3-piece ones, about 45 s in "
+                                      "all; KBNK takes about 16 min")
+    probe_parser = subparsers.add_parser('probe', help="look a position up")
+    probe_parser.add_argument('directory')
+    probe_parser.add_argument('fen')
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        generate_tables(args.directory, args.endgame or DEFAULT_ENDGAMES, verbose=True)
+        return 0
+
+    tables = EndgameTables(args.directory)
+    result = tables.probe(ChessBitboard.GameState(args.fen))
+    if result is None:
+        print("not in the tables")
+    elif result[0] == 0:
+        print("draw")
+    else:
+        print(f"{'win' if result[0] > 0 else 'loss'}, mate in {result[1]} plies")
+    tables.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,55 @@
+import random
+
 MOVES_TILL_STALEMATE = 75
+PROMOTION_PIECES = ['Q', 'R', 'B', 'N']
+GEN_ALL = 0  # move generation types
+GEN_CAPTURES = 1  # captures, including en passant & capturing promotions
+GEN_QUIETS = 2  # everything else, including castling & pushing promotions
+
+# Zobrist keys, drawn from a fixed seed so that every process hashes positions the same way
+ZOBRIST_SEED = 20231
+_zobrist_random = random.Random(ZOBRIST_SEED)
+ZOBRIST_PIECES = {piece: [_zobrist_random.getrandbits(64) for _ in range(64)]
+                  for piece in ['wP', 'wR', 'wN', 'wB', 'wQ', 'wK', 'bP', 'bR', 'bN', 'bB', 'bQ', 'bK']}
+ZOBRIST_BLACK_TO_MOVE = _zobrist_random.getrandbits(64)
+ZOBRIST_EN_PASSANT_FILES = [_zobrist_random.getrandbits(64) for _ in range(8)]
+_zobrist_castling_rights = [_zobrist_random.getrandbits(64) for _ in range(4)]  # white OO, black OO, white OOO, black OOO
+ZOBRIST_CASTLING = {((w_oo, b_oo), (w_ooo, b_ooo)): (_zobrist_castling_rights[0] if w_oo else 0) ^
+                    (_zobrist_castling_rights[1] if b_oo else 0) ^ (_zobrist_castling_rights[2] if w_ooo else 0) ^
+                    (_zobrist_castling_rights[3] if b_ooo else 0)
+                    for w_oo in (False, True) for b_oo in (False, True) for w_ooo in (False, True) for b_ooo in (False, True)}
+
+# Squares reached from every square, [row][col] -> list of (row, col), precomputed for move generation & attack queries
+KNIGHT_DIRECTIONS = [(-2, 1), (-1, 2), (1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1)]
+KING_DIRECTIONS = [(-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1)]
+ROOK_DIRECTIONS = [(-1, 0), (0, 1), (1, 0), (0, -1)]
+BISHOP_DIRECTIONS = [(-1, 1), (1, 1), (1, -1), (-1, -1)]
+
+
+def build_step_targets(directions):
+    return [[[(r + dr, c + dc) for dr, dc in directions if 0 <= r + dr <= 7 and 0 <= c + dc <= 7]
+             for c in range(8)] for r in range(8)]
+
+
+def build_rays(directions):
+    # one list of squares per direction, ordered from the nearest, empty rays are left out
+    rays = [[[] for _ in range(8)] for _ in range(8)]
+    for r in range(8):
+        for c in range(8):
+            for dr, dc in directions:
+                ray = [(r + dr * i, c + dc * i) for i in range(1, 8)
+                       if 0 <= r + dr * i <= 7 and 0 <= c + dc * i <= 7]
+                if ray:
+                    rays[r][c].append(ray)
+    return rays
+
+
+KNIGHT_TARGETS = build_step_targets(KNIGHT_DIRECTIONS)
+KING_TARGETS = build_step_targets(KING_DIRECTIONS)
+PAWN_ATTACKS = {'w': build_step_targets([(-1, -1), (-1, 1)]), 'b': build_step_targets([(1, -1), (1, 1)])}
+ROOK_RAYS = build_rays(ROOK_DIRECTIONS)
+BISHOP_RAYS = build_rays(BISHOP_DIRECTIONS)
+QUEEN_RAYS = [[ROOK_RAYS[r][c] + BISHOP_RAYS[r][c] for c in range(8)] for r in range(8)]
 
 
 class GameState:
@@ -6,19 +57,25 @@ class GameState:
                    'wP': 'P', 'wR': 'R', 'wN': 'N', 'wB': 'B', 'wQ': 'Q', 'wK': 'K'}
     FENToPieces = {v: k for k, v in PiecesToFEN.items()}
 
-    def __init__(self):
+    def __init__(self, fen=None):
         self.moveFunctions = {'P': self.get_pawn_moves, 'R': self.get_rook_moves, 'N': self.get_knight_moves,
                               'B': self.get_bishop_moves, 'Q': self.get_queen_moves, 'K': self.get_king_moves}
 
         self.FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
         self.FEN = "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8"
+        if fen is not None:
+            self.FEN = fen
         self.board, self.kingPosition, self.whiteToMove, self.canOO, self.canOOO, \
             self.enPassantTarget, self.moveRuleCount = self.get_board_from_fen(self.FEN)
-        self.Zobrist: int = 0
         self.moveLog = []
         self.notationMoveLog = []
         self.moveRuleLog = [int(self.moveRuleCount)]
         self.castlingRightsLog = [((self.canOO[0], self.canOO[1]), (self.canOOO[0], self.canOOO[1]))]  # initialize the castling rights log
+        self.Zobrist: int = self.compute_zobrist_key()
+        self.zobristLog = []
+        self.pieceCount = sum(piece != "--" for row in self.board for piece in row)  # updated by make/undo move
+        self.pieceSquareValues = None  # {piece: [64 signed values]}, enables the incremental score when set
+        self.score = 0
 
         self.selectedSquare = ()
         self.pinnedPieces = []
@@ -29,6 +86,10 @@ class GameState:
         self.isStaleMate = False
 
     def make_move(self, move, valid_moves=None):
+        # remove the castling rights & en passant keys of the current position, the new ones are added back below
+        self.zobristLog.append(self.Zobrist)
+        zobrist_key = self.Zobrist ^ ZOBRIST_CASTLING[self.castlingRightsLog[-1]] ^ self.get_zobrist_en_passant_key()
+
         self.board[move.startRow][move.startCol] = '--'
         self.board[move.endRow][move.endCol] = move.pieceMoved
 
@@ -37,7 +98,7 @@ class GameState:
         castling_oo = move.isCastling_OO
         castling_ooo = move.isCastling_OOO
         if promoting:
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + "Q"
+            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + move.promotionPiece
         if en_passant:
             self.board[move.startRow][move.endCol] = '--'
         if castling_oo:
@@ -52,6 +113,8 @@ class GameState:
 
         self.update_castling_rights(move)
 
+        if move.pieceCaptured != "--":
+            self.pieceCount -= 1
         if move.pieceCaptured == "--" and move.pieceMoved[1] != "P":  # not a capture nor a pawn move
             moves_count = int(self.moveRuleLog[-1])
             self.moveRuleLog.append(moves_count + 1)
@@ -62,9 +125,15 @@ class GameState:
 
         self.whiteToMove = not self.whiteToMove
 
+        if self.pieceSquareValues is not None:
+            self.score += self.get_move_score_delta(move)
+
         # add move to move log
         self.moveLog.append(move)
 
+        self.Zobrist = zobrist_key ^ self.get_zobrist_move_key(move) ^ ZOBRIST_BLACK_TO_MOVE ^ \
+            ZOBRIST_CASTLING[self.castlingRightsLog[-1]] ^ self.get_zobrist_en_passant_key()
+
         # add move to notation move log
         move_from_prefix = ""
         if valid_moves:
@@ -84,6 +153,11 @@ class GameState:
             self.moveRuleLog.pop()
             self.moveRuleCount = int(self.moveRuleLog[-1])
             move = self.moveLog.pop()
+            self.Zobrist = self.zobristLog.pop()
+            if move.pieceCaptured != "--":
+                self.pieceCount += 1
+            if self.pieceSquareValues is not None:
+                self.score -= self.get_move_score_delta(move)
             if len(self.notationMoveLog) != 0:
                 self.isCheck = (self.notationMoveLog[-1][-1] == "+")
             self.whiteToMove = not self.whiteToMove
@@ -109,16 +183,107 @@ class GameState:
             if move.pieceMoved[1] == "K":
                 self.kingPosition[1 - self.whiteToMove] = (move.startRow, move.startCol)
 
+    def make_null_move(self):
+        # passes the turn, for the null move pruning of the search: nothing moves & en passant is no longer possible
+        self.zobristLog.append(self.Zobrist)
+        self.Zobrist ^= ZOBRIST_BLACK_TO_MOVE ^ self.get_zobrist_en_passant_key()
+        self.moveRuleLog.append(self.moveRuleLog[-1] + 1)
+        self.moveRuleCount = self.moveRuleLog[-1]
+        self.whiteToMove = not self.whiteToMove
+        self.moveLog.append(NULL_MOVE)
+        self.notationMoveLog.append("--")
+
+    def undo_null_move(self):
+        self.notationMoveLog.pop()
+        self.moveLog.pop()
+        self.whiteToMove = not self.whiteToMove
+        self.moveRuleLog.pop()
+        self.moveRuleCount = self.moveRuleLog[-1]
+        self.Zobrist = self.zobristLog.pop()
+        self.isCheck = False  # a null move is only made when not in check
+
+    def has_non_pawn_material(self):
+        # whether the side to move has a piece other than its king & pawns
+        own_color = "w" if self.whiteToMove else "b"
+        return any(piece[0] == own_color and piece[1] not in "PK" for row in self.board for piece in row)
+
+    def get_en_passant_file(self):
+        if len(self.moveLog) > 0:
+            last_move = self.moveLog[-1]
+            if last_move.pieceMoved[1] == "P" and abs(last_move.endRow - last_move.startRow) == 2:
+                return last_move.endCol
+            return None
+        if self.enPassantTarget != '-':
+            return Move.filesToCols[self.enPassantTarget[0]]
+        return None
+
+    def get_zobrist_en_passant_key(self):
+        en_passant_file = self.get_en_passant_file()
+        return 0 if en_passant_file is None else ZOBRIST_EN_PASSANT_FILES[en_passant_file]
+
+    @staticmethod
+    def get_zobrist_move_key(move):
+        start_sq = move.startRow * 8 + move.startCol
+        end_sq = move.endRow * 8 + move.endCol
+        color = move.pieceMoved[0]
+        key = ZOBRIST_PIECES[move.pieceMoved][start_sq]
+        key ^= ZOBRIST_PIECES[color + move.promotionPiece][end_sq] if move.isPromotion else ZOBRIST_PIECES[move.pieceMoved][end_sq]
+        if move.pieceCaptured != "--":
+            captured_sq = move.startRow * 8 + move.endCol if move.isEnPassant else end_sq
+            key ^= ZOBRIST_PIECES[move.pieceCaptured][captured_sq]
+        if move.isCastling_OO:
+            key ^= ZOBRIST_PIECES[color + "R"][end_sq + 1] ^ ZOBRIST_PIECES[color + "R"][end_sq - 1]
+        elif move.isCastling_OOO:
+            key ^= ZOBRIST_PIECES[color + "R"][end_sq - 2] ^ ZOBRIST_PIECES[color + "R"][end_sq + 1]
+        return key
+
+    def compute_zobrist_key(self):
+        key = 0
+        for r in range(len(self.board)):
+            for c in range(len(self.board[r])):
+                if self.board[r][c] != '--':
+                    key ^= ZOBRIST_PIECES[self.board[r][c]][r * 8 + c]
+        if not self.whiteToMove:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_CASTLING[self.castlingRightsLog[-1]]
+        key ^= self.get_zobrist_en_passant_key()
+        return key
+
+    def set_piece_square_values(self, piece_square_values):
+        self.pieceSquareValues = piece_square_values
+        self.score = 0
+        for r in range(len(self.board)):
+            for c in range(len(self.board[r])):
+                self.score += piece_square_values[self.board[r][c]][r * 8 + c]
+
+    def get_move_score_delta(self, move):
+        values = self.pieceSquareValues
+        start_sq = move.startRow * 8 + move.startCol
+        end_sq = move.endRow * 8 + move.endCol
+        piece_after = move.pieceMoved[0] + move.promotionPiece if move.isPromotion else move.pieceMoved
+        delta = values[piece_after][end_sq] - values[move.pieceMoved][start_sq]
+        if move.pieceCaptured != "--":
+            captured_sq = move.startRow * 8 + move.endCol if move.isEnPassant else end_sq
+            delta -= values[move.pieceCaptured][captured_sq]
+        if move.isCastling_OO:
+            rook = move.pieceMoved[0] + "R"
+            delta += values[rook][end_sq - 1] - values[rook][end_sq + 1]
+        elif move.isCastling_OOO:
+            rook = move.pieceMoved[0] + "R"
+            delta += values[rook][end_sq + 1] - values[rook][end_sq - 2]
+        return delta
+
     def update_castling_rights(self, move):
+        own_back_row = 7 if self.whiteToMove else 0
         if move.pieceMoved[1] == "K":  # update own castling rights
             self.canOO[1 - self.whiteToMove] = False
             self.canOOO[1 - self.whiteToMove] = False
-        elif move.pieceMoved[1] == "R":  # update own castling rights
+        elif move.pieceMoved[1] == "R" and move.startRow == own_back_row:  # update own castling rights
             if move.startCol == 7:
                 self.canOO[1 - self.whiteToMove] = False
             elif move.startCol == 0:
                 self.canOOO[1 - self.whiteToMove] = False
-        elif move.pieceCaptured[1] == "R":  # update opponent castling rights
+        if move.pieceCaptured[1] == "R" and move.endRow == 7 - own_back_row:  # update opponent castling rights
             if move.endCol == 7 and self.canOO[self.whiteToMove]:
                 self.canOO[self.whiteToMove] = False
             elif move.endCol == 0 and self.canOOO[self.whiteToMove]:
@@ -136,78 +301,46 @@ class GameState:
         self.canOOO = [castle_rights[1][0], castle_rights[1][1]]
 
     def get_pinned_and_checking_pieces(self):
+        # pins & checks are stored as (row, col, piece, row direction, col direction) seen from the king
         pinned_pieces = []
         checking_pieces = []
+        board = self.board
         if self.whiteToMove:
-            king_position = self.kingPosition[0]
+            king_row, king_col = self.kingPosition[0]
             opposite_color = "b"
             ally_color = "w"
-            sign_direction = -1
         else:
-            king_position = self.kingPosition[1]
+            king_row, king_col = self.kingPosition[1]
             opposite_color = "w"
             ally_color = "b"
-            sign_direction = 1
 
-        list_directions = [[(-1, 0), (0, 1), (1, 0), (0, -1)], [(-1, 1), (1, 1), (1, -1), (-1, -1)]]
-        list_attacking_pieces = [["R", "Q"], ["B", "Q"]]
-        for directions in list_directions:
-            attacking_pieces = list_attacking_pieces[list_directions.index(directions)]
-            for direction in directions:
-                count_ally_pieces = 0
-                possible_pinned_piece = ()
-                for i in range(1, 8):
-                    new_row = king_position[0] + direction[0] * i
-                    new_col = king_position[1] + direction[1] * i
-                    if 0 <= new_row <= 7 and 0 <= new_col <= 7:
-                        new_piece = self.board[new_row][new_col]
-                        if new_piece[0] == opposite_color:
-                            if new_piece[1] in attacking_pieces:
-                                if count_ally_pieces == 1:
-                                    pinned_pieces.append(possible_pinned_piece)
-                                    break
-                                else:
-                                    checking_pieces.append((new_row, new_col, new_piece[1], direction[0], direction[1]))
+        for rays, attacking_pieces in ((ROOK_RAYS, "RQ"), (BISHOP_RAYS, "BQ")):
+            for ray in rays[king_row][king_col]:
+                possible_pinned_piece = None
+                for new_row, new_col in ray:
+                    new_piece = board[new_row][new_col]
+                    if new_piece[0] == opposite_color:
+                        if new_piece[1] in attacking_pieces:
+                            if possible_pinned_piece is not None:
+                                pinned_pieces.append(possible_pinned_piece)
                             else:
-                                break
-                        elif new_piece[0] == ally_color:
-                            count_ally_pieces = count_ally_pieces + 1
-                            if count_ally_pieces == 1:
-                                possible_pinned_piece = (new_row, new_col, new_piece[1], direction[0], direction[1])
-                            else:
-                                break
-                    else:
+                                checking_pieces.append((new_row, new_col, new_piece[1], ray[0][0] - king_row,
+                                                        ray[0][1] - king_col))
                         break
+                    elif new_piece[0] == ally_color:
+                        if possible_pinned_piece is not None:
+                            break
+                        possible_pinned_piece = (new_row, new_col, new_piece[1], ray[0][0] - king_row, ray[0][1] - king_col)
+
+        # Knights, King & Pawns (only for checks)
+        for targets, attacking_piece in ((KNIGHT_TARGETS[king_row][king_col], opposite_color + "N"),
+                                         (KING_TARGETS[king_row][king_col], opposite_color + "K"),
+                                         (PAWN_ATTACKS[ally_color][king_row][king_col], opposite_color + "P")):
+            for new_row, new_col in targets:
+                if board[new_row][new_col] == attacking_piece:
+                    checking_pieces.append((new_row, new_col, attacking_piece[1], new_row - king_row, new_col - king_col))
 
-        # Separate process for Knights & King (only for checks)
-        list_directions = [[(-2, 1), (-1, 2), (1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1)],
-                           [(-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1)]]
-        list_attacking_pieces = ["N", "K"]
-        for directions in list_directions:
-            attacking_piece = list_attacking_pieces[list_directions.index(directions)]
-            for direction in directions:
-                new_row = king_position[0] + direction[0]
-                new_col = king_position[1] + direction[1]
-                if 0 <= new_row <= 7 and 0 <= new_col <= 7:
-                    new_piece = self.board[new_row][new_col]
-                    if new_piece[0] == opposite_color and new_piece[1] == attacking_piece:
-                        checking_pieces.append((new_row, new_col, new_piece[1], direction[0], direction[1]))
-
-        # Separate process for Pawns (only for checks)
-        directions = [-1, 1]
-        for direction in directions:
-            new_row = king_position[0] + sign_direction
-            new_col = king_position[1] + direction
-            if 0 <= new_row <= 7 and 0 <= new_col <= 7:
-                new_piece = self.board[new_row][new_col]
-                if new_piece == opposite_color + 'P':
-                    checking_pieces.append((new_row, new_col, new_piece[1], sign_direction, direction))
-
-        is_in_check = False
-        if len(checking_pieces) > 0:
-            is_in_check = True
-
-        return pinned_pieces, checking_pieces, is_in_check
+        return pinned_pieces, checking_pieces, len(checking_pieces) > 0
 
     def is_move_valid(self, move):
         piece_to_move = move.pieceMoved
@@ -223,20 +356,28 @@ class GameState:
             opposite_color = "w"
 
         is_valid = False
-        if piece_to_move[1] == "K" or move.isEnPassant:
-            potential_move = Move((row_from, col_from), (row_to, col_to), self.board, move.isPromotion, move.isEnPassant)
-            self.make_move(potential_move)
-            self.whiteToMove = not self.whiteToMove
-            unused_pins, unused_check, potential_check = self.get_pinned_and_checking_pieces()
-            if not potential_check:
-                is_valid = True
-            self.whiteToMove = not self.whiteToMove
-            self.undo_move()
+        if piece_to_move[1] == "K":
+            # lift the king so that it does not shield the squares behind it from a sliding attacker
+            self.board[row_from][col_from] = "--"
+            is_valid = not self.is_square_attacked(row_to, col_to, opposite_color)
+            self.board[row_from][col_from] = piece_to_move
+        elif move.isEnPassant:
+            # both pawns leave the row of the king, set up the resulting squares and look at the king only
+            captured_piece = self.board[row_from][col_to]
+            self.board[row_from][col_from] = "--"
+            self.board[row_from][col_to] = "--"
+            self.board[row_to][col_to] = piece_to_move
+            is_valid = not self.is_square_attacked(king_row, king_col, opposite_color)
+            self.board[row_to][col_to] = "--"
+            self.board[row_from][col_to] = captured_piece
+            self.board[row_from][col_from] = piece_to_move
         else:
             if len(self.checkingPieces) > 1:  # Double check, only K can move
                 is_valid = False
             elif len(self.checkingPieces) == 1:  # Single check, piece can try to eat or block
-                if self.checkingPieces[0][2] == "N":  # Can only try to eat
+                if any(row_from == pinned[0] and col_from == pinned[1] for pinned in self.pinnedPieces):
+                    is_valid = False  # a pinned piece can neither eat nor block a checking piece
+                elif self.checkingPieces[0][2] == "N":  # Can only try to eat
                     if row_to == self.checkingPieces[0][0] and col_to == self.checkingPieces[0][1]:
                         is_valid = True
                 else:
@@ -284,32 +425,120 @@ class GameState:
                 valid_moves.append(move)
         # print(f"{len(valid_moves)} valid moves")
 
+        self.update_end_of_game_state(valid_moves)
+
+        return valid_moves
+
+    def update_end_of_game_state(self, valid_moves):
         if not valid_moves:
             if self.isCheck:
                 self.isCheckMate = True
-                self.notationMoveLog[-1] = self.notationMoveLog[-1] + "#"
+                if self.notationMoveLog and not self.notationMoveLog[-1].endswith("#"):
+                    self.notationMoveLog[-1] = self.notationMoveLog[-1] + "#"
             else:
                 self.isStaleMate = True
         else:
-            if self.isCheck:
+            if self.isCheck and self.notationMoveLog and not self.notationMoveLog[-1].endswith("+"):
                 self.notationMoveLog[-1] = self.notationMoveLog[-1] + "+"
             if self.moveRuleLog[-1] == MOVES_TILL_STALEMATE:
                 self.isStaleMate = True
 
-        return valid_moves
-
-    def get_all_possible_moves(self):
+    def get_all_possible_moves(self, gen_type=GEN_ALL):
         moves = []
         for r in range(len(self.board)):
             for c in range(len(self.board[r])):
                 turn = self.board[r][c][0]
                 if (turn == "w" and self.whiteToMove) or (turn == "b" and not self.whiteToMove):
                     piece = self.board[r][c][1]
-                    moves = moves + self.moveFunctions[piece](r, c)
+                    self.moveFunctions[piece](r, c, gen_type, moves)
         return moves
 
-    def get_pawn_moves(self, r, c):
-        moves = []
+    def get_legal_moves(self, gen_type=GEN_ALL, square=None, pins_and_checks=None):
+        # legal moves of the given type, only those of the piece on 'square' when given, without any end of game update
+        # the pins & checks of the position are looked for unless given as (pinned, checking, is check)
+        self.pinnedPieces, self.checkingPieces, self.isCheck = \
+            pins_and_checks if pins_and_checks is not None else self.get_pinned_and_checking_pieces()
+        if square is None:
+            possible_moves = self.get_all_possible_moves(gen_type)
+        elif self.board[square[0]][square[1]][0] == ("w" if self.whiteToMove else "b"):
+            possible_moves = self.moveFunctions[self.board[square[0]][square[1]][1]](square[0], square[1], gen_type)
+        else:
+            possible_moves = []
+        return [move for move in possible_moves if self.is_move_valid(move)]
+
+    def get_valid_capture_moves(self):
+        return self.get_legal_moves(GEN_CAPTURES)
+
+    def generate_moves_staged(self, hash_move_id=None, capture_order=None, quiet_order=None):
+        # Yields the hash move, then the captures, then the quiet moves: a cut-off in the search stops the generation
+        # before the next stage. Each stage generates all the legal moves of its type at once, sorted by decreasing
+        # 'capture_order' & 'quiet_order' keys when given. The pins & checks are looked for by the first stage only:
+        # the searches of the moves in between overwrite them in the game state, so they are kept & handed back
+        hash_move = None
+        pins_and_checks = None
+        if hash_move_id is not None:
+            moves = self.get_legal_moves(GEN_ALL, Move.get_start_square_from_id(hash_move_id))
+            pins_and_checks = self.pinnedPieces, self.checkingPieces, self.isCheck
+            hash_move = next((move for move in moves if move.moveID == hash_move_id), None)
+            if hash_move is not None:
+                yield hash_move
+        for gen_type, order in ((GEN_CAPTURES, capture_order), (GEN_QUIETS, quiet_order)):
+            moves = self.get_legal_moves(gen_type, pins_and_checks=pins_and_checks)
+            pins_and_checks = self.pinnedPieces, self.checkingPieces, self.isCheck
+            if order is not None:
+                moves.sort(key=order, reverse=True)
+            for move in moves:
+                if move != hash_move:
+                    yield move
+
+    def has_any_legal_move(self):
+        self.pinnedPieces, self.checkingPieces, self.isCheck = self.get_pinned_and_checking_pieces()
+        own_color = "w" if self.whiteToMove else "b"
+        king_row, king_col = self.kingPosition[1 - self.whiteToMove]
+        if any(self.is_move_valid(move) for move in self.get_king_moves(king_row, king_col)):
+            return True
+        for r in range(len(self.board)):
+            for c in range(len(self.board[r])):
+                if self.board[r][c][0] == own_color and self.board[r][c][1] != "K":
+                    if any(self.is_move_valid(move) for move in self.moveFunctions[self.board[r][c][1]](r, c)):
+                        return True
+        return False
+
+    def is_in_check(self):
+        king_row, king_col = self.kingPosition[1 - self.whiteToMove]
+        return self.is_square_attacked(king_row, king_col, "b" if self.whiteToMove else "w")
+
+    def is_square_attacked(self, row, col, by_color):
+        board = self.board
+        # a pawn attacks this square from the squares a pawn of the other color would attack
+        pawn = by_color + "P"
+        for r, c in PAWN_ATTACKS["b" if by_color == "w" else "w"][row][col]:
+            if board[r][c] == pawn:
+                return True
+
+        knight = by_color + "N"
+        for r, c in KNIGHT_TARGETS[row][col]:
+            if board[r][c] == knight:
+                return True
+        king = by_color + "K"
+        for r, c in KING_TARGETS[row][col]:
+            if board[r][c] == king:
+                return True
+
+        for rays, attacking_pieces in ((ROOK_RAYS, "RQ"), (BISHOP_RAYS, "BQ")):
+            for ray in rays[row][col]:
+                for r, c in ray:
+                    piece = board[r][c]
+                    if piece != "--":
+                        if piece[0] == by_color and piece[1] in attacking_pieces:
+                            return True
+                        break
+
+        return False
+
+    def get_pawn_moves(self, r, c, gen_type=GEN_ALL, moves=None):
+        if moves is None:
+            moves = []
         if self.whiteToMove:
             opposite_color = "b"
             sign_direction = -1
@@ -322,123 +551,105 @@ class GameState:
         # check if the potential move will get to a promotion
         got_to_backend_row = (r + 1 * sign_direction == pawn_starting_row + 6 * sign_direction)
 
-        if self.board[r + 1 * sign_direction][c] == "--":  # Move up
-            moves.append(Move((r, c), (r + 1 * sign_direction, c), self.board, got_to_backend_row))
+        if self.board[r + 1 * sign_direction][c] == "--" and gen_type != GEN_CAPTURES:  # Move up
+            self.add_pawn_moves(moves, (r, c), (r + 1 * sign_direction, c), got_to_backend_row)
             if r == pawn_starting_row and self.board[r + 2 * sign_direction][c] == "--":
                 moves.append(Move((r, c), (r + 2 * sign_direction, c), self.board))
-        if c - 1 >= 0:  # Capture on one side
-            if self.board[r + 1 * sign_direction][c - 1][0] == opposite_color:
-                moves.append(Move((r, c), (r + 1 * sign_direction, c - 1), self.board, got_to_backend_row))
-        if c + 1 <= 7:  # Capture on the other side
-            if self.board[r + 1 * sign_direction][c + 1][0] == opposite_color:
-                moves.append(Move((r, c), (r + 1 * sign_direction, c + 1), self.board, got_to_backend_row))
+        if gen_type == GEN_QUIETS:
+            return moves
+        for new_row, new_col in PAWN_ATTACKS["w" if self.whiteToMove else "b"][r][c]:  # Captures
+            if self.board[new_row][new_col][0] == opposite_color:
+                self.add_pawn_moves(moves, (r, c), (new_row, new_col), got_to_backend_row)
 
         # Add potential en passant moves
-        if len(self.moveLog) > 0:
-            last_move: Move = self.moveLog[-1]
-            piece_moved = last_move.pieceMoved
-            piece_moved_row = last_move.endRow
-            piece_moved_col = last_move.endCol
-            piece_from_row = last_move.startRow
-            if piece_moved[1] == "P":
-                if abs(piece_moved_col - c) == 1 and abs(piece_moved_row - piece_from_row) == 2:
-                    if r == pawn_starting_row + 3 * sign_direction:
-                        moves.append(Move((r, c), (r + 1 * sign_direction, piece_moved_col), self.board, False, True))
-                        # self.enPassantTarget = (r + 1 * sign_direction, piece_moved_col)
+        en_passant_file = self.get_en_passant_file()
+        if en_passant_file is not None and abs(en_passant_file - c) == 1:
+            if r == pawn_starting_row + 3 * sign_direction:
+                moves.append(Move((r, c), (r + 1 * sign_direction, en_passant_file), self.board, False, True))
 
         return moves
 
-    def get_rook_moves(self, r, c):
-        moves = []
-        directions = [(-1, 0), (0, 1), (1, 0), (0, -1)]
-        opposite_color = "w"
-        if self.whiteToMove:
-            opposite_color = "b"
-
-        for direction in directions:
-            for i in range(1, 8):
-                new_row = r + direction[0] * i
-                new_col = c + direction[1] * i
-                if 0 <= new_row <= 7 and 0 <= new_col <= 7:
-                    if self.board[new_row][new_col] == "--":
-                        moves.append(Move((r, c), (new_row, new_col), self.board))
-                    elif self.board[new_row][new_col][0] == opposite_color:
-                        moves.append(Move((r, c), (new_row, new_col), self.board))
-                        break
-                    else:
-                        break
+    def add_pawn_moves(self, moves, start_square, end_square, is_promotion):
+        if is_promotion:
+            for promotion_piece in PROMOTION_PIECES:
+                moves.append(Move(start_square, end_square, self.board, True, promotion_piece=promotion_piece))
+        else:
+            moves.append(Move(start_square, end_square, self.board))
 
-        return moves
+    def get_rook_moves(self, r, c, gen_type=GEN_ALL, moves=None):
+        return self.get_sliding_moves(r, c, ROOK_RAYS[r][c], gen_type, moves)
 
-    def get_knight_moves(self, r, c):
-        moves = []
-        directions = [(-2, 1), (-1, 2), (1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1)]
-        own_color = "b"
-        if self.whiteToMove:
-            own_color = "w"
+    def get_knight_moves(self, r, c, gen_type=GEN_ALL, moves=None):
+        if moves is None:
+            moves = []
+        board = self.board
+        own_color = "w" if self.whiteToMove else "b"
 
-        for direction in directions:
-            if 0 <= r + direction[0] <= 7 and 0 <= c + direction[1] <= 7:
-                if self.board[r + direction[0]][c + direction[1]][0] != own_color:
-                    moves.append(Move((r, c), (r + direction[0], c + direction[1]), self.board))
+        for new_row, new_col in KNIGHT_TARGETS[r][c]:
+            target = board[new_row][new_col]
+            if target[0] != own_color and (gen_type == GEN_ALL or (target == "--") == (gen_type == GEN_QUIETS)):
+                moves.append(Move((r, c), (new_row, new_col), board))
 
         return moves
 
-    def get_bishop_moves(self, r, c):
-        moves = []
-        directions = [(-1, 1), (1, 1), (1, -1), (-1, -1)]
-        opposite_color = "w"
-        if self.whiteToMove:
-            opposite_color = "b"
-
-        for direction in directions:
-            for i in range(1, 8):
-                new_row = r + direction[0] * i
-                new_col = c + direction[1] * i
-                if 0 <= new_row <= 7 and 0 <= new_col <= 7:
-                    if self.board[new_row][new_col] == "--":
-                        moves.append(Move((r, c), (new_row, new_col), self.board))
-                    elif self.board[new_row][new_col][0] == opposite_color:
-                        moves.append(Move((r, c), (new_row, new_col), self.board))
-                        break
-                    else:
-                        break
-
-        return moves
+    def get_bishop_moves(self, r, c, gen_type=GEN_ALL, moves=None):
+        return self.get_sliding_moves(r, c, BISHOP_RAYS[r][c], gen_type, moves)
+
+    def get_queen_moves(self, r, c, gen_type=GEN_ALL, moves=None):
+        return self.get_sliding_moves(r, c, QUEEN_RAYS[r][c], gen_type, moves)
+
+    def get_sliding_moves(self, r, c, rays, gen_type=GEN_ALL, moves=None):
+        if moves is None:
+            moves = []
+        board = self.board
+        opposite_color = "b" if self.whiteToMove else "w"
+
+        for ray in rays:
+            for new_row, new_col in ray:
+                target = board[new_row][new_col]
+                if target == "--":
+                    if gen_type != GEN_CAPTURES:
+                        moves.append(Move((r, c), (new_row, new_col), board))
+                elif target[0] == opposite_color:
+                    if gen_type != GEN_QUIETS:
+                        moves.append(Move((r, c), (new_row, new_col), board))
+                    break
+                else:
+                    break
 
-    def get_queen_moves(self, r, c):
-        moves = []
-        moves = moves + self.get_rook_moves(r, c)
-        moves = moves + self.get_bishop_moves(r, c)
         return moves
 
-    def get_king_moves(self, r, c):
-        moves = []
-        directions = [(-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1)]
+    def get_king_moves(self, r, c, gen_type=GEN_ALL, moves=None):
+        if moves is None:
+            moves = []
         if self.whiteToMove:
             own_color = "w"
+            opposite_color = "b"
             is_oo_possible = self.canOO[0]
             is_ooo_possible = self.canOOO[0]
         else:
             own_color = "b"
+            opposite_color = "w"
             is_oo_possible = self.canOO[1]
             is_ooo_possible = self.canOOO[1]
 
-        for direction in directions:
-            if 0 <= r + direction[0] <= 7 and 0 <= c + direction[1] <= 7:
-                if self.board[r + direction[0]][c + direction[1]][0] != own_color:
-                    moves.append(Move((r, c), (r + direction[0], c + direction[1]), self.board))
+        for new_row, new_col in KING_TARGETS[r][c]:
+            target = self.board[new_row][new_col]
+            if target[0] != own_color and (gen_type == GEN_ALL or (target == "--") == (gen_type == GEN_QUIETS)):
+                moves.append(Move((r, c), (new_row, new_col), self.board))
 
         # Add potential castling
+        is_oo_possible = is_oo_possible and self.board[r][7] == own_color + "R" and gen_type != GEN_CAPTURES
+        is_ooo_possible = is_ooo_possible and self.board[r][0] == own_color + "R" and gen_type != GEN_CAPTURES
         if is_oo_possible:
             if all(self.board[r][c_step] == "--" for c_step in range(c + 1, 7)):
-                if all(self.is_move_valid(Move((r, c), (r, c_step), self.board)) for c_step in range(c, 7)):
+                if not any(self.is_square_attacked(r, c_step, opposite_color) for c_step in range(c, 7)):
                     moves.append(Move((r, c), (r, c + 2), self.board, False, False, (True, False)))
                     # print("Castle King side possible")
 
         if is_ooo_possible:
-            if all(self.board[r][c_step] == "--" for c_step in range(2, c)):
-                if all(self.is_move_valid(Move((r, c), (r, c_step), self.board)) for c_step in range(2, c + 1)):
+            if all(self.board[r][c_step] == "--" for c_step in range(1, c)):
+                if not any(self.is_square_attacked(r, c_step, opposite_color) for c_step in range(2, c + 1)):
                     moves.append(Move((r, c), (r, c - 2), self.board, False, False, (False, True)))
                     # print("Castle Queen side possible")
 
@@ -515,8 +726,8 @@ class GameState:
         # 4th part of the FEN
         en_passant_target = fen_split[3]
 
-        # 5th part of the FEN
-        move_rule_count = fen_split[4]
+        # 5th part of the FEN, missing from the EPD positions where the operations follow the 4th part
+        move_rule_count = fen_split[4] if len(fen_split) > 4 and fen_split[4].isdigit() else '0'
 
         return board, king_position, white_to_move, can_oo, can_ooo, en_passant_target, move_rule_count
 
@@ -548,6 +759,9 @@ class GameState:
 
         # 4th part of the FEN
         fen_en_passant = '-'
+        en_passant_file = self.get_en_passant_file()
+        if en_passant_file is not None:
+            fen_en_passant = Move.colsToFiles[en_passant_file] + ('6' if self.whiteToMove else '3')
 
         # 5th part of the FEN
         fen_half_move_count = str(self.moveRuleCount)
@@ -559,13 +773,18 @@ class GameState:
         # print(f"{fen_string}")
         return fen_string
 
-    def get_moves_notation_from_log(self):
+    def get_moves_notation_from_log(self, first_move_number=1):
         moves_notation = ''
-        move_number = 0
+        move_number = first_move_number - 1
+        # black played first when the game started from a position with black to move
+        black_first = self.whiteToMove == (len(self.notationMoveLog) % 2 == 1)
+        if black_first and self.notationMoveLog:
+            move_number += 1
+            moves_notation += f"{move_number}... "
 
         for i in range(len(self.notationMoveLog)):
             notation = self.notationMoveLog[i]
-            if i % 2 == 0:
+            if (i + black_first) % 2 == 0:
                 move_number += 1
                 moves_notation += f"{move_number}. "
             moves_notation += f"{notation} "
@@ -581,76 +800,28 @@ class GameState:
         piece_moved_row = last_move.endRow
         piece_moved_col = last_move.endCol
 
-        if self.whiteToMove:
-            sign_direction = -1
-            king_position = self.kingPosition[0]
-        else:
-            sign_direction = 1
-            king_position = self.kingPosition[1]
-
+        king_square = tuple(self.kingPosition[0] if self.whiteToMove else self.kingPosition[1])
         match piece_moved[1]:
             case "P":
-                if king_position[0] == piece_moved_row - 1 * sign_direction:
-                    if abs(king_position[1] - piece_moved_col) == 1:
-                        print(f"King in check by {piece_moved}")
-                        return True
-            case "R":
-                directions = [(-1, 0), (0, 1), (1, 0), (0, -1)]
-                for direction in directions:
-                    for i in range(1, 8):
-                        new_row = piece_moved_row + direction[0] * i
-                        new_col = piece_moved_col + direction[1] * i
-                        if 0 <= new_row <= 7 and 0 <= new_col <= 7:
-                            new_piece = self.board[new_row][new_col]
-                            if new_piece != "--":
-                                if new_row == king_position[0] and new_col == king_position[1]:
-                                    print(f"King in check by {piece_moved}")
-                                    return True
-                                else:
-                                    break
-                        else:
-                            break
+                targets = PAWN_ATTACKS[piece_moved[0]][piece_moved_row][piece_moved_col]
             case "N":
-                directions = [(-2, 1), (-1, 2), (1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1)]
-                for direction in directions:
-                    if king_position[0] == piece_moved_row + direction[0] and \
-                            king_position[1] == piece_moved_col + direction[1]:
-                        print(f"King in check by {piece_moved}")
-                        return True
-            case "B":
-                directions = [(-1, 1), (1, 1), (1, -1), (-1, -1)]
-                for direction in directions:
-                    for i in range(1, 8):
-                        new_row = piece_moved_row + direction[0] * i
-                        new_col = piece_moved_col + direction[1] * i
-                        if 0 <= new_row <= 7 and 0 <= new_col <= 7:
-                            new_piece = self.board[new_row][new_col]
-                            if new_piece != "--":
-                                if new_row == king_position[0] and new_col == king_position[1]:
-                                    print(f"King in check by {piece_moved}")
-                                    return True
-                                else:
-                                    break
-                        else:
+                targets = KNIGHT_TARGETS[piece_moved_row][piece_moved_col]
+            case "R" | "B" | "Q":
+                rays = {"R": ROOK_RAYS, "B": BISHOP_RAYS, "Q": QUEEN_RAYS}[piece_moved[1]][piece_moved_row][piece_moved_col]
+                for ray in rays:
+                    for new_row, new_col in ray:
+                        if self.board[new_row][new_col] != "--":
+                            if (new_row, new_col) == king_square:
+                                print(f"King in check by {piece_moved}")
+                                return True
                             break
-            case "Q":
-                directions = [(-1, 0), (0, 1), (1, 0), (0, -1), (-1, 1), (1, 1), (1, -1), (-1, -1)]
-                for direction in directions:
-                    for i in range(1, 8):
-                        new_row = piece_moved_row + direction[0] * i
-                        new_col = piece_moved_col + direction[1] * i
-                        if 0 <= new_row <= 7 and 0 <= new_col <= 7:
-                            new_piece = self.board[new_row][new_col]
-                            if new_piece != "--":
-                                if new_row == king_position[0] and new_col == king_position[1]:
-                                    print(f"King in check by {piece_moved}")
-                                    return True
-                                else:
-                                    break
-                        else:
-                            break
-            case "K":
-                pass  # should never happen
+                return False
+            case _:
+                return False  # "K" should never happen
+
+        if king_square in targets:
+            print(f"King in check by {piece_moved}")
+            return True
 
         return False
 
@@ -675,12 +846,15 @@ class GameState:
 
 
 class Move:
+    __slots__ = ('startRow', 'startCol', 'endRow', 'endCol', 'pieceMoved', 'pieceCaptured', 'isEnPassant', 'isPromotion',
+                 'promotionPiece', 'isCastling_OO', 'isCastling_OOO', 'moveID')
     ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4, "5": 3, "6": 2, "7": 1, "8": 0}
     rowsToRanks = {v: k for k, v in ranksToRows.items()}
     filesToCols = {"a": 0, "b": 1, "c": 2, "d": 3, "e": 4, "f": 5, "g": 6, "h": 7}
     colsToFiles = {v: k for k, v in filesToCols.items()}
 
-    def __init__(self, start_square, end_square, board, is_promotion=False, is_en_passant=False, is_castling=(False, False)):
+    def __init__(self, start_square, end_square, board, is_promotion=False, is_en_passant=False, is_castling=(False, False),
+                 promotion_piece='Q'):
         self.startRow = start_square[0]
         self.startCol = start_square[1]
         self.endRow = end_square[0]
@@ -689,23 +863,44 @@ class Move:
         self.pieceCaptured = board[self.endRow][self.endCol]
         self.isEnPassant = is_en_passant
         self.isPromotion = is_promotion
+        self.promotionPiece = promotion_piece
         self.isCastling_OO = is_castling[0]
         self.isCastling_OOO = is_castling[1]
-        self.isChecking = False
-        self.isMating = False
-        self.isStaleMating = False
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
+        # packed as start square | end square << 6 | promotion piece index << 12, a queen promotion has the same id
+        # as the plain move between the two squares
+        self.moveID = self.startRow * 8 + self.startCol | (self.endRow * 8 + self.endCol) << 6
+        if is_promotion:
+            self.moveID |= PROMOTION_PIECES.index(promotion_piece) << 12
         if is_en_passant:
             self.pieceCaptured = board[self.startRow][self.endCol]
 
+    @staticmethod
+    def get_start_square_from_id(move_id):
+        return divmod(move_id & 63, 8)
+
+    @staticmethod
+    def get_end_square_from_id(move_id):
+        return divmod(move_id >> 6 & 63, 8)
+
+    @staticmethod
+    def get_promotion_piece_from_id(move_id):
+        return PROMOTION_PIECES[move_id >> 12]
+
     def __eq__(self, other):
         if isinstance(other, Move):
             return self.moveID == other.moveID
         return False
 
+    def __hash__(self):
+        return self.moveID
+
     def get_basic_chess_notation(self):
         return self.get_rank_file(self.startRow, self.startCol) + self.get_rank_file(self.endRow, self.endCol)
 
+    def get_uci_notation(self):
+        promotion_suffix = self.promotionPiece.lower() if self.isPromotion else ""
+        return self.get_basic_chess_notation() + promotion_suffix
+
     def get_rank_file(self, r, c):
         return self.colsToFiles[c] + self.rowsToRanks[r]
 
@@ -723,8 +918,8 @@ class Move:
                 if captured == "x":
                     captured = end_coordinate[0] + captured
             end_coordinate = end_coordinate[2:]
-            promotion_suffix = "=Q" if self.isPromotion else ""
-            if move_from == "":
+            promotion_suffix = "=" + self.promotionPiece if self.isPromotion else ""
+            if move_from == "" or piece == "":  # a pawn capture already starts with its file
                 move_from_suffix = ""
             else:
                 if move_from[0] == "r":
@@ -734,3 +929,6 @@ class Move:
                     col = int(move_from[2])
                     move_from_suffix: str = self.colsToFiles[col]
             return piece + move_from_suffix + captured + end_coordinate + promotion_suffix
+
+
+NULL_MOVE = Move((0, 0), (0, 0), [["--"]])  # logged by make_null_move, it moves & captures nothing
@@ -0,0 +1,119 @@
+import argparse
+import sys
+from Chess import ChessAI
+from Chess import ChessEngine
+
+# Positions are encoded as 64 int8 piece codes indexed by row * 8 + col, so that a batch of positions is scored by a
+# single gather & sum over the piece-square tables of ChessAI stacked into one (piece code, square) tensor
+PIECES = ['--', 'wP', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bP', 'bN', 'bB', 'bR', 'bQ', 'bK']
+PIECE_CODES = {piece: code for code, piece in enumerate(PIECES)}
+FEN_CODES = {fen_char: PIECE_CODES[piece] for piece, fen_char in ChessEngine.GameState.PiecesToFEN.items()}
+BATCH_SIZE = 4096  # positions scored per call when scoring a stream of positions
+
+# numpy is only needed by this module, it is imported by load_numpy the first time a position is encoded or scored
+np = None
+PIECE_SQUARE_TENSOR = None
+SQUARES = None
+
+
+def load_numpy():
+    global np, PIECE_SQUARE_TENSOR, SQUARES
+    if np is not None:
+        return
+    try:
+        import numpy
+    except ImportError as error:
+        raise ImportError("ChessEvaluation needs numpy, install it with: pip install numpy") from error
+    PIECE_SQUARE_TENSOR = numpy.array([ChessAI.PIECE_SQUARE_VALUES[piece] for piece in PIECES], dtype=numpy.int32)
+    SQUARES = numpy.arange(64)
+    np = numpy
+
+
+def encode_board(board):
+    load_numpy()
+    return np.fromiter((PIECE_CODES[piece] for row in board for piece in row), dtype=np.int8, count=64)
+
+
+def encode_fen(fen):
+    load_numpy()
+    encoded = np.zeros(64, dtype=np.int8)
+    square = 0
+    for char in fen.split(maxsplit=1)[0]:
+        if char.isdigit():
+            square += int(char)
+        elif char != '/':
+            encoded[square] = FEN_CODES[char]
+            square += 1
+    return encoded
+
+
+def encode_move(encoded, move):
+    # encoding of the position after the move, from the encoding of the position before it
+    child = encoded.copy()
+    start_square = move.startRow * 8 + move.startCol
+    end_square = move.endRow * 8 + move.endCol
+    child[start_square] = 0
+    child[end_square] = PIECE_CODES[move.pieceMoved[0] + move.promotionPiece if move.isPromotion else move.pieceMoved]
+    if move.isEnPassant:
+        child[move.startRow * 8 + move.endCol] = 0
+    if move.isCastling_OO:
+        child[end_square + 1] = 0
+        child[end_square - 1] = PIECE_CODES[move.pieceMoved[0] + 'R']
+    if move.isCastling_OOO:
+        child[end_square - 2] = 0
+        child[end_square + 1] = PIECE_CODES[move.pieceMoved[0] + 'R']
+    return child
+
+
+def score_batch(encoded_batch):
+    # scores from white's point of view of a (positions, 64) array of encoded positions, same as
+    # ChessAI.AIState.score_board_full
+    load_numpy()
+    return PIECE_SQUARE_TENSOR[encoded_batch, SQUARES].sum(axis=1)
+
+
+def score_children(game_state, moves=None):
+    # scores of the positions after each move, seen from the side to move, evaluated as one batch
+    load_numpy()
+    if moves is None:
+        moves = game_state.get_valid_moves()
+    if not moves:
+        return np.zeros(0, dtype=np.int32)
+    encoded = encode_board(game_state.board)
+    scores = score_batch(np.stack([encode_move(encoded, move) for move in moves]))
+    return scores if game_state.whiteToMove else -scores
+
+
+def score_fens(fens, batch_size=BATCH_SIZE):
+    # yields (FEN, score from white's point of view) of every FEN, 'batch_size' positions at a time so that any
+    # number of positions fits in memory
+    batch = []
+    for fen in fens:
+        batch.append(fen)
+        if len(batch) == batch_size:
+            yield from zip(batch, score_batch(np.stack([encode_fen(batch_fen) for batch_fen in batch])).tolist())
+            batch = []
+    if batch:
+        yield from zip(batch, score_batch(np.stack([encode_fen(batch_fen) for batch_fen in batch])).tolist())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scores a file of FENs, one per line, with the AI evaluation")
+    parser.add_argument('fens', help="FEN file, - for the standard input")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+    try:
+        load_numpy()
+    except ImportError as error:
+        parser.error(str(error))
+
+    fens_file = sys.stdin if args.fens == '-' else open(args.fens, encoding='utf-8')
+    with fens_file:
+        fens = (line.strip() for line in fens_file if line.strip() and not line.startswith('#'))
+        for fen, score in score_fens(fens, args.batch_size):
+            print(f"{score}\t{fen}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
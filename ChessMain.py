@@ -1,7 +1,9 @@
 import timeit
 import logging
+import threading
 import pygame as p
 from Chess import ChessEngine
+from Chess import ChessBitboard
 from Chess import ChessAI
 
 
@@ -20,13 +22,24 @@ POSSIBLE_MOVE_COLOR = 'palegreen4'
 STALEMATE_COLOR = 'lightslateblue'
 CHECKMATE_LOSE_COLOR = 'indianred2'  # 'lightcoral'
 CHECKMATE_WIN_COLOR = 'mediumseagreen'  # 'chartreuse3' 'lightgreen'
+THINKING_TEXT_COLOR = 'gray15'
+FONT_NAME = 'Helvetica'
+FONT_SIZE = 16
 IS_HUMAN = (False, True)  # (White, Black)
+USE_BITBOARDS = False  # bitboard move generation backend instead of the 8x8 list one
+AI_MOVE_TIME = None  # seconds per AI move, None to search at the AI fixed depth
+AI_WORKERS = ChessAI.SEARCH_WORKERS  # processes searching the AI moves in parallel
+OPENING_BOOK_FILE = None  # book compiled with ChessBook, None to search the opening moves too
+ENDGAME_TABLES_DIRECTORY = None  # tables generated with ChessEndgame, None to search the endgames too
+AI_SEARCH_MODE = ChessAI.SEARCH_NEGAMAX  # or ChessAI.SEARCH_MCTS, Monte Carlo tree search of ChessAI.MC_PATHS rollouts
+SEARCH_STATISTICS_FILE = None  # JSON-lines file the statistics of every AI search are appended to, None to not record
 
 
 def load_images():
     pieces = ['bP', 'bR', 'bN', 'bB', 'bQ', 'bK', 'wP', 'wR', 'wN', 'wB', 'wQ', 'wK']
     for piece in pieces:
-        IMAGES[piece] = p.image.load("images/" + piece + ".png")
+        image = p.image.load("images/" + piece + ".png").convert_alpha()  # same pixel format as the screen
+        IMAGES[piece] = p.transform.smoothscale(image, (int(SQ_SIZE), int(SQ_SIZE)))
 
 
 def main():
@@ -35,25 +48,41 @@ def main():
     screen = p.display.set_mode((WIDTH, HEIGHT))
     clock = p.time.Clock()
     screen.fill(p.Color('white'))
+    font = p.font.SysFont(FONT_NAME, FONT_SIZE)
     load_images()
-    gs = ChessEngine.GameState()
+    board_view = BoardView(screen, font)
+    gs = ChessBitboard.GameState() if USE_BITBOARDS else ChessEngine.GameState()
 
     running = True
     is_human_player = (IS_HUMAN[0], IS_HUMAN[1])
-    white_ai = ChessAI.AIState() if not IS_HUMAN[0] else None
-    black_ai = ChessAI.AIState() if not IS_HUMAN[1] else None
+    white_ai = ChessAI.AIState(workers=AI_WORKERS, book_path=OPENING_BOOK_FILE, endgame_path=ENDGAME_TABLES_DIRECTORY,
+                               statistics_path=SEARCH_STATISTICS_FILE,
+                               search_mode=AI_SEARCH_MODE) if not IS_HUMAN[0] else None
+    black_ai = ChessAI.AIState(workers=AI_WORKERS, book_path=OPENING_BOOK_FILE, endgame_path=ENDGAME_TABLES_DIRECTORY,
+                               statistics_path=SEARCH_STATISTICS_FILE,
+                               search_mode=AI_SEARCH_MODE) if not IS_HUMAN[1] else None
     game_over = False
     valid_moves = gs.get_valid_moves()
     move_made = False
     sq_selected = ()
     player_clicks = []
+    # the AI searches a copy of the game on a background thread, the window keeps being drawn meanwhile
+    ai_thread = None
+    current_turn_ai = None
+    start_time = 0
     while running:
         for e in p.event.get():
             if e.type == p.QUIT:
                 running = False
 
+            elif e.type == p.VIDEOEXPOSE:  # the window content was lost
+                board_view.invalidate()
+
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_z:
+                    if ai_thread is not None:
+                        cancel_ai_search(current_turn_ai, ai_thread)
+                        ai_thread = None
                     game_over = False
                     gs.isStaleMate = False
                     gs.isCheckMate = False
@@ -100,111 +129,182 @@ def main():
                             sq_selected = gs.selectedSquare
 
         if not move_made and not game_over and not is_human_player[1 - gs.whiteToMove]:
-            start_time = timeit.default_timer()
-            current_turn_ai = white_ai if gs.whiteToMove else black_ai
-
-            total_possible_moves = current_turn_ai.count_all_moves_at_depth(gs, current_turn_ai.depth)
-            print(f'total possible moves : {total_possible_moves}')
-
-            current_turn_ai.start_search(gs)
-            ai_move = current_turn_ai.chosen_move
-            print(f"Time: {timeit.default_timer() - start_time}")
-            logging.debug(gs.get_fen_from_board())
-            logging.debug(f'has considered en passant : {current_turn_ai.hasConsideredEnPassant}')
-            gs.make_move(ai_move, valid_moves)
-            move_made = True
+            if ai_thread is None:
+                start_time = timeit.default_timer()
+                current_turn_ai = white_ai if gs.whiteToMove else black_ai
+                ai_thread = threading.Thread(target=current_turn_ai.start_search,
+                                             args=(copy_game_state(gs), AI_MOVE_TIME), daemon=True)
+                ai_thread.start()
+            elif not ai_thread.is_alive():
+                ai_thread = None
+                # the chosen move belongs to the copy, the same move of this game is played. A search stopped before
+                # its first iteration completed has no move, it is started again on the next frame
+                chosen_move = current_turn_ai.chosen_move
+                ai_move = None if chosen_move is None else \
+                    next((move for move in valid_moves if move.moveID == chosen_move.moveID), None)
+                if ai_move is not None:
+                    gs.make_move(ai_move, valid_moves)
+                    move_made = True
 
         if move_made:
             move_made = False
             valid_moves = gs.get_valid_moves()
             game_over = gs.isCheckMate or gs.isStaleMate
-            if len(gs.notationMoveLog) > 0:
-                logging.debug(gs.notationMoveLog[-1])
-                logging.debug(f'castling rights : {gs.castlingRightsLog[-1]}')
-                logging.debug(f'kings position : {gs.kingPosition}')
             if game_over:
                 moves_notation = gs.get_moves_notation_from_log()
                 print(f"{moves_notation}")
+                logging.debug(gs.get_fen_from_board())
                 is_human_player = (True, True)
-            logging.debug(gs.get_fen_from_board())
 
         gs.selectedSquare = sq_selected
-        draw_game_state(screen, gs, valid_moves)
+        thinking_text = None
+        if ai_thread is not None:
+            thinking_text = f"Thinking... {current_turn_ai.nodes_count} nodes, " \
+                            f"{timeit.default_timer() - start_time:.1f} s"
+        board_view.draw(gs, valid_moves, thinking_text)
 
         clock.tick(MAX_FPS)
-        p.display.flip()
 
+    if ai_thread is not None:
+        cancel_ai_search(current_turn_ai, ai_thread)
+    for ai in (white_ai, black_ai):
+        if ai is not None:
+            ai.close()
+
+
+def copy_game_state(gs):
+    # replayed from the starting position, so that the copy has the same move log
+    gs_copy = type(gs)(gs.FEN)
+    for move in gs.moveLog:
+        gs_copy.make_move(move)
+    return gs_copy
+
+
+def cancel_ai_search(ai, ai_thread):
+    ai.stop()
+    ai_thread.join()
+    ai.stop_requested = False  # in case the search had already returned
+
+
+class BoardView:
+    # Draws the game square by square: the board & the sprites are rendered once, the move markers once per
+    # selection, and each frame only the squares whose content changed are drawn & sent to the display
+    def __init__(self, screen, font):
+        self.screen = screen
+        self.font = font
+        self.board_surface = render_board()
+        self.marker_surfaces = render_markers()
+        self.square_contents = [None] * (DIMENSION * DIMENSION)  # as drawn on the screen, None to redraw
+        self.selection = None  # (selected square, valid moves) the markers were computed for
+        self.markers = {}  # (row, col): marker name
+        self.text_rect = None
+
+    def invalidate(self):
+        self.square_contents = [None] * (DIMENSION * DIMENSION)
+
+    def draw(self, gs, valid_moves, text=None):
+        if self.selection is None or self.selection[0] != gs.selectedSquare or self.selection[1] is not valid_moves:
+            self.selection = (gs.selectedSquare, valid_moves)
+            self.markers = get_move_markers(gs.selectedSquare, valid_moves)
+        if self.text_rect is not None:  # the squares under the text are drawn again
+            self.invalidate_area(self.text_rect)
+        highlights = get_highlight_colors(gs)
+
+        dirty_rects = []
+        for r in range(DIMENSION):
+            for c in range(DIMENSION):
+                content = (highlights.get((r, c)), self.markers.get((r, c)), gs.board[r][c])
+                if content != self.square_contents[r * DIMENSION + c]:
+                    self.square_contents[r * DIMENSION + c] = content
+                    dirty_rects.append(self.draw_square(r, c, content))
 
-def draw_game_state(screen, gs, valid_moves):
-    draw_board(screen)
-    draw_highlighted_squares(screen, gs, valid_moves)
-    draw_piece(screen, gs.board)
+        if text is not None:
+            text_surface = self.font.render(text, True, p.Color(THINKING_TEXT_COLOR))
+            self.text_rect = self.screen.blit(text_surface, (4, HEIGHT - text_surface.get_height() - 4))
+            dirty_rects.append(self.text_rect)
+        else:
+            self.text_rect = None
+        if dirty_rects:
+            p.display.update(dirty_rects)
 
+    def invalidate_area(self, rect):
+        for r in range(int(rect.top // SQ_SIZE), min(DIMENSION, int(rect.bottom // SQ_SIZE) + 1)):
+            for c in range(int(rect.left // SQ_SIZE), min(DIMENSION, int(rect.right // SQ_SIZE) + 1)):
+                self.square_contents[r * DIMENSION + c] = None
 
-def draw_board(screen):
+    def draw_square(self, r, c, content):
+        highlight_color, marker, piece = content
+        square_rect = p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        if highlight_color is None:
+            self.screen.blit(self.board_surface, square_rect, square_rect)
+        else:
+            p.draw.rect(self.screen, highlight_color, square_rect)
+        if marker is not None:
+            self.screen.blit(self.marker_surfaces[marker], square_rect)
+        if piece != "--":
+            self.screen.blit(IMAGES[piece], square_rect)
+        return square_rect
+
+
+def render_board():
+    board_surface = p.Surface((WIDTH, HEIGHT)).convert()
     colors = [p.Color(LIGHT_SQ_COLOR), p.Color(DARK_SQ_COLOR)]
     for r in range(DIMENSION):
         for c in range(DIMENSION):
             color = colors[(r+c) % 2]
-            p.draw.rect(screen, color, p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
+            p.draw.rect(board_surface, color, p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
+    return board_surface
+
+
+def render_markers():
+    # transparent square sized overlays: a dot on the empty target squares, corners around the captured pieces
+    size = int(SQ_SIZE)
+    dot = p.Surface((size, size), p.SRCALPHA)
+    p.draw.circle(dot, POSSIBLE_MOVE_COLOR, (SQ_SIZE/2, SQ_SIZE/2), SQ_SIZE/10)
+    corners = p.Surface((size, size), p.SRCALPHA)
+    for c in range(2):
+        for r in range(2):
+            p.draw.polygon(corners, POSSIBLE_MOVE_COLOR,
+                           points=[(c * SQ_SIZE, r * SQ_SIZE),
+                                   (c * SQ_SIZE + (1 - 2 * c) * SQ_SIZE / 5, r * SQ_SIZE),
+                                   (c * SQ_SIZE, r * SQ_SIZE + (1 - 2 * r) * SQ_SIZE / 5)])
+    return {'dot': dot, 'corners': corners}
+
+
+def get_move_markers(selected_square, valid_moves):
+    markers = {}
+    if selected_square != ():
+        for move in valid_moves:
+            if move.startRow == selected_square[0] and move.startCol == selected_square[1]:
+                markers[(move.endRow, move.endCol)] = 'dot' if move.pieceCaptured == "--" else 'corners'
+    return markers
 
 
-def draw_highlighted_squares(screen, gs, valid_moves):
+def get_highlight_colors(gs):
+    # (row, col): color of the squares drawn in another color than the board's, the later ones win
+    highlights = {}
     # Previous move highlighting
     if len(gs.moveLog) != 0:
-        colors_moved = [p.Color(LIGHT_SQ_MOVED_COLOR), p.Color(DARK_SQ_MOVED_COLOR)]
+        colors_moved = [LIGHT_SQ_MOVED_COLOR, DARK_SQ_MOVED_COLOR]
         last_move = gs.moveLog[-1]
-        start_row = last_move.startRow
-        start_col = last_move.startCol
-        end_row = last_move.endRow
-        end_col = last_move.endCol
-        p.draw.rect(screen, colors_moved[(start_row+start_col) % 2],
-                    p.Rect(start_col * SQ_SIZE, start_row * SQ_SIZE, SQ_SIZE, SQ_SIZE))
-        p.draw.rect(screen, colors_moved[(end_row+end_col) % 2],
-                    p.Rect(end_col * SQ_SIZE, end_row * SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
-    # Possible move highlighting
+        for row, col in ((last_move.startRow, last_move.startCol), (last_move.endRow, last_move.endCol)):
+            highlights[(row, col)] = colors_moved[(row + col) % 2]
+
+    # Selected piece highlighting
     if gs.selectedSquare != ():
-        colors_selected = [p.Color(LIGHT_SQ_SELECTED_COLOR), p.Color(DARK_SQ_SELECTED_COLOR)]
-        selected_row = gs.selectedSquare[0]
-        selected_col = gs.selectedSquare[1]
-        p.draw.rect(screen, colors_selected[(selected_row + selected_col) % 2],
-                    p.Rect(selected_col * SQ_SIZE, selected_row * SQ_SIZE, SQ_SIZE, SQ_SIZE))
-        for move in valid_moves:
-            if move.startRow == selected_row and move.startCol == selected_col:
-                possible_row = move.endRow
-                possible_col = move.endCol
-                if move.pieceCaptured == "--":
-                    p.draw.circle(screen, POSSIBLE_MOVE_COLOR,
-                                  (possible_col * SQ_SIZE + SQ_SIZE/2, possible_row * SQ_SIZE + SQ_SIZE/2), SQ_SIZE/10)
-                else:
-                    for c in range(2):
-                        for r in range(2):
-                            p.draw.polygon(screen, POSSIBLE_MOVE_COLOR,
-                                           points=[((possible_col + c) * SQ_SIZE, (possible_row + r) * SQ_SIZE),
-                                                   ((possible_col + c) * SQ_SIZE + (1 - 2 * c) * SQ_SIZE / 5, (possible_row + r) * SQ_SIZE),
-                                                   ((possible_col + c) * SQ_SIZE, (possible_row + r) * SQ_SIZE + (1 - 2 * r) * SQ_SIZE / 5)])
+        colors_selected = [LIGHT_SQ_SELECTED_COLOR, DARK_SQ_SELECTED_COLOR]
+        selected_row, selected_col = gs.selectedSquare
+        highlights[(selected_row, selected_col)] = colors_selected[(selected_row + selected_col) % 2]
 
     # CheckMate and stalemate highlighting
     kings = gs.kingPosition
     if gs.isCheckMate:
-        p.draw.rect(screen, CHECKMATE_LOSE_COLOR,
-                    p.Rect(kings[1 - gs.whiteToMove][1] * SQ_SIZE, kings[1 - gs.whiteToMove][0] * SQ_SIZE, SQ_SIZE, SQ_SIZE))
-        p.draw.rect(screen, CHECKMATE_WIN_COLOR,
-                    p.Rect(kings[gs.whiteToMove][1] * SQ_SIZE, kings[gs.whiteToMove][0] * SQ_SIZE, SQ_SIZE, SQ_SIZE))
+        highlights[tuple(kings[1 - gs.whiteToMove])] = CHECKMATE_LOSE_COLOR
+        highlights[tuple(kings[gs.whiteToMove])] = CHECKMATE_WIN_COLOR
     if gs.isStaleMate:
-        p.draw.rect(screen, STALEMATE_COLOR,
-                    p.Rect(kings[1 - gs.whiteToMove][1] * SQ_SIZE, kings[1 - gs.whiteToMove][0] * SQ_SIZE, SQ_SIZE, SQ_SIZE))
-        p.draw.rect(screen, STALEMATE_COLOR,
-                    p.Rect(kings[gs.whiteToMove][1] * SQ_SIZE, kings[gs.whiteToMove][0] * SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
-
-def draw_piece(screen, board):
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            piece = board[r][c]
-            if piece != "--":
-                screen.blit(IMAGES[piece], p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
+        highlights[tuple(kings[1 - gs.whiteToMove])] = STALEMATE_COLOR
+        highlights[tuple(kings[gs.whiteToMove])] = STALEMATE_COLOR
+    return highlights
 
 
 if __name__ == "__main__":
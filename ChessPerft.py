@@ -0,0 +1,269 @@
+import argparse
+import json
+import os
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from Chess import ChessEngine
+from Chess import ChessBitboard
+from Chess import ChessAI
+
+DEFAULT_DEPTH = 3
+HASH_MIN_DEPTH = 2  # subtrees of depth 1 are bulk counted, cheaper than a table lookup
+# (name, FEN, {depth: nodes}), from the Chess Programming Wiki perft results and Martin Sedlak's edge-case suite,
+# whose shallow counts were cross-checked between both backends
+PERFT_POSITIONS = [
+    ('initial', 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+     {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609}),
+    ('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+     {1: 48, 2: 2039, 3: 97862, 4: 4085603}),
+    ('position3', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+     {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624}),
+    ('position4', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+     {1: 6, 2: 264, 3: 9467, 4: 422333}),
+    ('position5', 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+     {1: 44, 2: 1486, 3: 62379, 4: 2103487}),
+    ('position6', 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+     {1: 46, 2: 2079, 3: 89890, 4: 3894594}),
+    ('illegal_en_passant_1', '3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1',
+     {1: 18, 2: 92, 3: 1670, 6: 1134888}),
+    ('illegal_en_passant_2', '8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1',
+     {1: 13, 2: 102, 3: 1266, 6: 1015133}),
+    ('en_passant_gives_check', '8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1',
+     {1: 15, 2: 126, 3: 1928, 6: 1440467}),
+    ('short_castling_gives_check', '5k2/8/8/8/8/8/8/4K2R w K - 0 1',
+     {1: 15, 2: 66, 3: 1198, 6: 661072}),
+    ('long_castling_gives_check', '3k4/8/8/8/8/8/8/R3K3 w Q - 0 1',
+     {1: 16, 2: 71, 3: 1286, 6: 803711}),
+    ('castling_rights', 'r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1',
+     {1: 26, 2: 1141, 3: 27826, 4: 1274206}),
+    ('castling_prevented', 'r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1',
+     {1: 44, 2: 1494, 3: 50509, 4: 1720476}),
+    ('promote_out_of_check', '2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1',
+     {1: 11, 2: 133, 3: 1442, 6: 3821001}),
+    ('discovered_check', '8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1',
+     {1: 29, 2: 165, 3: 5160, 5: 1004658}),
+    ('promote_to_give_check', '4k3/1P6/8/8/8/8/K7/8 w - - 0 1',
+     {1: 9, 2: 40, 3: 472, 6: 217342}),
+    ('underpromote_to_give_check', '8/P1k5/K7/8/8/8/8/8 w - - 0 1',
+     {1: 6, 2: 27, 3: 273, 6: 92683}),
+    ('self_stalemate', 'K1k5/8/P7/8/8/8/8/8 w - - 0 1',
+     {1: 2, 2: 6, 3: 13, 6: 2217}),
+    ('stalemate_and_checkmate_1', '8/k1P5/8/1K6/8/8/8/8 w - - 0 1',
+     {1: 10, 2: 25, 3: 268, 7: 567584}),
+    ('stalemate_and_checkmate_2', '8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1',
+     {1: 37, 2: 183, 3: 6559, 4: 23527}),
+]
+
+
+class PerftHashTable:
+    # Subtree node counts by (Zobrist key, depth), two 64-bit words per entry: the key, and count << 8 | depth
+    ENTRY_SIZE_BYTES = 16
+
+    def __init__(self, size_mb):
+        entries = max(1, size_mb * 1024 * 1024 // self.ENTRY_SIZE_BYTES)
+        self.size = 1 << (entries.bit_length() - 1)
+        self.mask = self.size - 1
+        self.keys = array('Q', bytes(8 * self.size))
+        self.values = array('Q', bytes(8 * self.size))
+        self.hits = 0
+
+    def probe(self, key, depth):
+        index = (key ^ depth * 0x9E3779B97F4A7C15) & self.mask  # the depths of a position go to different entries
+        value = self.values[index]
+        if self.keys[index] == key and value & 0xFF == depth:
+            self.hits += 1
+            return value >> 8
+        return None
+
+    def store(self, key, depth, nodes):
+        index = (key ^ depth * 0x9E3779B97F4A7C15) & self.mask
+        self.keys[index] = key
+        self.values[index] = nodes << 8 | depth
+
+
+def perft(game_state, depth, ai_state=None, hash_table=None):
+    if hash_table is not None:
+        return perft_hashed(game_state, depth, hash_table)
+    ai_state = ai_state if ai_state is not None else ChessAI.AIState(hash_size_mb=0)
+    return ai_state.count_all_moves_at_depth(game_state, depth)
+
+
+def perft_hashed(game_state, depth, hash_table):
+    if depth < HASH_MIN_DEPTH:
+        return len(game_state.get_valid_moves()) if depth == 1 else 1
+    nodes = hash_table.probe(game_state.Zobrist, depth)
+    if nodes is not None:
+        return nodes
+
+    nodes = 0
+    for move in game_state.get_valid_moves():
+        game_state.make_move(move)
+        nodes += perft_hashed(game_state, depth - 1, hash_table)
+        game_state.undo_move()
+    hash_table.store(game_state.Zobrist, depth, nodes)
+    return nodes
+
+
+def divide(game_state, depth, ai_state=None, hash_table=None):
+    ai_state = ai_state if ai_state is not None else ChessAI.AIState(hash_size_mb=0)
+    counts = {}
+    for move in game_state.get_valid_moves():
+        game_state.make_move(move)
+        counts[move.get_uci_notation()] = perft(game_state, depth - 1, ai_state, hash_table) if depth > 1 else 1
+        game_state.undo_move()
+    return counts
+
+
+# Parallel perft workers, each process keeps its own hash table between tasks
+worker_hash_table = None
+
+
+def init_perft_worker(hash_mb):
+    global worker_hash_table
+    worker_hash_table = PerftHashTable(hash_mb) if hash_mb > 0 else None
+
+
+def perft_subtree(game_state_class, fen, move_ids, depth):
+    # counts the leaves 'depth' plies below the position reached by playing 'move_ids' from 'fen'
+    start_time = time.perf_counter()
+    game_state = game_state_class(fen)
+    for move_id in move_ids:
+        start_square = ChessEngine.Move.get_start_square_from_id(move_id)
+        game_state.make_move(next(move for move in game_state.get_legal_moves(ChessEngine.GEN_ALL, start_square)
+                                  if move.moveID == move_id))
+    nodes = perft(game_state, depth, hash_table=worker_hash_table)
+    return nodes, os.getpid(), time.perf_counter() - start_time
+
+
+def get_split_paths(game_state, split_depth):
+    # (uci notation of the root move, move ids) of every line of 'split_depth' plies, shorter where the game ends
+    paths = []
+    for move in game_state.get_valid_moves():
+        if split_depth > 1:
+            game_state.make_move(move)
+            sub_paths = get_split_paths(game_state, split_depth - 1)
+            game_state.undo_move()
+            if sub_paths:
+                paths.extend((move.get_uci_notation(), [move.moveID] + move_ids) for _, move_ids in sub_paths)
+                continue
+        paths.append((move.get_uci_notation(), [move.moveID]))
+    return paths
+
+
+def parallel_divide(executor, game_state, depth, split_depth=1):
+    # fans the lines of 'split_depth' plies out to the pool, returns the counts by root move & the timing by worker
+    split_depth = max(1, min(split_depth, depth))
+    fen = game_state.get_fen_from_board()
+    paths = get_split_paths(game_state, split_depth)
+    futures = [executor.submit(perft_subtree, type(game_state), fen, move_ids, depth - len(move_ids))
+               for _, move_ids in paths]
+
+    counts = {}
+    workers = {}
+    for (root_move, _), future in zip(paths, futures):
+        nodes, pid, seconds = future.result()
+        counts[root_move] = counts.get(root_move, 0) + nodes
+        worker = workers.setdefault(pid, {'pid': pid, 'tasks': 0, 'nodes': 0, 'seconds': 0.0})
+        worker['tasks'] += 1
+        worker['nodes'] += nodes
+        worker['seconds'] += seconds
+    for worker in workers.values():
+        worker['seconds'] = round(worker['seconds'], 6)
+    return counts, sorted(workers.values(), key=lambda worker: worker['pid'])
+
+
+def run_perft(name, fen, depth, expected=None, backend='bitboard', with_divide=False, hash_table=None, executor=None,
+              split_depth=1):
+    game_state = ChessBitboard.BACKENDS[backend](fen)
+    start_time = time.perf_counter()
+    workers = None
+    if executor is not None and depth > 1:
+        divide_counts, workers = parallel_divide(executor, game_state, depth, split_depth)
+        nodes = sum(divide_counts.values())
+    elif with_divide:
+        divide_counts = divide(game_state, depth, hash_table=hash_table)
+        nodes = sum(divide_counts.values())
+    else:
+        divide_counts = None
+        nodes = perft(game_state, depth, hash_table=hash_table)
+    elapsed = time.perf_counter() - start_time
+
+    result = {'name': name, 'fen': fen, 'backend': backend, 'depth': depth, 'nodes': nodes, 'expected': expected,
+              'ok': None if expected is None else nodes == expected, 'seconds': round(elapsed, 6),
+              'nps': round(nodes / elapsed) if elapsed > 0 else 0}
+    if divide_counts is not None and with_divide:
+        result['divide'] = divide_counts
+    if workers is not None:
+        result['workers'] = workers
+    return result
+
+
+def print_result(result, as_json):
+    if as_json:
+        print(json.dumps(result), flush=True)
+        return
+    if 'divide' in result:
+        for move, count in sorted(result['divide'].items()):
+            print(f"{move}: {count}")
+    status = '' if result['ok'] is None else ('OK' if result['ok'] else f"FAIL (expected {result['expected']})")
+    print(f"{result['name']:<28} depth {result['depth']}  {result['nodes']:>10} nodes  {result['seconds']:8.2f} s  "
+          f"{result['nps']:>8} nps  {status}", flush=True)
+    for worker in result.get('workers', []):
+        print(f"{'':<28} worker {worker['pid']:>7}  {worker['tasks']:>5} tasks  {worker['nodes']:>10} nodes  "
+              f"{worker['seconds']:8.2f} s", flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perft move generation correctness & speed suite")
+    parser.add_argument('--backend', choices=sorted(ChessBitboard.BACKENDS), default='bitboard')
+    parser.add_argument('--depth', type=int, default=DEFAULT_DEPTH,
+                        help="maximum depth, every known count up to it is checked")
+    parser.add_argument('--position', action='append', help="name of a built-in position, can be repeated")
+    parser.add_argument('--fen', help="custom position, searched at exactly --depth")
+    parser.add_argument('--divide', action='store_true', help="break the counts down by root move")
+    parser.add_argument('--json', action='store_true', help="print one JSON object per line")
+    parser.add_argument('--workers', type=int, default=1, help="processes counting the subtrees in parallel")
+    parser.add_argument('--split-depth', type=int, default=1, choices=[1, 2],
+                        help="plies played before the subtrees are handed out to the workers")
+    parser.add_argument('--hash-mb', type=int, default=0, help="size of the subtree count table, per process")
+    args = parser.parse_args(argv)
+
+    if args.fen:
+        runs = [('custom', args.fen, args.depth, None)]
+    else:
+        positions = [position for position in PERFT_POSITIONS if not args.position or position[0] in args.position]
+        runs = [(name, fen, depth, nodes) for name, fen, counts in positions
+                for depth, nodes in sorted(counts.items()) if depth <= args.depth]
+
+    hash_table = PerftHashTable(args.hash_mb) if args.hash_mb > 0 and args.workers <= 1 else None
+    executor = ProcessPoolExecutor(max_workers=args.workers, initializer=init_perft_worker,
+                                   initargs=(args.hash_mb,)) if args.workers > 1 else None
+    total_nodes = 0
+    total_seconds = 0.0
+    failures = 0
+    try:
+        for name, fen, depth, expected in runs:
+            result = run_perft(name, fen, depth, expected, args.backend, args.divide, hash_table, executor,
+                               args.split_depth)
+            print_result(result, args.json)
+            total_nodes += result['nodes']
+            total_seconds += result['seconds']
+            failures += result['ok'] is False
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    summary = {'name': 'total', 'backend': args.backend, 'runs': len(runs), 'failures': failures, 'nodes': total_nodes,
+               'seconds': round(total_seconds, 6), 'nps': round(total_nodes / total_seconds) if total_seconds > 0 else 0}
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        print(f"{len(runs)} runs, {failures} failures, {total_nodes} nodes in {total_seconds:.2f} s "
+              f"({summary['nps']} nps)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+import argparse
+import os
+import sys
+import textwrap
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from Chess import ChessAI
+from Chess import ChessBitboard
+from Chess import ChessBook
+from Chess import ChessEngine
+
+DEFAULT_GAMES = 10
+MAX_PLIES = 600  # games still going on are adjourned, result '*'
+PGN_LINE_LENGTH = 79
+
+
+def read_openings(paths):
+    # one FEN per line, blank lines & lines starting with '#' are skipped
+    openings = []
+    for path in paths:
+        with open(path, encoding='utf-8') as openings_file:
+            for line in openings_file:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    openings.append(line)
+    return openings
+
+
+def play_game(backend, fen, depth, move_time, seed, hash_size_mb, book_path, endgame_path, max_plies):
+    # plays a game of the AI against itself from 'fen', returns (result, termination, notation of the moves)
+    game_state = ChessBitboard.BACKENDS[backend](fen)
+    ai_states = [ChessAI.AIState(hash_size_mb, workers=1, seed=seed, book_path=book_path, endgame_path=endgame_path)
+                 for _ in range(2)]  # white, black
+    for ai_state in ai_states:
+        ai_state.depth = min(max(depth, 1), ChessAI.MAX_DEPTH)
+
+    valid_moves = game_state.get_valid_moves()
+    while True:
+        if game_state.isCheckMate:
+            result, termination = ('0-1' if game_state.whiteToMove else '1-0'), "checkmate"
+            break
+        if game_state.isStaleMate:
+            # the engine counts the move rule in plies, not in moves of both sides
+            result, termination = '1/2-1/2', "stalemate" if not valid_moves else \
+                f"{ChessEngine.MOVES_TILL_STALEMATE} plies without capture or pawn move"
+            break
+        if len(game_state.moveLog) >= max_plies:
+            result, termination = '*', "ply limit"
+            break
+        ai_state = ai_states[0 if game_state.whiteToMove else 1]
+        ai_state.start_search(game_state, time_limit=move_time)
+        if ai_state.chosen_move is None:  # the time ran out before the first iteration completed
+            result, termination = '*', "no move"
+            break
+        game_state.make_move(ai_state.chosen_move, valid_moves)  # the valid moves disambiguate the notation
+        valid_moves = game_state.get_valid_moves()
+
+    for ai_state in ai_states:
+        ai_state.close()
+    fen_fields = fen.split()
+    first_move_number = int(fen_fields[5]) if len(fen_fields) > 5 else 1
+    return result, termination, game_state.get_moves_notation_from_log(first_move_number)
+
+
+def get_pgn(tags, moves_notation, result):
+    lines = [f'[{name} "{value}"]' for name, value in tags.items()]
+    lines.append('')
+    lines.append(textwrap.fill(moves_notation + result, PGN_LINE_LENGTH))
+    return '\n'.join(lines) + '\n\n'
+
+
+def run_self_play(output_path, openings, games=DEFAULT_GAMES, workers=1, depth=ChessAI.DEPTH, move_time=None,
+                  seed=None, backend='bitboard', hash_size_mb=ChessAI.HASH_SIZE_MB, book_path=None,
+                  endgame_path=None, max_plies=MAX_PLIES):
+    # Plays the games over a process pool, each game is appended to the PGN file as soon as it is over, in the
+    # order they finish. Game i starts from openings[i % len(openings)], with the seed 'seed + i' when seeded
+    player = f"ChessAI depth {depth}" if move_time is None else f"ChessAI {move_time} s/move"
+    date = time.strftime('%Y.%m.%d')
+    results = {'1-0': 0, '0-1': 0, '1/2-1/2': 0, '*': 0}
+    start_time = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor, open(output_path, 'w', encoding='utf-8') as pgn_file:
+        futures = {}
+        for game in range(games):
+            fen = openings[game % len(openings)]
+            game_seed = None if seed is None else seed + game
+            future = executor.submit(play_game, backend, fen, depth, move_time, game_seed, hash_size_mb, book_path,
+                                     endgame_path, max_plies)
+            futures[future] = (game + 1, fen, game_seed)
+
+        for future in as_completed(futures):
+            game_round, fen, game_seed = futures[future]
+            result, termination, moves_notation = future.result()
+            tags = {'Event': "Self-play", 'Site': "?", 'Date': date, 'Round': game_round, 'White': player,
+                    'Black': player, 'Result': result}
+            if fen != ChessBook.STARTING_FEN:
+                tags['SetUp'] = 1
+                tags['FEN'] = fen
+            tags['Termination'] = termination
+            if game_seed is not None:
+                tags['Seed'] = game_seed
+            pgn_file.write(get_pgn(tags, moves_notation, result))
+            pgn_file.flush()
+            results[result] += 1
+            print(f"Game {game_round}: {result} by {termination}, "
+                  f"{sum(results.values())}/{games} games in {time.perf_counter() - start_time:.1f} s", flush=True)
+    return results, time.perf_counter() - start_time
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless games of the AI against itself, saved as PGN")
+    parser.add_argument('--output', required=True, help="PGN file to write")
+    parser.add_argument('--games', type=int, default=DEFAULT_GAMES)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="games played at once")
+    parser.add_argument('--openings', action='append', help="file of starting FENs, one per line, can be repeated")
+    limit_group = parser.add_mutually_exclusive_group()
+    limit_group.add_argument('--depth', type=int, default=ChessAI.DEPTH, help="search depth of every move")
+    limit_group.add_argument('--move-time', type=float, help="seconds per move instead of a fixed depth")
+    parser.add_argument('--seed', type=int, help="seed of the first game, the next games use the following ones")
+    parser.add_argument('--backend', choices=sorted(ChessBitboard.BACKENDS), default='bitboard')
+    parser.add_argument('--hash-mb', type=int, default=ChessAI.HASH_SIZE_MB, help="per player")
+    parser.add_argument('--book', help="opening book compiled with ChessBook")
+    parser.add_argument('--endgame', help="directory of the tables generated with ChessEndgame")
+    parser.add_argument('--max-plies', type=int, default=MAX_PLIES)
+    args = parser.parse_args(argv)
+    if not 1 <= args.depth <= ChessAI.MAX_DEPTH:
+        parser.error(f"--depth must be between 1 and {ChessAI.MAX_DEPTH}")
+
+    openings = read_openings(args.openings) if args.openings else [ChessBook.STARTING_FEN]
+    if not openings:
+        print("No opening found")
+        return 1
+    results, seconds = run_self_play(args.output, openings, args.games, args.workers, args.depth, args.move_time,
+                                     args.seed, args.backend, args.hash_mb, args.book, args.endgame, args.max_plies)
+    print(f"+{results['1-0']} -{results['0-1']} ={results['1/2-1/2']} *{results['*']} (white's view), "
+          f"{sum(results.values()) * 3600 / seconds:.0f} games/hour")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
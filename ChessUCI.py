@@ -0,0 +1,261 @@
+import argparse
+import os
+import sys
+import threading
+import time
+from Chess import ChessAI
+from Chess import ChessBitboard
+from Chess import ChessBook
+
+ENGINE_NAME = "da0ud Chess"
+ENGINE_AUTHOR = "da0ud"
+MAX_HASH_MB = 1024
+MAX_THREADS = 64
+READ_SIZE = 4096
+# name: (UCI type, default, minimum, maximum), strings are empty when unset
+OPTIONS = {
+    'Hash': ('spin', ChessAI.HASH_SIZE_MB, 1, MAX_HASH_MB),
+    'Threads': ('spin', ChessAI.SEARCH_WORKERS, 1, MAX_THREADS),
+    'Ponder': ('check', False, None, None),
+    'BookFile': ('string', '', None, None),
+    'EndgamePath': ('string', '', None, None),
+}
+
+
+class UCIEngine:
+    # Reads the commands on the calling thread while the search runs on a worker thread, so that 'stop',
+    # 'ponderhit' & 'isready' are answered during the search
+    def __init__(self, game_state_class=ChessBitboard.GameState, output=sys.stdout):
+        self.game_state_class = game_state_class
+        self.output = output
+        self.output_lock = threading.Lock()
+        self.options = {name: option[1] for name, option in OPTIONS.items()}
+        self.ai_state = None  # created on the first search, and again after an option change
+        self.game_state = game_state_class(ChessBook.STARTING_FEN)
+        self.search_thread = None
+        self.search_start_time = 0.0
+        # set once the best move may be sent: right away for a normal search, on 'stop' or 'ponderhit' for an
+        # infinite or ponder search, which must not end by itself
+        self.release = threading.Event()
+        self.ponder_time_limit = None
+        self.stop_timer = None
+
+    def send(self, line):
+        with self.output_lock:
+            print(line, file=self.output, flush=True)
+
+    def run(self, lines):
+        for line in lines:
+            if not self.handle_command(line):
+                break
+        self.stop_search()
+        if self.ai_state is not None:
+            self.ai_state.close()
+
+    def handle_command(self, line):
+        # returns False on 'quit'
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, arguments = tokens[0], tokens[1:]
+        if command == 'uci':
+            self.send(f"id name {ENGINE_NAME}")
+            self.send(f"id author {ENGINE_AUTHOR}")
+            for name, (option_type, default, minimum, maximum) in OPTIONS.items():
+                if option_type == 'spin':
+                    self.send(f"option name {name} type spin default {default} min {minimum} max {maximum}")
+                elif option_type == 'check':
+                    self.send(f"option name {name} type check default {str(default).lower()}")
+                else:
+                    self.send(f"option name {name} type string default {default or '<empty>'}")
+            self.send("uciok")
+        elif command == 'isready':
+            self.send("readyok")
+        elif command == 'setoption':
+            self.stop_search()
+            self.set_option(arguments)
+        elif command == 'ucinewgame':
+            self.stop_search()
+            if self.ai_state is not None:
+                self.ai_state.transposition_table.clear()
+                self.ai_state.new_move_ordering(keep_history=False)
+        elif command == 'position':
+            self.stop_search()
+            self.set_position(arguments)
+        elif command == 'go':
+            self.stop_search()
+            self.go(arguments)
+        elif command == 'stop':
+            if self.ai_state is not None:
+                self.ai_state.stop()
+            self.release.set()
+        elif command == 'ponderhit':
+            if self.ponder_time_limit is not None:  # the search goes on as a normal one, on the clock from now
+                self.stop_timer = threading.Timer(self.ponder_time_limit, self.ai_state.stop)
+                self.stop_timer.start()
+            self.release.set()
+        elif command == 'quit':
+            return False
+        return True
+
+    def set_option(self, arguments):
+        # setoption name <name> [value <value>], names & values may contain spaces
+        if 'name' not in arguments:
+            return
+        value_index = arguments.index('value') if 'value' in arguments else len(arguments)
+        name = ' '.join(arguments[arguments.index('name') + 1:value_index])
+        value = ' '.join(arguments[value_index + 1:])
+        option = next((option for option in OPTIONS if option.lower() == name.lower()), None)
+        if option is None:
+            self.send(f"info string unknown option {name}")
+            return
+        option_type, _, minimum, maximum = OPTIONS[option]
+        if option_type == 'spin':
+            try:
+                self.options[option] = max(minimum, min(int(value), maximum))
+            except ValueError:
+                self.send(f"info string invalid value {value} for {option}")
+                return
+        elif option_type == 'check':
+            self.options[option] = value.lower() == 'true'
+        else:
+            self.options[option] = '' if value == '<empty>' else value
+        if option != 'Ponder' and self.ai_state is not None:
+            self.ai_state.close()
+            self.ai_state = None
+
+    def get_ai_state(self):
+        if self.ai_state is None:
+            self.ai_state = ChessAI.AIState(self.options['Hash'], workers=self.options['Threads'],
+                                            book_path=self.options['BookFile'] or None,
+                                            endgame_path=self.options['EndgamePath'] or None)
+        return self.ai_state
+
+    def set_position(self, arguments):
+        # position (startpos | fen <fen>) [moves <move> ...], the moves in long algebraic notation
+        moves_index = arguments.index('moves') if 'moves' in arguments else len(arguments)
+        if arguments and arguments[0] == 'fen':
+            fen = ' '.join(arguments[1:moves_index])
+        else:
+            fen = ChessBook.STARTING_FEN
+        game_state = self.game_state_class(fen)
+        for uci_move in arguments[moves_index + 1:]:
+            move = next((move for move in game_state.get_valid_moves() if move.get_uci_notation() == uci_move), None)
+            if move is None:
+                self.send(f"info string illegal move {uci_move}")
+                break
+            game_state.make_move(move)
+        self.game_state = game_state
+
+    def go(self, arguments):
+        # go [ponder] [infinite] [depth <plies>] [movetime <ms>] [wtime <ms>] [btime <ms>] [winc <ms>] [binc <ms>]
+        # [movestogo <moves>]
+        limits = {}
+        for i, token in enumerate(arguments[:-1]):
+            if token in ('depth', 'movetime', 'wtime', 'btime', 'winc', 'binc', 'movestogo'):
+                try:
+                    limits[token] = int(arguments[i + 1])
+                except ValueError:
+                    pass
+        ponder = 'ponder' in arguments
+        infinite = 'infinite' in arguments
+
+        ai_state = self.get_ai_state()
+        time_limit = None
+        if 'movetime' in limits:
+            time_limit = limits['movetime'] / 1000
+        elif 'wtime' in limits or 'btime' in limits:
+            color = 'w' if self.game_state.whiteToMove else 'b'
+            remaining_time = limits.get(color + 'time', 0) / 1000
+            increment = limits.get(color + 'inc', 0) / 1000
+            time_limit = ai_state.allocate_time(remaining_time, increment,
+                                                limits.get('movestogo', ChessAI.MOVES_TO_GO))
+        ai_state.depth = min(max(limits['depth'], 1), ChessAI.MAX_DEPTH) if 'depth' in limits else ChessAI.MAX_DEPTH
+        if infinite or ponder:
+            # searched without a deadline, a ponder search gets its time limit on 'ponderhit'
+            self.ponder_time_limit = time_limit if ponder else None
+            time_limit = None
+            self.release.clear()
+        else:
+            self.ponder_time_limit = None
+            self.release.set()
+
+        ai_state.stop_requested = False
+        self.search_start_time = time.perf_counter()
+        self.search_thread = threading.Thread(target=self.search, args=(self.game_state, time_limit), daemon=True)
+        self.search_thread.start()
+
+    def search(self, game_state, time_limit):
+        ai_state = self.ai_state
+        ai_state.start_search(game_state, time_limit,
+                              on_iteration=lambda *iteration: self.send_info(game_state, *iteration))
+        self.release.wait()
+        if self.stop_timer is not None:
+            self.stop_timer.cancel()
+            self.stop_timer = None
+
+        best_move = ai_state.chosen_move
+        if ai_state.statistics.book_move:  # no search, so no score to report
+            self.send(f"info string book move {best_move.get_uci_notation()} weight {ai_state.statistics.book_weight}")
+        if best_move is None:  # the first iteration always completes, so there is no legal move
+            self.send("bestmove 0000")
+            return
+        principal_variation = ai_state.get_principal_variation(2)
+        if len(principal_variation) > 1:
+            self.send(f"bestmove {best_move.get_uci_notation()} ponder {principal_variation[1].get_uci_notation()}")
+        else:
+            self.send(f"bestmove {best_move.get_uci_notation()}")
+
+    def send_info(self, game_state, depth, score, nodes, seconds):
+        # called by the search thread after each completed iteration
+        if abs(score) > ChessAI.MATE_THRESHOLD:
+            plies = ChessAI.CHECKMATE - abs(score)
+            score_text = f"mate {(plies + 1) // 2 if score > 0 else -(plies // 2)}"
+        else:
+            score_text = f"cp {score}"
+        principal_variation = self.ai_state.get_principal_variation()
+        elapsed = time.perf_counter() - self.search_start_time
+        self.send(f"info depth {depth} score {score_text} nodes {nodes} nps {int(nodes / max(seconds, 1e-6))} "
+                  f"time {int(elapsed * 1000)} pv {' '.join(move.get_uci_notation() for move in principal_variation)}")
+
+    def stop_search(self):
+        # ends the running search, if any, once its best move has been sent
+        if self.search_thread is None:
+            return
+        if self.ai_state is not None:
+            self.ai_state.stop()
+        self.release.set()
+        self.search_thread.join()
+        self.search_thread = None
+
+
+def read_lines(file_descriptor):
+    # lines read straight from the file descriptor: a search worker process forked while sys.stdin holds its lock in
+    # readline() would deadlock when it closes its copy of sys.stdin on start-up
+    buffer = b''
+    while True:
+        data = os.read(file_descriptor, READ_SIZE)
+        if not data:
+            break
+        buffer += data
+        while b'\n' in buffer:
+            line, buffer = buffer.split(b'\n', 1)
+            yield line.decode(errors='replace')
+    if buffer:
+        yield buffer.decode(errors='replace')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="UCI engine, the commands are read from the standard input")
+    parser.add_argument('--backend', choices=sorted(ChessBitboard.BACKENDS), default='bitboard')
+    args = parser.parse_args(argv)
+
+    # the protocol owns the standard output, any other print goes to the standard error
+    engine = UCIEngine(ChessBitboard.BACKENDS[args.backend], sys.stdout)
+    sys.stdout = sys.stderr
+    engine.run(read_lines(sys.stdin.fileno()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+import contextlib
+import io
+import os
+import random
+import tempfile
+import unittest
+from Chess import ChessAI
+from Chess import ChessBitboard
+from Chess import ChessBook
+from Chess import ChessUCI
+
+PGN = '''[Event "Game 1"]
+[Result "1-0"]
+
+1. e4 e5 2. Nf3 {the main line} Nc6 3. Bb5 a6 (3... Nf6 4. O-O) 4. Ba4 Nf6 1-0
+
+[Event "Game 2"]
+[Result "0-1"]
+
+1. e4 c5 2. Nf3 d6 3. d4 cxd4 0-1
+
+[Event "Game 3"]
+[Result "1/2-1/2"]
+
+1. d4 d5 2. c4 e6 3. Nc3 Nf6 1/2-1/2
+
+[Event "Game 4"]
+[Result "*"]
+
+1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 *
+
+[Event "Game 5"]
+[Result "*"]
+
+1. e4 e5 2. Qh7 *
+'''
+
+
+class BookTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.pgn_path = os.path.join(self.directory.name, 'games.pgn')
+        self.book_path = os.path.join(self.directory.name, 'games.bin')
+        with open(self.pgn_path, 'w', encoding='utf-8') as pgn_file:
+            pgn_file.write(PGN)
+        with contextlib.redirect_stdout(io.StringIO()):  # the skipped game is reported
+            self.build_result = ChessBook.build_book([self.pgn_path], self.book_path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_build(self):
+        games, skipped_games, records = self.build_result
+        self.assertEqual((games, skipped_games), (5, 1))
+        self.assertEqual(os.path.getsize(self.book_path), records * ChessBook.RECORD.size)
+
+    def test_probe(self):
+        book = ChessBook.OpeningBook(self.book_path)
+        game_state = ChessBitboard.GameState(ChessBook.STARTING_FEN)
+        moves = {ChessBook.get_move_from_san(game_state, 'e4').moveID: 4,
+                 ChessBook.get_move_from_san(game_state, 'd4').moveID: 1}
+        self.assertEqual(dict(book.get_moves(game_state.Zobrist)), moves)
+
+        for san in ('e4', 'e5', 'Nf3', 'Nc6'):
+            game_state.make_move(ChessBook.get_move_from_san(game_state, san))
+        self.assertEqual(sorted(weight for _, weight in book.get_moves(game_state.Zobrist)), [1, 1])
+        move = book.choose_move(game_state, random.Random(1))
+        self.assertIn(move.get_uci_notation(), ('f1b5', 'f1c4'))
+
+        for san in ('Bc4', 'Bc5'):  # the end of game 4, out of book
+            game_state.make_move(ChessBook.get_move_from_san(game_state, san))
+        self.assertEqual(book.get_moves(game_state.Zobrist), [])
+        self.assertIsNone(book.choose_move(game_state, random.Random(1)))
+        book.close()
+
+    def test_empty_book(self):
+        empty_path = os.path.join(self.directory.name, 'empty.bin')
+        open(empty_path, 'wb').close()
+        book = ChessBook.OpeningBook(empty_path)
+        self.assertEqual(book.count, 0)
+        self.assertIsNone(book.choose_move(ChessBitboard.GameState(ChessBook.STARTING_FEN)))
+        book.close()
+
+    def test_search_plays_book_move(self):
+        ai_state = ChessAI.AIState(1, workers=1, seed=1, book_path=self.book_path)
+        try:
+            game_state = ChessBitboard.GameState(ChessBook.STARTING_FEN)
+            statistics = ai_state.start_search(game_state, 1)
+            self.assertTrue(statistics.book_move)
+            self.assertIsNone(statistics.score)
+            self.assertEqual(statistics.book_weight, {'e2e4': 4, 'd2d4': 1}[statistics.move])
+            self.assertEqual(statistics.move, ai_state.chosen_move.get_uci_notation())
+        finally:
+            ai_state.close()
+
+    def test_uci_book_move(self):
+        output = io.StringIO()
+        engine = ChessUCI.UCIEngine(ChessBitboard.GameState, output)
+        engine.run([f'setoption name BookFile value {self.book_path}', 'position startpos', 'go depth 2'])
+        lines = output.getvalue().splitlines()
+        self.assertFalse([line for line in lines if line.startswith('info depth')])  # no search, no score
+        self.assertRegex(lines[-2], r'^info string book move (e2e4 weight 4|d2d4 weight 1)$')
+        self.assertEqual(lines[-1], 'bestmove ' + lines[-2].split()[4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+from Chess import ChessBitboard
+from Chess import ChessEngine
+from Chess import ChessPerft
+
+MAX_DEPTH = 3  # every known count of the ChessPerft positions up to this depth is checked
+# positions with pins & checks of every kind: slider, knight, pawn & double checks, pins along rows & diagonals
+PIN_AND_CHECK_FENS = [
+    'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+    '3k4/8/8/8/8/8/r2B1K2/8 w - - 0 1',
+    '4k3/8/8/8/1b6/8/3N4/4K3 w - - 0 1',
+    '4k3/8/8/8/8/5n2/8/4K3 w - - 0 1',
+    '4k3/8/8/8/8/8/3p4/4K3 w - - 0 1',
+    '4k3/8/8/1b6/8/8/4r3/R3K2R w KQ - 0 1',
+    '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+]
+
+
+class PerftTest(unittest.TestCase):
+    def test_perft_positions(self):
+        for backend in sorted(ChessBitboard.BACKENDS):
+            for name, fen, counts in ChessPerft.PERFT_POSITIONS:
+                for depth, expected in sorted(counts.items()):
+                    if depth > MAX_DEPTH:
+                        continue
+                    with self.subTest(backend=backend, position=name, depth=depth):
+                        result = ChessPerft.run_perft(name, fen, depth, expected, backend)
+                        self.assertEqual(result['nodes'], expected)
+
+    def test_hashed_perft(self):
+        name, fen, counts = ChessPerft.PERFT_POSITIONS[1]
+        hash_table = ChessPerft.PerftHashTable(1)
+        for backend in sorted(ChessBitboard.BACKENDS):
+            with self.subTest(backend=backend):
+                result = ChessPerft.run_perft(name, fen, MAX_DEPTH, counts[MAX_DEPTH], backend, hash_table=hash_table)
+                self.assertEqual(result['nodes'], counts[MAX_DEPTH])
+
+    def test_pins_and_checks(self):
+        # both backends describe the pins & checks with the same (row, col, piece, row direction, col direction)
+        for fen in PIN_AND_CHECK_FENS:
+            with self.subTest(fen=fen):
+                mailbox = ChessEngine.GameState(fen)
+                mailbox.get_valid_moves()
+                bitboard = ChessBitboard.GameState(fen)
+                bitboard.get_valid_moves()
+                self.assertEqual(sorted(mailbox.pinnedPieces), sorted(bitboard.pinnedPieces))
+                self.assertEqual(sorted(mailbox.checkingPieces), sorted(bitboard.checkingPieces))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import io
+import unittest
+from Chess import ChessAI
+from Chess import ChessBitboard
+from Chess import ChessUCI
+
+MATE_IN_ONE_FEN = '6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1'
+
+
+class UCITest(unittest.TestCase):
+    def run_engine(self, commands, backend='bitboard'):
+        # output lines of the engine once every command is handled & the search, if any, has sent its best move
+        output = io.StringIO()
+        engine = ChessUCI.UCIEngine(ChessBitboard.BACKENDS[backend], output)
+        for command in commands:
+            engine.handle_command(command)
+        if engine.search_thread is not None:
+            engine.search_thread.join()
+        engine.run(['quit'])
+        return engine, output.getvalue().splitlines()
+
+    def test_handshake(self):
+        _, lines = self.run_engine(['uci', 'isready'])
+        self.assertEqual(lines[0], f"id name {ChessUCI.ENGINE_NAME}")
+        self.assertEqual(lines[-2:], ['uciok', 'readyok'])
+
+    def test_position_startpos_moves(self):
+        for backend in sorted(ChessBitboard.BACKENDS):
+            with self.subTest(backend=backend):
+                engine, lines = self.run_engine(['position startpos moves e2e4 e7e5 g1f3'], backend)
+                self.assertEqual(lines, [])
+                self.assertEqual(engine.game_state.get_fen_from_board(),
+                                 'rnbqkbnr/pppp1ppp/8/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R b KQkq - 1 2')
+
+    def test_position_fen(self):
+        fen = 'rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3'
+        engine, _ = self.run_engine([f'position fen {fen} moves e5f6'])
+        self.assertEqual(len(engine.game_state.moveLog), 1)
+        self.assertTrue(engine.game_state.moveLog[0].isEnPassant)
+
+    def test_illegal_move(self):
+        engine, lines = self.run_engine(['position startpos moves e2e4 e2e4'])
+        self.assertEqual(lines, ["info string illegal move e2e4"])
+        self.assertEqual(len(engine.game_state.moveLog), 1)  # the moves before the illegal one are played
+
+    def test_go_depth(self):
+        _, lines = self.run_engine([f'position fen {MATE_IN_ONE_FEN}', 'go depth 2'])
+        info_lines = [line for line in lines if line.startswith('info depth')]
+        self.assertTrue(info_lines)
+        self.assertIn('score mate 1', info_lines[-1])
+        self.assertEqual(lines[-1], 'bestmove a1a8')
+
+    def test_go_depth_beyond_max_depth(self):
+        _, lines = self.run_engine([f'position fen {MATE_IN_ONE_FEN}', f'go depth {ChessAI.MAX_DEPTH + 100}'])
+        self.assertEqual(lines[-1], 'bestmove a1a8')
+
+    def test_go_on_finished_game(self):
+        _, lines = self.run_engine(['position fen R5k1/5ppp/8/8/8/8/8/6K1 b - - 0 1', 'go depth 2'])
+        self.assertEqual(lines[-1], 'bestmove 0000')
+
+
+if __name__ == '__main__':
+    unittest.main()